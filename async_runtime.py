@@ -0,0 +1,36 @@
+# async_runtime.py
+# 在后台线程中运行一个共享的asyncio事件循环，供同步代码（流水线、调度器）提交裁判协程
+
+import asyncio
+import threading
+
+
+class BackgroundLoop:
+    """
+    后台事件循环。所有模型的裁判请求都提交到同一个循环中执行，
+    从而共享同一个异步HTTP连接池与限流器，用少量线程即可让大量请求同时在途。
+    """
+
+    def __init__(self, name="judge-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """提交协程，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro):
+        """提交协程并阻塞等待结果"""
+        return self.submit(coro).result()
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
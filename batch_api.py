@@ -0,0 +1,162 @@
+# batch_api.py
+# 离线批处理(Batch API)评估：把全部裁判请求渲染为OpenAI批处理格式的JSONL文件，
+# 提交后轮询直到完成，再把结果解析回与在线评估相同的结构。适合不关心延迟、只关心成本与吞吐的夜间回归。
+# 后端可插拔：通过 register_batch_backend 注册自定义实现，或把 base_url 指向本地的兼容服务用于测试。
+
+import os
+import json
+import time
+import logging
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATES = {'completed', 'failed', 'expired', 'cancelled'}
+
+
+class BatchBackend(ABC):
+    """批处理后端接口；缺少任一方法的实现在注册或实例化时即报错，而不是在提交批次之后"""
+
+    @abstractmethod
+    def submit(self, input_path, completion_window='24h'):
+        """上传请求文件并创建批处理任务，返回 batch_id"""
+
+    @abstractmethod
+    def status(self, batch_id):
+        """返回 (状态字符串, 进度描述)"""
+
+    @abstractmethod
+    def fetch_results(self, batch_id):
+        """返回批处理输出文件中的全部记录（包括错误文件中的记录）"""
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """OpenAI Batch API；base_url 可指向任何兼容 /v1/files 与 /v1/batches 的服务"""
+
+    def __init__(self, base_url=None, api_key=None):
+        from openai import OpenAI
+
+        self.client = OpenAI(base_url=base_url, api_key=api_key, timeout=300.0)
+
+    def submit(self, input_path, completion_window='24h'):
+        with open(input_path, 'rb') as f:
+            input_file = self.client.files.create(file=f, purpose='batch')
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint='/v1/chat/completions',
+            completion_window=completion_window,
+        )
+        return batch.id
+
+    def status(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        counts = getattr(batch, 'request_counts', None)
+        progress = f"{counts.completed}/{counts.total} 完成, {counts.failed} 失败" if counts else ""
+        return batch.status, progress
+
+    def fetch_results(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        records = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = self.client.files.content(file_id).text
+            for line in content.splitlines():
+                if line.strip():
+                    records.append(json.loads(line))
+        return records
+
+
+BATCH_BACKENDS = {
+    'openai': OpenAIBatchBackend,
+}
+
+
+def register_batch_backend(name, backend_cls):
+    """注册自定义批处理后端（BatchBackend 的子类），之后可在 config.yaml 的 batch_api.backend 中按名称使用"""
+    if not (isinstance(backend_cls, type) and issubclass(backend_cls, BatchBackend)):
+        raise TypeError(f"批处理后端 '{name}' 必须是 BatchBackend 的子类。")
+    if backend_cls.__abstractmethods__:
+        raise TypeError(f"批处理后端 '{name}' 缺少以下方法的实现: {', '.join(sorted(backend_cls.__abstractmethods__))}")
+    BATCH_BACKENDS[name] = backend_cls
+
+
+def create_batch_backend(batch_config, provider_config):
+    """根据配置创建批处理后端；未指定 base_url 时沿用裁判服务商的地址与密钥"""
+    batch_config = batch_config or {}
+    backend_name = batch_config.get('backend', 'openai')
+    if backend_name not in BATCH_BACKENDS:
+        raise ValueError(f"未知的批处理后端 '{backend_name}'，可选: {', '.join(BATCH_BACKENDS)}")
+    return BATCH_BACKENDS[backend_name](
+        base_url=batch_config.get('base_url') or provider_config.get('base_url'),
+        api_key=os.environ.get(provider_config['api_key_env']),
+    )
+
+
+def run_batch_judging(online_evaluator, task_items, backend, output_dir, poll_interval=30.0,
+                      completion_window='24h', existing_batch_id=None, on_submitted=None):
+    """
+    以批处理方式评估 task_items，返回 {题目ID: 评估结果或None}。
+    - 先查缓存，只提交未命中的题目
+    - existing_batch_id 为之前（中断前）已提交的批次，会先取回它的结果，只为剩余题目提交新批次
+    - on_submitted(batch_id) 在新批次提交后调用，用于记录到 run_meta 以便恢复
+    """
+    results = {}
+    pending = {}
+    for task_item in task_items:
+        item_id = str(task_item.get('id'))
+        cached = online_evaluator.cached_evaluation(task_item)
+        if cached is not None:
+            results[item_id] = cached
+        else:
+            pending[item_id] = task_item
+    if results:
+        logger.info(f"批处理评估：{len(results)} 道题目命中缓存。")
+
+    if existing_batch_id and pending:
+        logger.info(f"批处理评估：取回之前提交的批次 {existing_batch_id} 的结果。")
+        _wait_for_batch(backend, existing_batch_id, poll_interval)
+        _ingest_batch(online_evaluator, backend, existing_batch_id, pending, results)
+
+    if pending:
+        input_path = os.path.join(output_dir, "judge_batch_input.jsonl")
+        with open(input_path, 'w', encoding='utf-8') as f:
+            for item_id, task_item in pending.items():
+                f.write(json.dumps(online_evaluator.build_batch_request(item_id, task_item), ensure_ascii=False) + '\n')
+        batch_id = backend.submit(input_path, completion_window)
+        logger.info(f"批处理评估：已提交 {len(pending)} 个请求，批次ID: {batch_id}")
+        if on_submitted:
+            on_submitted(batch_id)
+        _wait_for_batch(backend, batch_id, poll_interval)
+        _ingest_batch(online_evaluator, backend, batch_id, pending, results)
+
+    for item_id in pending:
+        results[item_id] = None
+    return results
+
+
+def _wait_for_batch(backend, batch_id, poll_interval):
+    while True:
+        state, progress = backend.status(batch_id)
+        if state in TERMINAL_STATES:
+            logger.info(f"批次 {batch_id} 已结束，状态: {state} {progress}")
+            return state
+        logger.info(f"批次 {batch_id} 状态: {state} {progress}，{poll_interval:.0f}秒后再次查询。")
+        time.sleep(poll_interval)
+
+
+def _ingest_batch(online_evaluator, backend, batch_id, pending, results):
+    """把批次输出解析为评估结果，已解析的题目从 pending 中移除"""
+    try:
+        records = backend.fetch_results(batch_id)
+    except Exception as e:
+        logger.error(f"取回批次 {batch_id} 的结果时出错: {e}")
+        return
+    for record in records:
+        item_id = str(record.get('custom_id'))
+        if item_id not in pending:
+            continue
+        result = online_evaluator.parse_batch_output(record)
+        if result is not None:
+            online_evaluator.store_evaluation(pending.pop(item_id), result)
+            results[item_id] = result
@@ -0,0 +1,346 @@
+# benchmarks/fake_servers.py
+# 用于基准测试的本地替身服务：
+# - FakeOllama: 实现 /api/generate（流式与非流式），可配置首token延迟、生成速度、回答长度与错误率
+# - FakeJudge:  实现 OpenAI 兼容的 /v1/chat/completions（单题、批量、成对比较与总结），可配置延迟、错误率与每分钟请求上限（超出时返回429与Retry-After）
+# - FakeBatchJudge: 在 FakeJudge 的基础上实现 OpenAI Batch API (/v1/files 与 /v1/batches)，用于测试离线批处理评估模式
+# 只依赖标准库，在后台线程中运行，不需要真实的模型服务即可端到端地测量流水线吞吐。
+
+import re
+import sys
+import json
+import time
+import random
+import threading
+from collections import deque
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 从评估模板中识别评分维度，如 "accuracy": <1-10的整数>
+_SCORE_KEY = re.compile(r'"(\w+)":\s*<1-10的整数>')
+_BATCH_ITEM_ID = re.compile(r'^## 题目 ID: (\S+)', re.MULTILINE)
+# 成对比较模板中的偏好维度，如 "accuracy": "<A|B|tie>"
+_PREFERENCE_KEY = re.compile(r'"(\w+)":\s*"<A\|B\|tie>"')
+_BATCH_PATH = re.compile(r'^/v1/batches/([\w-]+)$')
+_FILE_CONTENT_PATH = re.compile(r'^/v1/files/([\w-]+)/content$')
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端关闭空闲的 keep-alive 连接属于正常情况，不打印堆栈
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+class _FakeServer:
+    """在后台线程中运行的 ThreadingHTTPServer；handler 通过 self.server.owner 访问配置"""
+
+    def __init__(self, handler_cls, host='127.0.0.1', port=0):
+        self.httpd = _QuietHTTPServer((host, port), handler_cls)
+        self.httpd.owner = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name=type(self).__name__, daemon=True)
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, error=False):
+        with self._lock:
+            self.requests += 1
+            if error:
+                self.errors += 1
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def write_chunk(self, data):
+        self.wfile.write(b'%x\r\n' % len(data) + data + b'\r\n')
+        self.wfile.flush()
+
+
+class _OllamaHandler(_JsonHandler):
+    def do_POST(self):
+        owner = self.server.owner
+        if self.path != '/api/generate':
+            self.send_json(404, {'error': 'not found'})
+            return
+        payload = self.read_json()
+        if not payload.get('prompt'):
+            # 没有 prompt 的请求用于加载/卸载模型（keep_alive 为0时卸载）
+            done_reason = 'unload' if payload.get('keep_alive') == 0 else 'load'
+            self.send_json(200, {'model': payload.get('model'), 'response': '', 'done': True, 'done_reason': done_reason})
+            return
+        if random.random() < owner.error_rate:
+            owner.count(error=True)
+            self.send_json(500, {'error': 'injected failure'})
+            return
+        owner.count()
+
+        tokens = max(1, int(random.gauss(owner.answer_tokens, owner.answer_tokens * 0.2)))
+        token_interval = 1.0 / owner.tokens_per_second if owner.tokens_per_second else 0.0
+        time.sleep(owner.first_token_latency)
+        final = {
+            'model': payload.get('model'), 'done': True,
+            'eval_count': tokens, 'eval_duration': int(tokens * token_interval * 1e9) or 1,
+            'prompt_eval_count': len(payload.get('prompt', '')) // 4,
+            'prompt_eval_duration': int(owner.first_token_latency * 1e9),
+            'load_duration': 0,
+        }
+
+        if not payload.get('stream', True):
+            time.sleep(tokens * token_interval)
+            self.send_json(200, {**final, 'response': "答" * tokens})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        # 按 chunk_tokens 个token一组发送，避免极小的写入放大基准本身的开销
+        sent = 0
+        while sent < tokens:
+            n = min(owner.chunk_tokens, tokens - sent)
+            time.sleep(n * token_interval)
+            self.write_chunk((json.dumps({'response': "答" * n, 'done': False}, ensure_ascii=False) + '\n').encode('utf-8'))
+            sent += n
+        self.write_chunk((json.dumps({**final, 'response': ''}) + '\n').encode('utf-8'))
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+
+class FakeOllama(_FakeServer):
+    def __init__(self, first_token_latency=0.05, tokens_per_second=200.0, answer_tokens=120, error_rate=0.0, chunk_tokens=8, **kwargs):
+        super().__init__(_OllamaHandler, **kwargs)
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.error_rate = error_rate
+        self.chunk_tokens = max(1, chunk_tokens)
+
+
+class _JudgeHandler(_JsonHandler):
+    def do_POST(self):
+        owner = self.server.owner
+        if self.path.rstrip('/') not in ('/v1/chat/completions', '/chat/completions'):
+            self.send_json(404, {'error': {'message': 'not found'}})
+            return
+        payload = self.read_json()
+        retry_after = owner.admit()
+        if retry_after is not None:
+            owner.count(error=True)
+            self.send_json(429, {'error': {'message': 'rate limited', 'type': 'rate_limit_exceeded'}},
+                           headers={'Retry-After': f"{retry_after:.2f}"})
+            return
+        if random.random() < owner.error_rate:
+            owner.count(error=True)
+            self.send_json(500, {'error': {'message': 'injected failure'}})
+            return
+        owner.count()
+        time.sleep(max(0.0, random.gauss(owner.latency, owner.latency * 0.1)))
+        self.send_json(200, owner.completion(payload))
+
+
+class FakeJudge(_FakeServer):
+    _handler = _JudgeHandler
+
+    def __init__(self, latency=0.3, error_rate=0.0, requests_per_minute=None, **kwargs):
+        super().__init__(self._handler, **kwargs)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests_per_minute = requests_per_minute
+        self._window = deque()
+        self.throttled = 0
+
+    def admit(self):
+        """滑动窗口限流：超出每分钟请求数时返回建议的 Retry-After 秒数"""
+        if not self.requests_per_minute:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            while self._window and now - self._window[0] > 60.0:
+                self._window.popleft()
+            if len(self._window) >= self.requests_per_minute:
+                self.throttled += 1
+                return max(0.05, 60.0 - (now - self._window[0]))
+            self._window.append(now)
+        return None
+
+    @staticmethod
+    def _verdict(keys):
+        return {
+            'scores': {key: random.randint(3, 10) for key in keys},
+            'reason': "基准测试用的模拟评分理由。",
+            'strengths': "结构清晰。",
+            'weaknesses': "细节不足。",
+        }
+
+    def completion(self, payload):
+        """对 chat.completions 请求体生成完整的响应体"""
+        prompt = payload['messages'][-1]['content']
+        content = self.respond(prompt)
+        prompt_tokens = len(prompt) // 2
+        completion_tokens = len(content) // 2
+        return {
+            'id': 'chatcmpl-fake', 'object': 'chat.completion', 'created': int(time.time()), 'model': payload.get('model'),
+            'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens},
+        }
+
+    def respond(self, prompt):
+        """按 prompt 的类型返回单题评估JSON、批量评估JSON数组、成对比较JSON或总结文本"""
+        preference_keys = [key for key in dict.fromkeys(_PREFERENCE_KEY.findall(prompt)) if key != 'winner']
+        if preference_keys:
+            return json.dumps({
+                'preferences': {key: random.choice(('A', 'B', 'tie')) for key in preference_keys},
+                'winner': random.choice(('A', 'B', 'tie')),
+                'reason': "基准测试用的模拟比较理由。",
+            }, ensure_ascii=False)
+        keys = list(dict.fromkeys(_SCORE_KEY.findall(prompt)))
+        if not keys:
+            return "## 模拟总结\n\n整体表现稳定，这是基准测试生成的总结。"
+        batch_ids = _BATCH_ITEM_ID.findall(prompt)
+        if batch_ids:
+            return json.dumps([{'id': item_id, **self._verdict(keys)} for item_id in batch_ids], ensure_ascii=False)
+        return json.dumps(self._verdict(keys), ensure_ascii=False)
+
+
+class _BatchJudgeHandler(_JudgeHandler):
+    def do_POST(self):
+        owner = self.server.owner
+        path = self.path.rstrip('/')
+        if path == '/v1/files':
+            length = int(self.headers.get('Content-Length') or 0)
+            self.send_json(200, owner.upload(self.headers.get('Content-Type', ''), self.rfile.read(length)))
+        elif path == '/v1/batches':
+            batch = owner.create_batch(self.read_json())
+            self.send_json(200 if batch else 400, batch or {'error': {'message': 'unknown input_file_id'}})
+        else:
+            super().do_POST()
+
+    def do_GET(self):
+        owner = self.server.owner
+        path = self.path.rstrip('/')
+        batch_match, content_match = _BATCH_PATH.match(path), _FILE_CONTENT_PATH.match(path)
+        if batch_match and owner.batch(batch_match.group(1)):
+            self.send_json(200, owner.batch(batch_match.group(1)))
+        elif content_match and content_match.group(1) in owner.files:
+            body = owner.files[content_match.group(1)]
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_json(404, {'error': {'message': 'not found'}})
+
+
+class FakeBatchJudge(FakeJudge):
+    """
+    OpenAI Batch API 替身：上传的请求文件在批次创建 completion_delay 秒后一次性处理完，
+    每个请求按 error_rate 写入错误文件，其余写入输出文件。chat.completions 接口与 FakeJudge 相同。
+    """
+    _handler = _BatchJudgeHandler
+
+    def __init__(self, completion_delay=0.5, **kwargs):
+        super().__init__(**kwargs)
+        self.completion_delay = completion_delay
+        self.files = {}
+        self.batches = {}
+        self.batch_requests = 0
+
+    def _add_file(self, content, filename, purpose):
+        with self._lock:
+            file_id = f"file-{len(self.files) + 1}"
+            self.files[file_id] = content
+        return {'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+                'filename': filename, 'purpose': purpose, 'status': 'processed'}
+
+    def upload(self, content_type, body):
+        """解析 multipart/form-data 上传，保存其中的 file 字段"""
+        message = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode('utf-8') + body)
+        content, filename = b'', 'input.jsonl'
+        for part in message.iter_parts():
+            if part.get_param('name', header='content-disposition') == 'file':
+                content = part.get_payload(decode=True) or b''
+                filename = part.get_filename() or filename
+        return self._add_file(content, filename, 'batch')
+
+    def create_batch(self, payload):
+        input_file_id = payload.get('input_file_id')
+        if input_file_id not in self.files:
+            return None
+        total = sum(1 for line in self.files[input_file_id].splitlines() if line.strip())
+        with self._lock:
+            batch_id = f"batch-{len(self.batches) + 1}"
+            self.batches[batch_id] = {
+                'id': batch_id, 'object': 'batch', 'endpoint': payload.get('endpoint'), 'errors': None,
+                'input_file_id': input_file_id, 'completion_window': payload.get('completion_window', '24h'),
+                'status': 'in_progress', 'output_file_id': None, 'error_file_id': None, 'created_at': int(time.time()),
+                'request_counts': {'total': total, 'completed': 0, 'failed': 0},
+                '_started': time.monotonic(),
+            }
+        return self.batch(batch_id)
+
+    def batch(self, batch_id):
+        """返回批次状态；到达 completion_delay 后先处理全部请求"""
+        batch = self.batches.get(batch_id)
+        if batch is None:
+            return None
+        if batch['status'] == 'in_progress' and time.monotonic() - batch['_started'] >= self.completion_delay:
+            self._complete(batch)
+        return {key: value for key, value in batch.items() if not key.startswith('_')}
+
+    def _complete(self, batch):
+        outputs, errors = [], []
+        for line in self.files[batch['input_file_id']].splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            failed = random.random() < self.error_rate
+            self.count(error=failed)
+            self.batch_requests += 1
+            record = {'id': f"req-{self.batch_requests}", 'custom_id': request['custom_id'], 'error': None}
+            if failed:
+                errors.append({**record, 'response': {'status_code': 500, 'body': {'error': {'message': 'injected failure'}}}})
+            else:
+                outputs.append({**record, 'response': {'status_code': 200, 'body': self.completion(request['body'])}})
+
+        def dump(records):
+            return "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode('utf-8')
+
+        batch['output_file_id'] = self._add_file(dump(outputs), 'output.jsonl', 'batch_output')['id'] if outputs else None
+        batch['error_file_id'] = self._add_file(dump(errors), 'errors.jsonl', 'batch_output')['id'] if errors else None
+        batch['request_counts'].update(completed=len(outputs), failed=len(errors))
+        batch['status'] = 'completed'
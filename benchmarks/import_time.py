@@ -0,0 +1,109 @@
+# benchmarks/import_time.py
+# 启动耗时基准：在全新的子进程中多次导入入口模块（默认 main），统计导入耗时的中位数，
+# 并检查 pandas/numpy/openai/requests/tqdm/dotenv/asyncio/sqlite3 等依赖没有在导入阶段被加载。
+# 超出启动预算 (--budget-ms) 或加载了禁止的模块时以非零状态码退出，可在 CI 中守住冒烟评估的启动速度。
+#
+# 用法（在项目根目录执行）：
+#   python benchmarks/import_time.py
+#   python benchmarks/import_time.py --budget-ms 200 --repeat 10
+#   python benchmarks/import_time.py --module main --module eval_service --forbid pandas --forbid openai
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 入口模块导入阶段不应加载的依赖：只在生成、裁判或大规模统计阶段才需要
+DEFAULT_FORBIDDEN = ('pandas', 'numpy', 'openai', 'requests', 'tqdm', 'dotenv', 'asyncio', 'sqlite3')
+
+# 子进程中执行的测量脚本：计时导入，并输出耗时与已加载的禁止模块
+_PROBE = """
+import sys, time, json
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{'seconds': elapsed, 'loaded': [name for name in {forbidden!r} if name in sys.modules]}}))
+"""
+
+
+def measure_once(module, forbidden):
+    """在全新的子进程中导入一次模块，返回 (耗时秒数, 已加载的禁止模块)"""
+    output = subprocess.run([sys.executable, '-c', _PROBE.format(module=module, forbidden=tuple(forbidden))],
+                            cwd=ROOT_DIR, capture_output=True, text=True, check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    return result['seconds'], result['loaded']
+
+
+def slowest_imports(module, top):
+    """用 python -X importtime 找出累计耗时最长的若干个依赖 [(累计微秒, 模块名)]"""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                            cwd=ROOT_DIR, capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def run(args):
+    forbidden = args.forbid or list(DEFAULT_FORBIDDEN)
+    results = {}
+    for module in args.module or ['main']:
+        timings, loaded = [], set()
+        for _ in range(args.repeat):
+            seconds, loaded_now = measure_once(module, forbidden)
+            timings.append(seconds)
+            loaded.update(loaded_now)
+        results[module] = {
+            'median_ms': round(statistics.median(timings) * 1000, 1),
+            'min_ms': round(min(timings) * 1000, 1),
+            'max_ms': round(max(timings) * 1000, 1),
+            'forbidden_loaded': sorted(loaded),
+            'slowest_imports': [{'module': name, 'cumulative_ms': round(us / 1000, 1)} for us, name in slowest_imports(module, args.top)],
+        }
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="LLM-Auto-Evaluator 启动耗时基准")
+    parser.add_argument('--module', action='append', help="要测量的入口模块，可重复指定（默认 main）")
+    parser.add_argument('--repeat', type=int, default=5, help="每个模块在全新子进程中导入的次数")
+    parser.add_argument('--budget-ms', type=float, default=300.0, help="导入耗时中位数的预算（毫秒），超出时以非零状态码退出")
+    parser.add_argument('--forbid', action='append', help=f"导入阶段不允许加载的模块，可重复指定（默认 {', '.join(DEFAULT_FORBIDDEN)}）")
+    parser.add_argument('--top', type=int, default=8, help="列出累计耗时最长的依赖数")
+    parser.add_argument('--output', help="把结果写入该JSON文件")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    results = run(args)
+    failed = []
+    for module, result in results.items():
+        print(f"\nimport {module}: 中位数 {result['median_ms']}ms (最快 {result['min_ms']}ms, 最慢 {result['max_ms']}ms, 预算 {args.budget_ms:.0f}ms)")
+        for row in result['slowest_imports']:
+            print(f"  {row['module']:<40} {row['cumulative_ms']:>8.1f}ms")
+        if result['forbidden_loaded']:
+            print(f"  导入阶段加载了较慢的依赖: {', '.join(result['forbidden_loaded'])}")
+            failed.append(module)
+        if result['median_ms'] > args.budget_ms:
+            failed.append(module)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存至: {args.output}")
+
+    if failed:
+        print(f"\n以下模块超出启动预算或加载了禁止的依赖: {', '.join(dict.fromkeys(failed))}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+# benchmarks/run_benchmark.py
+# 端到端吞吐基准：启动本地替身 Ollama 与裁判服务，用合成题库驱动 evaluate_single_model，
+# 输出 items/sec、峰值内存(RSS)与各阶段耗时，并可与之前保存的基线结果比较。
+#
+# 用法（在项目根目录执行）：
+#   python benchmarks/run_benchmark.py --rows 10k
+#   python benchmarks/run_benchmark.py --rows 10k --save-baseline benchmarks/baseline_10k.json
+#   python benchmarks/run_benchmark.py --rows 10k --baseline benchmarks/baseline_10k.json
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_servers import FakeOllama, FakeJudge, FakeBatchJudge
+
+SCENARIOS = [("通用知识", "历史"), ("通用知识", "地理"), ("代码生成", "Python"), ("文本创作", "摘要"), ("逻辑推理", "数学")]
+
+# 与基线比较的指标：(路径, 越大越好)
+COMPARED_METRICS = [
+    (('items_per_s',), True),
+    (('peak_rss_mb',), False),
+    (('wall_s',), False),
+]
+
+
+def parse_rows(value):
+    """支持 1000 / 1k / 10k / 100k 形式"""
+    value = value.strip().lower()
+    if value.endswith('k'):
+        return int(float(value[:-1]) * 1000)
+    return int(value)
+
+
+def make_question_bank(path, rows, seed=0):
+    """生成合成题库（jsonl），同一行数与种子下内容固定，便于多次运行之间比较"""
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        for index in range(rows):
+            scenario, sub_scenario = SCENARIOS[index % len(SCENARIOS)]
+            prompt = f"第{index}题：请解释以下概念并给出示例。" + "背景信息。" * rng.randint(5, 60)
+            f.write(json.dumps({
+                'id': index,
+                'scenario': scenario,
+                'sub_scenario': sub_scenario,
+                'prompt': prompt,
+                'ideal_output': "参考答案。" * rng.randint(5, 40),
+                'notes_for_evaluation': "关注准确性与完整性。",
+            }, ensure_ascii=False) + '\n')
+    return path
+
+
+def peak_rss_mb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return usage / (1024 * 1024) if sys.platform == 'darwin' else usage / 1024
+
+
+def build_config(args, work_dir, ollama_url, judge_url):
+    from main import load_config
+
+    config = load_config(args.config)
+    config['models']['ollama_models'] = [{'model_name': 'bench-model', 'base_url': ollama_url, 'options': {}}]
+    evaluator_config = config['models']['online_evaluator']
+    evaluator_config['provider'] = 'openai'
+    evaluator_config['openai'] = {**evaluator_config.get('openai', {}), 'model_name': 'bench-judge', 'base_url': f"{judge_url}/v1",
+                                  'api_key_env': 'BENCH_JUDGE_API_KEY', 'evaluation_temperature': 0.0, 'summary_temperature': 0.0}
+    os.environ.setdefault('BENCH_JUDGE_API_KEY', 'bench')
+
+    config['paths']['results_dir'] = os.path.join(work_dir, 'results')
+    config['evaluation']['task_name'] = f"bench_{args.rows}"
+    config['evaluation']['judge_mode'] = args.judge_mode
+    # 批处理模式下同一个替身服务同时提供 /v1/files 与 /v1/batches
+    config['batch_api'] = {**config.get('batch_api', {}), 'backend': 'openai', 'base_url': f"{judge_url}/v1", 'poll_interval_seconds': 0.2}
+    for key, value in (('max_workers', args.max_workers), ('ollama_max_concurrency', args.ollama_concurrency),
+                       ('judge_max_concurrency', args.judge_concurrency), ('batch_size', args.batch_size)):
+        if value is not None:
+            config['evaluation'][key] = value
+    # 替身服务不限流，默认去掉客户端的RPM/TPM限制，只测流水线本身；需要时用 --client-rpm 模拟
+    rate_limit = config['evaluation'].setdefault('judge_rate_limit', {})
+    rate_limit['requests_per_minute'] = args.client_rpm
+    rate_limit['tokens_per_minute'] = None
+    rate_limit['backoff_base_seconds'] = 0.1
+
+    config['cache'] = {**config.get('cache', {}), 'enabled': args.cache, 'path': os.path.join(work_dir, 'cache.sqlite')}
+    config.setdefault('logging', {})['trace'] = not args.no_trace
+    return config
+
+
+def run(args):
+    from main import evaluate_single_model
+    from run_logging import setup_logging
+    from progress import ProgressBoard
+    from result_cache import ResultCache
+    from async_runtime import BackgroundLoop
+    from rate_limiter import JudgeRateLimiter
+
+    setup_logging(args.log_level)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='llm_eval_bench_')
+    os.makedirs(work_dir, exist_ok=True)
+    bank_path = os.path.join(work_dir, f"questions_{args.rows}.jsonl")
+    if not os.path.exists(bank_path):
+        make_question_bank(bank_path, args.rows)
+
+    ollama = FakeOllama(first_token_latency=args.ollama_ttft, tokens_per_second=args.ollama_tps,
+                        answer_tokens=args.answer_tokens, error_rate=args.ollama_error_rate).start()
+    judge_cls = FakeBatchJudge if args.judge_mode == 'batch_api' else FakeJudge
+    judge = judge_cls(latency=args.judge_latency, error_rate=args.judge_error_rate, requests_per_minute=args.judge_rpm).start()
+    try:
+        config = build_config(args, work_dir, ollama.url, judge.url)
+        evaluation_config = config['evaluation']
+        judge_max_concurrency = evaluation_config.get('judge_max_concurrency', evaluation_config['max_workers'])
+        rate_limiter = JudgeRateLimiter.from_config(evaluation_config.get('judge_rate_limit'), judge_max_concurrency)
+        runtime = BackgroundLoop()
+        progress_board = ProgressBoard()
+        cache = ResultCache.from_config(config.get('cache'))
+
+        started = time.monotonic()
+        try:
+            evaluate_single_model(config['models']['ollama_models'][0], config, bank_path, rate_limiter, progress_board, cache, runtime=runtime)
+        finally:
+            wall = time.monotonic() - started
+            progress_board.close()
+            runtime.close()
+            if cache:
+                cache.close()
+    finally:
+        ollama.stop()
+        judge.stop()
+
+    results_dir = config['paths']['results_dir']
+    run_dir = max((os.path.join(results_dir, name) for name in os.listdir(results_dir)), key=os.path.getmtime)
+    with open(os.path.join(run_dir, 'metrics.json'), 'r', encoding='utf-8') as f:
+        run_metrics = json.load(f)
+
+    return {
+        'rows': args.rows,
+        'wall_s': round(wall, 3),
+        'items_per_s': round(args.rows / wall, 2) if wall > 0 else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'stages_seconds': run_metrics.get('stages_seconds', {}),
+        'latency_seconds': run_metrics.get('latency_seconds', {}),
+        'counters': run_metrics.get('counters', {}),
+        'servers': {
+            'ollama': {'requests': ollama.requests, 'errors': ollama.errors},
+            'judge': {'requests': judge.requests, 'errors': judge.errors, 'throttled': judge.throttled},
+        },
+        'settings': {key: value for key, value in vars(args).items() if key not in ('baseline', 'save_baseline', 'output', 'work_dir')},
+        'run_dir': run_dir,
+    }
+
+
+def compare_with_baseline(result, baseline, tolerance):
+    """打印与基线的对比，返回超出容差的退化项"""
+    regressions = []
+    rows = []
+    compared = list(COMPARED_METRICS)
+    compared += [(('stages_seconds', name), False) for name in result['stages_seconds']]
+    for path, higher_is_better in compared:
+        current, previous = result, baseline
+        for key in path:
+            current = current.get(key) if isinstance(current, dict) else None
+            previous = previous.get(key) if isinstance(previous, dict) else None
+        if not current or not previous:
+            continue
+        change = (current - previous) / previous
+        worse = -change if higher_is_better else change
+        flag = "退化" if worse > tolerance else ("改善" if worse < -tolerance else "")
+        name = ".".join(path)
+        rows.append(f"  {name:<36} {previous:>12.3f} -> {current:>12.3f}  {change:+.1%} {flag}")
+        if worse > tolerance:
+            regressions.append(name)
+    print(f"\n与基线对比（容差 {tolerance:.0%}）：")
+    print("\n".join(rows))
+    return regressions
+
+
+def print_result(result):
+    print(f"\n题目数: {result['rows']}  总耗时: {result['wall_s']:.2f}s  吞吐: {result['items_per_s']} items/s  峰值RSS: {result['peak_rss_mb']} MB")
+    print("各阶段耗时:")
+    for name, seconds in result['stages_seconds'].items():
+        print(f"  {name:<24} {seconds:>10.3f}s")
+    for name, latency in result['latency_seconds'].items():
+        if latency.get('count'):
+            print(f"  延迟 {name:<19} p50 {latency['p50']:.3f}s  p90 {latency['p90']:.3f}s  p99 {latency['p99']:.3f}s  (n={latency['count']})")
+    print(f"替身服务: {json.dumps(result['servers'], ensure_ascii=False)}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="LLM-Auto-Evaluator 吞吐基准")
+    parser.add_argument('--rows', type=parse_rows, default=parse_rows('1k'), help="合成题库的题目数，如 1k / 10k / 100k")
+    parser.add_argument('--config', default=os.path.join(ROOT_DIR, 'config.yaml'), help="作为基础的配置文件")
+    parser.add_argument('--work-dir', help="题库、结果与缓存的存放目录（默认临时目录；复用同一目录可跳过题库生成）")
+    # 替身服务的行为
+    parser.add_argument('--ollama-ttft', type=float, default=0.05, help="Ollama首token延迟（秒）")
+    parser.add_argument('--ollama-tps', type=float, default=400.0, help="Ollama生成速度（tokens/s，0为不限）")
+    parser.add_argument('--answer-tokens', type=int, default=120, help="平均回答长度（token）")
+    parser.add_argument('--ollama-error-rate', type=float, default=0.0, help="Ollama返回500的概率")
+    parser.add_argument('--judge-latency', type=float, default=0.2, help="裁判单次请求延迟（秒）")
+    parser.add_argument('--judge-error-rate', type=float, default=0.0, help="裁判返回500的概率")
+    parser.add_argument('--judge-rpm', type=int, help="裁判服务端每分钟请求上限，超出时返回429与Retry-After")
+    # 被测配置的覆盖项（留空则沿用配置文件）
+    parser.add_argument('--judge-mode', choices=('online', 'batch_api'), default='online', help="裁判评估方式；batch_api 时替身服务模拟 Batch API")
+    parser.add_argument('--max-workers', type=int)
+    parser.add_argument('--ollama-concurrency', type=int)
+    parser.add_argument('--judge-concurrency', type=int)
+    parser.add_argument('--batch-size', type=int)
+    parser.add_argument('--client-rpm', type=int, help="客户端限流器的RPM（默认不限）")
+    parser.add_argument('--cache', action='store_true', help="启用结果缓存（在同一 --work-dir 中第二次运行可测缓存命中）")
+    parser.add_argument('--no-trace', action='store_true', help="不写 trace.jsonl.gz")
+    parser.add_argument('--log-level', default='WARNING')
+    # 结果与基线
+    parser.add_argument('--output', help="把结果写入该JSON文件")
+    parser.add_argument('--baseline', help="与该基线结果文件比较")
+    parser.add_argument('--save-baseline', help="把本次结果保存为基线")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="判定退化的相对容差")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    result = run(args)
+    print_result(result)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            print(f"结果已保存至: {path}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(result, baseline, args.tolerance)
+        if regressions:
+            print(f"\n以下指标相对基线退化超过 {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,479 @@
+# eval_service.py
+# 常驻评估服务：在本地提供一个小型HTTP API，接收评估任务（题库 + 模型 + 评估角色）并排队执行。
+# 服务启动时只加载一次配置，所有任务共享同一个裁判事件循环、裁判客户端连接池、结果缓存与限流器，
+# CI 流水线可以频繁提交小规模评估，既没有每次启动进程的开销，也不会在多个进程之间争抢裁判配额。
+#
+# 用法（在项目根目录执行）：
+#   python eval_service.py --port 8765
+#
+# 接口：
+#   POST /jobs                          提交任务，请求体为JSON，返回 202 与任务信息
+#   GET  /jobs                          列出全部任务
+#   GET  /jobs/<id>                     任务状态、各模型的进度、运行目录与平均得分
+#   GET  /jobs/<id>/report?model=<名称>  某个模型的 Markdown 评估报告
+#   POST /jobs/<id>/cancel              取消仍在排队的任务
+#   GET  /health                        服务状态与队列长度
+#
+# 任务请求体示例：
+#   {"question_bank": "data/smoke.jsonl", "models": ["qwen3:8b"], "persona": "default", "task_name": "ci_smoke"}
+# models 中的元素可以是 config.yaml 中 models.ollama_models 的模型名，也可以是完整的模型配置；省略时评估配置中的全部模型。
+
+import os
+import copy
+import json
+import time
+import uuid
+import queue
+import logging
+import argparse
+import threading
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from main import (load_config, convert_csv_to_jsonl_if_needed, evaluate_single_model, create_scheduler, create_judge_rate_limiters,
+                  sanitize_filename)
+from prompts import EVALUATION_PROMPTS
+from result_cache import ResultCache
+from async_runtime import BackgroundLoop
+from run_logging import setup_logging
+from run_metrics import RunMetrics
+from run_store import load_run_meta
+from leaderboard import generate_leaderboard, load_run_scores
+
+logger = logging.getLogger(__name__)
+
+REPORT_FILE = "evaluation_report.md"
+
+# 服务配置的默认值，可被 config.yaml 中的 service 覆盖
+DEFAULT_SERVICE_CONFIG = {
+    'host': '127.0.0.1',
+    'port': 8765,
+    'max_concurrent_jobs': 1,
+    'jobs_dir': './service_jobs',
+    'max_request_bytes': 1024 * 1024,
+}
+
+# 任务可以覆盖的评估配置（评估标准、裁判与限流相关的配置由服务统一决定）
+JOB_FIELDS = ('question_bank', 'models', 'persona', 'task_name', 'comparison')
+
+JOB_STATES = ('queued', 'running', 'completed', 'failed', 'cancelled', 'interrupted')
+
+
+class JobError(ValueError):
+    """任务请求无效，返回400"""
+
+
+class _RunProgress:
+    """实现流水线所需的进度句柄接口 (generated/judged/close)，把进度写入任务状态而不是终端进度条"""
+
+    def __init__(self, job, name, total):
+        self._job = job
+        self._lock = job.lock
+        with self._lock:
+            self._state = job.runs.setdefault(name, {})
+            self._state.update(total=total, generated=0, judged=0)
+
+    def generated(self, n=1):
+        with self._lock:
+            self._state['generated'] += n
+
+    def judged(self, n=1):
+        with self._lock:
+            self._state['judged'] += n
+
+    def close(self):
+        pass
+
+
+class _JobProgressBoard:
+    """与 progress.ProgressBoard 接口一致：每个模型一个进度句柄"""
+
+    def __init__(self, job):
+        self.job = job
+
+    def add_model(self, name, total):
+        return _RunProgress(self.job, name, total)
+
+    def close(self):
+        pass
+
+
+class Job:
+    """一个评估任务：请求参数、状态与各模型的运行结果；状态变化时写入 jobs_dir/<id>.json，服务重启后可以查询"""
+
+    def __init__(self, job_id, request, jobs_dir, status='queued', submitted_at=None, started_at=None, finished_at=None, runs=None, error=None, leaderboard=None):
+        self.id = job_id
+        self.request = request
+        self.status = status
+        self.submitted_at = submitted_at or datetime.now().isoformat(timespec='seconds')
+        self.started_at = started_at
+        self.finished_at = finished_at
+        self.runs = runs or {}
+        self.error = error
+        self.leaderboard = leaderboard
+        self.lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._path = os.path.join(jobs_dir, f"{job_id}.json")
+
+    @classmethod
+    def load(cls, path, jobs_dir):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['id'], data['request'], jobs_dir, data['status'], data.get('submitted_at'), data.get('started_at'),
+                   data.get('finished_at'), data.get('runs'), data.get('error'), data.get('leaderboard'))
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'id': self.id,
+                'status': self.status,
+                'request': self.request,
+                'submitted_at': self.submitted_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'runs': copy.deepcopy(self.runs),
+                'error': self.error,
+                'leaderboard': self.leaderboard,
+            }
+
+    def update(self, **fields):
+        with self.lock:
+            for key, value in fields.items():
+                setattr(self, key, value)
+        self.save()
+
+    def save(self):
+        """先写临时文件再替换；串行写入，避免较旧的快照覆盖较新的状态"""
+        with self._save_lock:
+            tmp_path = f"{self._path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.as_dict(), f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self._path)
+
+
+class EvaluationService:
+    """
+    任务队列与共享资源。max_concurrent_jobs 个工作线程依次取出任务执行；
+    每个任务内的多个模型仍由 ModelScheduler 调度（同主机模型数限制只在单个任务内生效，多任务并发时请相应调低）。
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.service_config = {**DEFAULT_SERVICE_CONFIG, **(config.get('service') or {})}
+        self.jobs_dir = self.service_config['jobs_dir']
+        os.makedirs(self.jobs_dir, exist_ok=True)
+
+        # 所有任务共享：裁判事件循环、裁判客户端（连接池）、限流器与结果缓存
+        self.runtime = BackgroundLoop()
+        self.judge_clients = {}
+        self.judge_max_concurrency, self.rate_limiter, self.cheap_rate_limiter = create_judge_rate_limiters(config)
+        self.cache = ResultCache.from_config(config.get('cache'))
+        if self.cache:
+            logger.info(f"已启用结果缓存: {self.cache.path}")
+
+        self.jobs = {}
+        self._jobs_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._restore_jobs()
+        self._workers = [threading.Thread(target=self._work, name=f"eval-job-{i}", daemon=True)
+                         for i in range(max(1, int(self.service_config['max_concurrent_jobs'])))]
+        for worker in self._workers:
+            worker.start()
+
+    def _restore_jobs(self):
+        """读取上次服务留下的任务：排队中的任务重新入队，运行中被中断的任务标记为 interrupted（可用 main.py --resume 继续）"""
+        restored = []
+        for name in os.listdir(self.jobs_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                job = Job.load(os.path.join(self.jobs_dir, name), self.jobs_dir)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"无法读取任务文件 {name}: {e}")
+                continue
+            if job.status == 'running':
+                job.update(status='interrupted', error="服务在任务运行期间停止")
+            self.jobs[job.id] = job
+            restored.append(job)
+        for job in sorted(restored, key=lambda job: job.submitted_at):
+            if job.status == 'queued':
+                self._queue.put(job)
+        if restored:
+            logger.info(f"已恢复 {len(restored)} 个历史任务，其中 {self._queue.qsize()} 个重新排队。")
+
+    def _resolve_models(self, models):
+        configured = {model['model_name']: model for model in self.config.get('models', {}).get('ollama_models', [])}
+        if models is None:
+            if not configured:
+                raise JobError("请求未指定 models，且 config.yaml 中没有配置 models.ollama_models。")
+            return list(configured.values())
+        if not isinstance(models, list) or not models:
+            raise JobError("models 必须是非空列表。")
+        resolved = []
+        for model in models:
+            if isinstance(model, str):
+                resolved.append(configured.get(model, {'model_name': model}))
+            elif isinstance(model, dict) and model.get('model_name'):
+                resolved.append(model)
+            else:
+                raise JobError(f"无法识别的模型配置: {model!r}")
+        names = [model['model_name'] for model in resolved]
+        if len(set(names)) != len(names):
+            raise JobError("同一任务中的模型名不能重复。")
+        return resolved
+
+    def submit(self, request):
+        """校验并登记任务，返回 Job；请求无效时抛出 JobError"""
+        if not isinstance(request, dict):
+            raise JobError("请求体必须是JSON对象。")
+        unknown = set(request) - set(JOB_FIELDS)
+        if unknown:
+            raise JobError(f"不支持的字段: {', '.join(sorted(unknown))}，可用字段: {', '.join(JOB_FIELDS)}")
+        question_bank = request.get('question_bank')
+        if not question_bank or not os.path.isfile(question_bank):
+            raise JobError(f"题库文件不存在: {question_bank}")
+        if not question_bank.endswith(('.jsonl', '.csv')):
+            raise JobError("题库文件必须是 .jsonl 或 .csv。")
+        persona = request.get('persona', self.config['evaluation']['prompt_persona'])
+        if persona not in EVALUATION_PROMPTS:
+            raise JobError(f"评估角色 '{persona}' 不存在于 prompts.py 中。")
+        if request.get('comparison') is not None and not isinstance(request['comparison'], dict):
+            raise JobError("comparison 必须是JSON对象。")
+        self._resolve_models(request.get('models'))
+
+        job = Job(uuid.uuid4().hex[:12], request, self.jobs_dir)
+        with self._jobs_lock:
+            self.jobs[job.id] = job
+        job.save()
+        self._queue.put(job)
+        logger.info(f"任务 {job.id} 已排队（题库 {question_bank}，队列长度 {self._queue.qsize()}）。")
+        return job
+
+    def cancel(self, job_id):
+        """取消排队中的任务；已开始的任务不能取消。返回是否取消成功"""
+        job = self.get(job_id)
+        with job.lock:
+            if job.status != 'queued':
+                return False
+            job.status = 'cancelled'
+            job.finished_at = datetime.now().isoformat(timespec='seconds')
+        job.save()
+        return True
+
+    def get(self, job_id):
+        with self._jobs_lock:
+            return self.jobs[job_id]
+
+    def list_jobs(self):
+        with self._jobs_lock:
+            jobs = list(self.jobs.values())
+        return [job.as_dict() for job in sorted(jobs, key=lambda job: job.submitted_at)]
+
+    def status(self):
+        with self._jobs_lock:
+            counts = {state: 0 for state in JOB_STATES}
+            for job in self.jobs.values():
+                counts[job.status] += 1
+        return {'status': 'ok', 'queued': self._queue.qsize(), 'jobs': counts, 'cache': self.cache.summary() if self.cache else None}
+
+    def _job_config(self, request):
+        """在服务配置的副本上应用任务参数，任务之间互不影响"""
+        config = copy.deepcopy(self.config)
+        config['paths']['question_bank'] = request['question_bank']
+        if request.get('persona'):
+            config['evaluation']['prompt_persona'] = request['persona']
+        if request.get('task_name'):
+            config['evaluation']['task_name'] = request['task_name']
+        if request.get('comparison'):
+            config['comparison'] = {**(config.get('comparison') or {}), **request['comparison']}
+        return config
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job.status == 'queued':
+                    self._run_job(job)
+            except BaseException as e:
+                # 任务中的 SystemExit 等异常同样只让当前任务失败，工作线程继续处理后面排队的任务
+                logger.exception(f"任务 {job.id} 执行出错")
+                job.update(status='failed', error=str(e) or type(e).__name__, finished_at=datetime.now().isoformat(timespec='seconds'))
+            finally:
+                self._queue.task_done()
+
+    def _run_job(self, job):
+        job.update(status='running', started_at=datetime.now().isoformat(timespec='seconds'))
+        logger.info(f"{'='*25} 开始执行任务 {job.id} {'='*25}")
+        config = self._job_config(job.request)
+        models = self._resolve_models(job.request.get('models'))
+        conversion_started = time.monotonic()
+        question_jsonl_path = convert_csv_to_jsonl_if_needed(config)
+        conversion_seconds = time.monotonic() - conversion_started
+        progress_board = _JobProgressBoard(job)
+
+        def run_model(model_config, release_host):
+            name = sanitize_filename(model_config['model_name'])
+            with job.lock:
+                job.runs.setdefault(name, {}).update(model=model_config['model_name'], status='running')
+            metrics = RunMetrics(labels={'model': model_config['model_name'], 'job': job.id})
+            metrics.record_stage('csv_conversion', conversion_seconds)
+            try:
+                run_dir = evaluate_single_model(model_config, config, question_jsonl_path, self.rate_limiter, progress_board, self.cache,
+                                                runtime=self.runtime, metrics=metrics, cheap_rate_limiter=self.cheap_rate_limiter,
+                                                on_generation_done=release_host, judge_clients=self.judge_clients)
+            except BaseException as e:
+                with job.lock:
+                    job.runs[name].update(status='failed', error=str(e))
+                job.save()
+                raise
+            with job.lock:
+                job.runs[name].update(status='completed', run_dir=run_dir, scores=self._run_scores(run_dir))
+            job.save()
+
+        failures = create_scheduler(config).run(models, run_model)
+        leaderboard = None
+        if len(models) > 1 and config.get('report', {}).get('leaderboard', True):
+            leaderboard = generate_leaderboard(config['paths']['results_dir'], persona=config['evaluation']['prompt_persona'],
+                                               task=sanitize_filename(config['evaluation'].get('task_name', 'default_task')),
+                                               question_bank=question_jsonl_path)
+        status = 'failed' if failures else 'completed'
+        job.update(status=status, leaderboard=leaderboard, finished_at=datetime.now().isoformat(timespec='seconds'),
+                   error=f"以下模型评估失败: {', '.join(failures)}" if failures else None)
+        logger.info(f"任务 {job.id} 结束，状态: {status}")
+
+    @staticmethod
+    def _run_scores(run_dir):
+        """各维度的平均得分（复用排行榜的 scores.npz 缓存），供CI直接判断是否达标"""
+        try:
+            run = load_run_scores(run_dir, load_run_meta(run_dir))
+        except (OSError, ValueError) as e:
+            logger.warning(f"无法读取运行 {run_dir} 的评分: {e}")
+            return None
+        return {'items': len(run.ids), **{dim: round(mean, 4) if mean is not None else None for dim, mean in run.dimension_means().items()}}
+
+    def report_path(self, job_id, model_name=None):
+        """任务中某个模型（只有一个模型时可省略）的报告路径；尚未生成时返回 None"""
+        runs = self.get(job_id).as_dict()['runs']
+        if model_name is not None:
+            runs = {name: run for name, run in runs.items() if model_name in (name, run.get('model'))}
+        if len(runs) != 1:
+            raise JobError("请通过 model 参数指定模型。" if runs else f"任务中没有模型 {model_name}。")
+        run_dir = next(iter(runs.values())).get('run_dir')
+        path = os.path.join(run_dir, REPORT_FILE) if run_dir else None
+        return path if path and os.path.exists(path) else None
+
+    def close(self):
+        for client in self.judge_clients.values():
+            self.runtime.run(client.close())
+        self.runtime.close()
+        if self.cache:
+            logger.info(f"缓存统计 (全部任务): {self.cache.summary()}")
+            self.cache.close()
+
+
+class _ServiceHandler(BaseHTTPRequestHandler):
+    """HTTP接口；handler 通过 self.server.service 访问 EvaluationService"""
+
+    server_version = "LLMAutoEvaluator"
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+    def _send(self, status, body, content_type='application/json; charset=utf-8'):
+        data = body if isinstance(body, bytes) else json.dumps(body, ensure_ascii=False, indent=2).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _route(self):
+        parsed = urlparse(self.path)
+        return [part for part in parsed.path.split('/') if part], parse_qs(parsed.query)
+
+    def do_GET(self):
+        service = self.server.service
+        parts, query = self._route()
+        try:
+            if parts == ['health']:
+                return self._send(200, service.status())
+            if parts == ['jobs']:
+                return self._send(200, service.list_jobs())
+            if len(parts) == 2 and parts[0] == 'jobs':
+                return self._send(200, service.get(parts[1]).as_dict())
+            if len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'report':
+                path = service.report_path(parts[1], (query.get('model') or [None])[0])
+                if path is None:
+                    return self._send(404, {'error': "报告尚未生成"})
+                with open(path, 'rb') as f:
+                    return self._send(200, f.read(), 'text/markdown; charset=utf-8')
+        except KeyError:
+            return self._send(404, {'error': f"任务不存在: {parts[1]}"})
+        except JobError as e:
+            return self._send(400, {'error': str(e)})
+        self._send(404, {'error': f"未知的路径: {self.path}"})
+
+    def do_POST(self):
+        service = self.server.service
+        parts, _ = self._route()
+        if parts == ['jobs']:
+            length = int(self.headers.get('Content-Length') or 0)
+            if length > service.service_config['max_request_bytes']:
+                return self._send(413, {'error': "请求体过大"})
+            try:
+                job = service.submit(json.loads(self.rfile.read(length) or b'null'))
+            except json.JSONDecodeError as e:
+                return self._send(400, {'error': f"请求体不是有效的JSON: {e}"})
+            except JobError as e:
+                return self._send(400, {'error': str(e)})
+            return self._send(202, job.as_dict())
+        if len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'cancel':
+            try:
+                cancelled = service.cancel(parts[1])
+            except KeyError:
+                return self._send(404, {'error': f"任务不存在: {parts[1]}"})
+            return self._send(200 if cancelled else 409, service.get(parts[1]).as_dict())
+        self._send(404, {'error': f"未知的路径: {self.path}"})
+
+
+def create_server(service, host, port):
+    httpd = ThreadingHTTPServer((host, port), _ServiceHandler)
+    httpd.daemon_threads = True
+    httpd.service = service
+    return httpd
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="LLM-Auto-Evaluator 常驻评估服务")
+    parser.add_argument('--config', default='config.yaml', help="配置文件路径")
+    parser.add_argument('--host', help="监听地址，覆盖 config.yaml 中的 service.host")
+    parser.add_argument('--port', type=int, help="监听端口，覆盖 config.yaml 中的 service.port")
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], type=str.upper,
+                        help="日志级别，覆盖 config.yaml 中的 logging.level")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    config = load_config(args.config)
+    logging_config = config.get('logging', {})
+    setup_logging(args.log_level or logging_config.get('level', 'INFO'), logging_config.get('log_file'))
+
+    service = EvaluationService(config)
+    host = args.host or service.service_config['host']
+    port = args.port or service.service_config['port']
+    httpd = create_server(service, host, port)
+    logger.info(f"评估服务已启动: http://{host}:{httpd.server_address[1]}，同时执行任务数: {len(service._workers)}，"
+                f"裁判API并发上限: {service.judge_max_concurrency}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("正在停止评估服务...")
+    finally:
+        httpd.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
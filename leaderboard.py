@@ -0,0 +1,397 @@
+# leaderboard.py
+# 跨模型排行榜：扫描 paths.results_dir 下的所有运行目录，每个模型取最近一次完成的运行（--shard 分片运行的各片合并为一组），
+# 输出一份 模型 × 维度 × 场景 的对比报告，包含 得分-延迟 Pareto 排名与共享题目上的两两胜率。
+# 每个运行的评分与生成耗时会缓存为运行目录中的 scores.npz（结果文件未变化时直接读取），数百个历史运行也能快速重扫。
+#
+# 用法（在项目根目录执行）：
+#   python leaderboard.py
+#   python leaderboard.py --task multi_model_test --output results/leaderboard.md
+#   python leaderboard.py --task multi_model_test --question-bank data/questions.jsonl
+
+import os
+import json
+import logging
+import argparse
+import yaml
+import numpy as np
+from datetime import datetime
+from pipeline import score_columns_of
+from run_store import RUN_META_FILE
+from report_generator import iter_details, LATENCY_METRICS
+from run_logging import setup_logging
+
+logger = logging.getLogger(__name__)
+
+SCORES_CACHE_FILE = "scores.npz"
+LEADERBOARD_FILE = "leaderboard.md"
+DETAILS_FILE = "evaluation_details.jsonl"
+
+# 缓存格式变化时递增，旧缓存会自动重建
+_CACHE_VERSION = 1
+
+
+class RunScores:
+    """一个运行的紧凑评分表：ids/scenarios 为字符串数组，scores 为 (题数, 维度数) 的 float32 矩阵，latency 为各生成指标"""
+
+    def __init__(self, run_dir, meta, ids, scenarios, dims, scores, latency):
+        self.run_dir = run_dir
+        self.name = os.path.basename(os.path.normpath(run_dir))
+        self.meta = meta
+        self.model = meta.get('model_config', {}).get('model_name', self.name)
+        self.ids = ids
+        self.scenarios = scenarios
+        self.dims = list(dims)
+        self.scores = scores
+        self.latency = latency
+
+    def item_scores(self, dims=None):
+        """每题的综合得分（各维度的平均）；dims 指定时只取这些维度"""
+        columns = [self.dims.index(dim) for dim in (dims or self.dims) if dim in self.dims]
+        values = self.scores[:, columns]
+        finite = np.isfinite(values)
+        counts = finite.sum(axis=1)
+        totals = np.where(finite, values, 0).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 0, totals / counts, np.nan).astype(np.float32)
+
+    def dimension_means(self):
+        """各维度的平均得分（忽略缺失值）"""
+        return {dim: _nanmean(self.scores[:, index]) for index, dim in enumerate(self.dims)}
+
+    @classmethod
+    def merge(cls, parts):
+        """把同一模型各分片运行的评分表按顺序拼接为一个（维度取并集），运行名为各分片运行名的组合"""
+        if len(parts) == 1:
+            return parts[0]
+        dims = list(dict.fromkeys(dim for part in parts for dim in part.dims))
+        scores = np.full((sum(len(part.ids) for part in parts), len(dims)), np.nan, dtype=np.float32)
+        row = 0
+        for part in parts:
+            scores[row:row + len(part.ids), [dims.index(dim) for dim in part.dims]] = part.scores
+            row += len(part.ids)
+        merged = cls(parts[0].run_dir, parts[0].meta, np.concatenate([part.ids for part in parts]),
+                     np.concatenate([part.scenarios for part in parts]), dims, scores,
+                     np.concatenate([part.latency for part in parts]))
+        merged.name = ", ".join(part.name for part in parts)
+        return merged
+
+
+def _nanmean(values, reducer=np.mean):
+    """忽略 NaN 的均值（或 reducer 指定的统计量）；没有有效值时返回 None"""
+    values = values[np.isfinite(values)]
+    return float(reducer(values)) if len(values) else None
+
+
+def _source_signature(details_path):
+    stat = os.stat(details_path)
+    return np.array([_CACHE_VERSION, stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+
+
+def _parse_details(details_path):
+    """从 evaluation_details.jsonl 中提取 id、场景、评分与生成耗时"""
+    ids, scenarios, rows, latency = [], [], [], []
+    dims = {}
+    for record in iter_details(details_path):
+        scores = {col: record[col] for col in score_columns_of(record)}
+        if not scores:
+            continue
+        for dim in scores:
+            dims.setdefault(dim, len(dims))
+        ids.append(str(record.get('id')))
+        scenarios.append(str(record.get('scenario')))
+        rows.append(scores)
+        gen_metrics = record.get('gen_metrics') or {}
+        latency.append([np.nan if gen_metrics.get(name) is None else gen_metrics[name] for name in LATENCY_METRICS])
+
+    score_matrix = np.full((len(rows), len(dims)), np.nan, dtype=np.float32)
+    for row_index, scores in enumerate(rows):
+        for dim, value in scores.items():
+            score_matrix[row_index, dims[dim]] = value
+    return (np.array(ids, dtype=str), np.array(scenarios, dtype=str), np.array(list(dims), dtype=str),
+            score_matrix, np.array(latency, dtype=np.float32).reshape(len(rows), len(LATENCY_METRICS)))
+
+
+def load_run_scores(run_dir, meta):
+    """读取运行的评分表；scores.npz 与结果文件的修改时间、大小一致时直接使用缓存，否则重新解析并写入缓存"""
+    details_path = os.path.join(run_dir, DETAILS_FILE)
+    cache_path = os.path.join(run_dir, SCORES_CACHE_FILE)
+    signature = _source_signature(details_path)
+    if os.path.exists(cache_path):
+        try:
+            with np.load(cache_path, allow_pickle=False) as cached:
+                if np.array_equal(cached['source'], signature):
+                    return RunScores(run_dir, meta, cached['ids'], cached['scenarios'], cached['dims'], cached['scores'], cached['latency'])
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning(f"评分缓存 {cache_path} 无法读取，将重新解析: {e}")
+
+    ids, scenarios, dims, scores, latency = _parse_details(details_path)
+    try:
+        tmp_path = cache_path + '.tmp.npz'
+        np.savez(tmp_path, source=signature, ids=ids, scenarios=scenarios, dims=dims, scores=scores, latency=latency)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"无法写入评分缓存 {cache_path}: {e}")
+    return RunScores(run_dir, meta, ids, scenarios, dims, scores, latency)
+
+
+def _question_bank_of(meta):
+    bank = meta.get('question_bank')
+    return os.path.abspath(bank) if bank else None
+
+
+def group_shard_runs(runs, strict=False):
+    """
+    把 (运行目录, run_meta) 按模型分组：未分片的单个运行，或同一题库、同一分片数下各分片的运行组成一组。
+    strict 为 False 时（扫描结果目录）每个分片取最近一次运行、每个模型取最近的一组，分片不全的一组跳过并给出警告；
+    strict 为 True 时（显式指定的运行目录）同一分片重复、分片不全或同一模型对应多组都抛出 ValueError。
+    返回 [[(运行目录, run_meta), ...]]，每个模型一组（分片运行按分片编号排列），按模型名排序。
+    """
+    # (模型, 题库, 分片数) -> {分片编号: (时间, 运行目录, run_meta)}
+    groups = {}
+    for run_dir, meta in runs:
+        model = meta.get('model_config', {}).get('model_name', os.path.basename(os.path.normpath(run_dir)))
+        index, count = meta.get('shard') or (0, 1)
+        key = meta.get('finished_at') or meta.get('started_at') or ''
+        parts = groups.setdefault((model, _question_bank_of(meta), count), {})
+        if strict and index in parts:
+            raise ValueError(f"模型 {model} 的第 {index} 片对应了多个运行目录。")
+        if index not in parts or key > parts[index][0]:
+            parts[index] = (key, run_dir, meta)
+
+    latest = {}
+    for (model, _, count), parts in groups.items():
+        if len(parts) < count:
+            found = ", ".join(str(index) for index in sorted(parts))
+            message = f"模型 {model} 的分片运行不全（共 {count} 片，只找到第 {found} 片）"
+            if strict:
+                raise ValueError(f"{message}。")
+            logger.warning(f"{message}，不计入排行榜。")
+            continue
+        if strict and model in latest:
+            raise ValueError(f"模型 {model} 对应了多个运行目录。")
+        ordered = [parts[index] for index in range(count)]
+        key = max(part[0] for part in ordered)
+        if model not in latest or key > latest[model][0]:
+            latest[model] = (key, [(run_dir, meta) for _, run_dir, meta in ordered])
+    return [group for _, (_, group) in sorted(latest.items())]
+
+
+def scan_runs(results_dir, task=None, persona=None, include_unfinished=False, question_bank=None):
+    """
+    扫描 results_dir 下的运行目录，只读取 run_meta.json，可按 task_name、评估角色与题库筛选。
+    task_name 以 run_meta.json 中记录的为准（不从目录名推断）；指定 task 时，未记录 task_name 的旧运行不参与筛选结果。
+    每个模型保留最近一次（已完成的）运行：未分片的单个运行，或同一题库、同一分片数下各分片最近一次运行组成的一组；
+    分片不全的一组会被跳过并给出警告（见 group_shard_runs）。
+    返回 [[(运行目录, run_meta), ...]]，每个模型一组（分片运行按分片编号排列），按模型名排序。
+    """
+    question_bank = os.path.abspath(question_bank) if question_bank else None
+    runs = []
+    for name in os.listdir(results_dir) if os.path.isdir(results_dir) else []:
+        run_dir = os.path.join(results_dir, name)
+        meta_path = os.path.join(run_dir, RUN_META_FILE)
+        if not (os.path.exists(meta_path) and os.path.exists(os.path.join(run_dir, DETAILS_FILE))):
+            continue
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if not include_unfinished and meta.get('status') != 'completed':
+            continue
+        if persona and meta.get('prompt_persona') != persona:
+            continue
+        if task and meta.get('task_name') != task:
+            continue
+        if question_bank and _question_bank_of(meta) != question_bank:
+            continue
+        runs.append((run_dir, meta))
+    return group_shard_runs(runs)
+
+
+def pareto_ranks(scores, latencies):
+    """
+    非支配排序：得分越高、延迟越低越好。第1层为 Pareto 前沿，去掉后剩余模型的前沿为第2层，依此类推。
+    缺少延迟的模型返回 None。
+    """
+    ranks = [None] * len(scores)
+    remaining = [i for i in range(len(scores)) if np.isfinite(scores[i]) and np.isfinite(latencies[i])]
+    rank = 1
+    while remaining:
+        front = [i for i in remaining
+                 if not any(scores[j] >= scores[i] and latencies[j] <= latencies[i] and (scores[j] > scores[i] or latencies[j] < latencies[i])
+                            for j in remaining)]
+        for i in front:
+            ranks[i] = rank
+        remaining = [i for i in remaining if i not in front]
+        rank += 1
+    return ranks
+
+
+def win_rates(runs, dims=None):
+    """
+    两两胜率：在两个模型都有评分的共享题目上比较每题的综合得分，胜记1、平记0.5。
+    返回 (胜率矩阵, 共享题数矩阵)，对角线为 NaN。
+    """
+    count = len(runs)
+    rates = np.full((count, count), np.nan)
+    shared = np.zeros((count, count), dtype=np.int64)
+    item_scores = [run.item_scores(dims) for run in runs]
+    for a in range(count):
+        for b in range(a + 1, count):
+            _, index_a, index_b = np.intersect1d(runs[a].ids, runs[b].ids, assume_unique=False, return_indices=True)
+            score_a, score_b = item_scores[a][index_a], item_scores[b][index_b]
+            valid = np.isfinite(score_a) & np.isfinite(score_b)
+            n = int(valid.sum())
+            shared[a, b] = shared[b, a] = n
+            if n == 0:
+                continue
+            wins = (score_a[valid] > score_b[valid]).sum() + 0.5 * (score_a[valid] == score_b[valid]).sum()
+            rates[a, b] = wins / n
+            rates[b, a] = 1 - rates[a, b]
+    return rates, shared
+
+
+def build_leaderboard(runs):
+    """计算排行榜数据：各模型的维度均分、分场景综合得分、生成耗时、Pareto 排名与胜率"""
+    dims = list(dict.fromkeys(dim for run in runs for dim in run.dims))
+    scenarios = sorted(set().union(*(np.unique(run.scenarios).tolist() for run in runs))) if runs else []
+    rows = []
+    for run in runs:
+        item_scores = run.item_scores(dims)
+        dim_means = {dim: _nanmean(run.scores[:, run.dims.index(dim)]) if dim in run.dims else None for dim in dims}
+        latency = {name: _nanmean(run.latency[:, i], np.median) for i, name in enumerate(LATENCY_METRICS)}
+        scenario_scores = {}
+        for scenario in scenarios:
+            mask = (run.scenarios == scenario) & np.isfinite(item_scores)
+            scenario_scores[scenario] = float(item_scores[mask].mean()) if mask.any() else None
+        rows.append({
+            'model': run.model,
+            'run': run.name,
+            'items': int(np.isfinite(item_scores).sum()),
+            'score': _nanmean(item_scores),
+            'dimensions': dim_means,
+            'scenarios': scenario_scores,
+            'latency_p50': latency,
+        })
+
+    scores = np.array([np.nan if row['score'] is None else row['score'] for row in rows])
+    latencies = np.array([np.nan if row['latency_p50']['total_s'] is None else row['latency_p50']['total_s'] for row in rows])
+    for row, rank in zip(rows, pareto_ranks(scores, latencies)):
+        row['pareto_rank'] = rank
+    rates, shared = win_rates(runs, dims)
+    for index, row in enumerate(rows):
+        others = [rates[index, j] for j in range(len(rows)) if j != index and np.isfinite(rates[index, j])]
+        row['avg_win_rate'] = float(np.mean(others)) if others else None
+    return {
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'dimensions': dims,
+        'scenarios': scenarios,
+        'models': rows,
+        'win_rates': [[None if not np.isfinite(value) else float(value) for value in row] for row in rates],
+        'shared_items': shared.tolist(),
+    }
+
+
+def _fmt(value, spec=".2f", suffix=""):
+    return "-" if value is None else f"{value:{spec}}{suffix}"
+
+
+def write_leaderboard_markdown(leaderboard, path):
+    rows = sorted(leaderboard['models'], key=lambda row: -1e9 if row['score'] is None else -row['score'])
+    dims, scenarios = leaderboard['dimensions'], leaderboard['scenarios']
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("# 模型排行榜\n\n")
+        f.write(f"**生成时间:** {leaderboard['generated_at']}  \n")
+        f.write(f"**模型数:** {len(rows)}（每个模型取最近一次完成的运行，分片运行合并为一组）\n\n")
+
+        f.write("## 1. 综合排名\n\n")
+        f.write("综合得分为每题各维度平均分的均值；平均胜率为与其余模型在共享题目上两两比较的胜率均值；"
+                "Pareto 排名按 综合得分(越高越好) 与 单题总耗时P50(越低越好) 做非支配排序，1 为前沿。\n\n")
+        f.write("| 排名 | 模型 | 题数 | 综合得分 | 平均胜率 | 总耗时 P50 | TTFT P50 | tokens/s P50 | Pareto |\n")
+        f.write("|:---:|:---|:---:|:---:|:---:|:---:|:---:|:---:|:---:|\n")
+        for position, row in enumerate(rows, 1):
+            latency = row['latency_p50']
+            f.write(f"| {position} | `{row['model']}` | {row['items']} | {_fmt(row['score'])} | {_fmt(row['avg_win_rate'], '.1%')} | "
+                    f"{_fmt(latency['total_s'], '.2f', 's')} | {_fmt(latency['ttft_s'], '.2f', 's')} | {_fmt(latency['tokens_per_s'], '.1f')} | "
+                    f"{_fmt(row['pareto_rank'], 'd')} |\n")
+        f.write("\n")
+
+        if dims:
+            f.write("## 2. 各维度平均分\n\n")
+            f.write("| 模型 | " + " | ".join(dims) + " |\n")
+            f.write("|:---|" + ":---:|" * len(dims) + "\n")
+            for row in rows:
+                f.write(f"| `{row['model']}` | " + " | ".join(_fmt(row['dimensions'][dim]) for dim in dims) + " |\n")
+            f.write("\n")
+
+        if scenarios:
+            f.write("## 3. 各场景综合得分\n\n")
+            f.write("| 模型 | " + " | ".join(scenarios) + " |\n")
+            f.write("|:---|" + ":---:|" * len(scenarios) + "\n")
+            for row in rows:
+                f.write(f"| `{row['model']}` | " + " | ".join(_fmt(row['scenarios'][scenario]) for scenario in scenarios) + " |\n")
+            f.write("\n")
+
+        models = [row['model'] for row in leaderboard['models']]
+        if len(models) > 1:
+            order = [models.index(row['model']) for row in rows]
+            f.write("## 4. 两两胜率\n\n")
+            f.write("第 i 行第 j 列为行模型相对列模型的胜率（括号内为共享题数）。\n\n")
+            f.write("| 模型 | " + " | ".join(f"`{models[j]}`" for j in order) + " |\n")
+            f.write("|:---|" + ":---:|" * len(order) + "\n")
+            for i in order:
+                cells = []
+                for j in order:
+                    rate = leaderboard['win_rates'][i][j]
+                    cells.append("-" if i == j or rate is None else f"{rate:.1%} ({leaderboard['shared_items'][i][j]})")
+                f.write(f"| `{models[i]}` | " + " | ".join(cells) + " |\n")
+            f.write("\n")
+
+        f.write("## 5. 数据来源\n\n")
+        for row in rows:
+            f.write(f"- `{row['model']}`: {row['run']}\n")
+    return path
+
+
+def generate_leaderboard(results_dir, output_path=None, task=None, persona=None, include_unfinished=False, question_bank=None):
+    """
+    扫描运行目录并生成排行榜（Markdown 与同名 JSON），返回 Markdown 路径；没有可用运行时返回 None。
+    task 与 question_bank 限定参与排名的运行，避免不同题库的运行混在同一份排名与胜率中。
+    """
+    runs = [RunScores.merge([load_run_scores(run_dir, meta) for run_dir, meta in group])
+            for group in scan_runs(results_dir, task, persona, include_unfinished, question_bank)]
+    runs = [run for run in runs if len(run.ids)]
+    if not runs:
+        logger.warning(f"在 {results_dir} 中没有找到可用于排行榜的运行。")
+        return None
+    leaderboard = build_leaderboard(runs)
+    output_path = output_path or os.path.join(results_dir, LEADERBOARD_FILE)
+    with open(os.path.splitext(output_path)[0] + '.json', 'w', encoding='utf-8') as f:
+        json.dump(leaderboard, f, ensure_ascii=False, indent=2)
+    return write_leaderboard_markdown(leaderboard, output_path)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="LLM-Auto-Evaluator 跨模型排行榜")
+    parser.add_argument('--config', default='config.yaml', help="配置文件路径（读取 paths.results_dir 与评估角色）")
+    parser.add_argument('--results-dir', help="覆盖 paths.results_dir")
+    parser.add_argument('--task', help="只包含该 task_name 的运行")
+    parser.add_argument('--persona', help="只包含该评估角色的运行（默认取 evaluation.prompt_persona）")
+    parser.add_argument('--question-bank', help="只包含使用该题库（转换后的JSONL路径）的运行")
+    parser.add_argument('--include-unfinished', action='store_true', help="同时包含未完成的运行")
+    parser.add_argument('--output', help="输出的 Markdown 路径（默认 results_dir/leaderboard.md）")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    setup_logging(config.get('logging', {}).get('level', 'INFO'))
+    results_dir = args.results_dir or config['paths']['results_dir']
+    persona = args.persona or config.get('evaluation', {}).get('prompt_persona')
+    path = generate_leaderboard(results_dir, args.output, task=args.task, persona=persona, include_unfinished=args.include_unfinished,
+                                question_bank=args.question_bank)
+    if path:
+        logger.info(f"排行榜已生成: {path}")
+
+
+if __name__ == "__main__":
+    main()
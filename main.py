@@ -1,40 +1,77 @@
 # main.py
 # 主程序入口，负责编排整个评估流程
 # 升级版：支持循环评估在config.yaml中定义的多个本地模型
+# 启动优化：openai、requests、pandas/numpy、tqdm、dotenv、asyncio、sqlite3 等依赖推迟到真正需要它们的阶段才导入（见 benchmarks/import_time.py）
 
 import os
+import sys
 import json
-import yaml
-import pandas as pd
+import argparse
+import logging
 import csv
 import re
+import time
+import hashlib
+import threading
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from tqdm import tqdm
 
-from ollama_runner import OllamaRunner
-from online_evaluator import OnlineEvaluator
-from report_generator import ReportGenerator
-from dotenv import load_dotenv
-load_dotenv()
+from report_generator import ReportGenerator, DEFAULT_PANDAS_MIN_ROWS
+from pipeline import run_generate_and_judge, run_generate_then_batch_judge
+from batch_api import create_batch_backend, run_batch_judging
+from progress import ProgressBoard
+from scheduler import ModelScheduler
+from run_store import JsonlAppender, iter_jsonl_tolerant, rewrite_jsonl_in_order, write_run_meta, load_run_meta, update_run_meta
+from run_logging import setup_logging, TraceWriter, new_trace_path
+from run_metrics import RunMetrics
+from run_comparison import DEFAULT_COMPARISON_CONFIG, PreviousRun, resolve_previous_run, compare_runs, write_comparison
+
+logger = logging.getLogger(__name__)
 
 def load_config(config_path='config.yaml'):
-    """加载配置文件"""
+    """加载配置文件，同时从 .env 加载裁判API密钥等环境变量（各入口都经由这里读取配置）"""
+    import yaml
+    from dotenv import load_dotenv
+
+    load_dotenv()
     with open(config_path, 'r', encoding='utf-8') as f:
         return yaml.safe_load(f)
 
+def _file_sha256(path):
+    """流式计算文件的SHA-256，避免把大文件整体读入内存"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 def convert_csv_to_jsonl_if_needed(config):
-    """检查题库文件，如果是CSV则自动转换为JSONL"""
+    """
+    检查题库文件，如果是CSV则自动转换为JSONL。
+    若JSONL比CSV新且记录的CSV内容哈希一致，则直接复用已有的JSONL，不再重复转换。
+    CSV无法读取或缺少必要的列时抛出 ValueError，由调用方决定退出进程还是只让当前任务失败。
+    """
     question_file = config['paths']['question_bank']
     if not question_file.endswith('.csv'):
         return question_file
 
-    print(f"检测到输入文件为CSV: {question_file}")
+    logger.info(f"检测到输入文件为CSV: {question_file}")
     jsonl_path = question_file.replace('.csv', '.jsonl')
+    hash_path = jsonl_path + '.source_sha256'
     
+    # 临时文件名同时包含进程号与线程号：分片进程与常驻服务的各个任务线程可能同时转换同一个CSV
+    tmp_path = f"{jsonl_path}.{os.getpid()}.{threading.get_ident()}.tmp"
     try:
+        csv_hash = _file_sha256(question_file)
+        if os.path.exists(jsonl_path) and os.path.exists(hash_path) \
+                and os.path.getmtime(jsonl_path) >= os.path.getmtime(question_file):
+            with open(hash_path, 'r', encoding='utf-8') as f:
+                if f.read().strip() == csv_hash:
+                    logger.info(f"JSONL已是最新，跳过转换: {jsonl_path}")
+                    return jsonl_path
+
+        # 先写临时文件再替换，避免并发的分片进程读到写了一半的JSONL
         with open(question_file, mode='r', encoding='utf-8') as csv_file, \
-             open(jsonl_path, mode='w', encoding='utf-8') as jsonl_file:
+             open(tmp_path, mode='w', encoding='utf-8') as jsonl_file:
             
             csv_reader = csv.DictReader(csv_file)
             required_columns = {'id', 'scenario', 'sub_scenario', 'prompt', 'ideal_output', 'notes_for_evaluation'}
@@ -44,129 +81,431 @@ def convert_csv_to_jsonl_if_needed(config):
             for row in csv_reader:
                 json_record = json.dumps({key: row.get(key, "") for key in required_columns}, ensure_ascii=False)
                 jsonl_file.write(json_record + '\n')
+        os.replace(tmp_path, jsonl_path)
+        with open(hash_path, 'w', encoding='utf-8') as f:
+            f.write(csv_hash)
         
-        print(f"成功将CSV转换为JSONL: {jsonl_path}")
+        logger.info(f"成功将CSV转换为JSONL: {jsonl_path}")
         return jsonl_path
     except Exception as e:
-        print(f"处理CSV文件时出错: {e}")
-        exit(1)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise ValueError(f"处理CSV文件 {question_file} 时出错: {e}") from e
 
 
-def load_questions(file_path):
-    """从jsonl文件加载题库"""
-    questions = []
+def parse_shard(value):
+    """解析 --shard 参数，格式为 i/N（0 <= i < N）"""
+    if value is None:
+        return None
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"分片格式应为 i/N，例如 0/4，实际为: {value}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"分片编号需满足 0 <= i < N，实际为: {value}")
+    return index, count
+
+def iter_questions(file_path, shard=None):
+    """
+    逐行流式读取jsonl题库，不会把整个题库读入内存。
+    shard 为 (i, N) 时只产出第 i 个分片（按行号对 N 取模）的题目。
+    """
     with open(file_path, 'r', encoding='utf-8') as f:
+        line_number = 0
         for line in f:
-            questions.append(json.loads(line))
-    return questions
+            if not line.strip():
+                continue
+            if shard is None or line_number % shard[1] == shard[0]:
+                yield json.loads(line)
+            line_number += 1
+
+def count_questions(file_path, shard=None):
+    """统计题目数量（不解析JSON），用于进度显示"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        total = sum(1 for line in f if line.strip())
+    if shard is None:
+        return total
+    index, count = shard
+    return total // count + (1 if index < total % count else 0)
+
+def load_questions(file_path, shard=None):
+    """从jsonl文件加载题库"""
+    return list(iter_questions(file_path, shard))
 
 def sanitize_filename(name):
     """清理字符串，使其可以安全地作为文件名的一部分"""
     return re.sub(r'[^a-zA-Z0-9_-]', '_', name)
 
-def evaluate_single_model(ollama_model_config, global_config):
+def is_evaluation_finished(record):
+    """评估失败或出错的记录在恢复运行时需要重新评估"""
+    return record.get('reason') != 'Evaluation failed' and record.get('strengths') != 'Error'
+
+def iter_question_ids(file_path, shard=None):
+    """按题库顺序逐个产出题目ID（字符串），用于流式整理结果文件"""
+    for q in iter_questions(file_path, shard):
+        yield str(q.get('id'))
+
+def evaluate_single_model(ollama_model_config, global_config, question_jsonl_path=None, rate_limiter=None, progress_board=None, cache=None, output_dir=None, runtime=None, shard=None, metrics=None,
+                          cheap_rate_limiter=None, on_generation_done=None, judge_clients=None):
     """
     对单个Ollama模型执行完整的评估流程。
+    多模型并发时，由 main 统一转换题库并传入共享的裁判限流器 (rate_limiter)、裁判事件循环 (runtime)、
+    进度视图 (progress_board) 与结果缓存 (cache)；开启分级评估时低成本裁判的限流器 (cheap_rate_limiter) 同样共享。
+    传入已有的 output_dir 时从该目录中的部分结果继续运行（--resume）。
+    shard 为 (i, N) 时只评估题库的第 i 个分片。题目以流式方式读取，完整的答案与评估记录只保存在结果文件中
+    （逐条追加写盘，结束时按题库顺序流式整理），内存中只保留题目ID、评分与总结用的截断文本；
+    恢复运行时已有答案但未完成评估的记录，以及离线批处理模式下本次待评估的记录，会在评估结束前保留在内存中。
+    各阶段耗时、请求延迟、token用量、重试与缓存命中记录在 metrics (run_metrics.RunMetrics) 中，结束时写入 metrics.json。
+    on_generation_done 在全部答案生成完毕、模型已卸载后调用，用于让调度器提前把Ollama主机交给下一个模型。
+    judge_clients 为跨运行共享的裁判客户端字典（常驻服务中复用连接池），未传入时每次运行各自创建。
+    返回本次运行的结果目录。
     """
+    # 生成与裁判客户端依赖 requests/openai，导入较慢，只在真正评估时加载
+    from ollama_runner import OllamaRunner, ERROR_PREFIX, DEFAULT_KEEP_ALIVE
+    from online_evaluator import OnlineEvaluator
+
     task_name = sanitize_filename(global_config['evaluation'].get('task_name', 'default_task'))
     ollama_model_name = sanitize_filename(ollama_model_config['model_name'])
     evaluator_model_name = sanitize_filename(global_config['models']['online_evaluator'][global_config['models']['online_evaluator']['provider']]['model_name'])
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
-    # 文件夹名称现在包含被评估的小模型名称
-    run_name = f"{task_name}_{ollama_model_name}_vs_{evaluator_model_name}_{timestamp}"
-    output_dir = os.path.join(global_config['paths']['results_dir'], run_name)
-    
-    os.makedirs(output_dir, exist_ok=True)
-    print(f"结果将保存在: {output_dir}")
-
-    # 实例化运行器和评估器
-    ollama_runner = OllamaRunner(ollama_model_config)
-    online_evaluator = OnlineEvaluator(global_config['models']['online_evaluator'], global_config['evaluation']['prompt_persona'])
-    report_generator = ReportGenerator(output_dir)
-
-    question_jsonl_path = convert_csv_to_jsonl_if_needed(global_config)
-    questions = load_questions(question_jsonl_path)
-    print(f"成功加载 {len(questions)} 道题目。")
-
-    print("\n--- 步骤 1: 本地小模型正在生成答案... ---")
-    tasks_with_answers = []
-    for q in tqdm(questions, desc=f"Ollama Generating ({ollama_model_name})"):
-        answer = ollama_runner.generate(q['prompt'])
-        q_copy = q.copy() # 复制一份以避免在循环中修改原始列表
-        q_copy['answer'] = answer
-        tasks_with_answers.append(q_copy)
-    
+    metrics = metrics or RunMetrics(labels={'model': ollama_model_config['model_name']})
+    if question_jsonl_path is None:
+        with metrics.stage('csv_conversion'):
+            question_jsonl_path = convert_csv_to_jsonl_if_needed(global_config)
+
+    resuming = output_dir is not None
+    if not resuming:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        # 文件夹名称现在包含被评估的小模型名称
+        run_name = f"{task_name}_{ollama_model_name}_vs_{evaluator_model_name}_{timestamp}"
+        if shard:
+            run_name += f"_shard{shard[0]}of{shard[1]}"
+        output_dir = os.path.join(global_config['paths']['results_dir'], run_name)
+        os.makedirs(output_dir, exist_ok=True)
+        write_run_meta(output_dir, {
+            'task_name': task_name,
+            'model_config': ollama_model_config,
+            'question_bank': question_jsonl_path,
+            'shard': list(shard) if shard else None,
+            'prompt_persona': global_config['evaluation']['prompt_persona'],
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'status': 'running',
+        })
+    logger.info(f"结果将保存在: {output_dir}")
+
     ollama_results_path = os.path.join(output_dir, "ollama_answers.jsonl")
-    with open(ollama_results_path, 'w', encoding='utf-8') as f:
-        for item in tasks_with_answers:
-            f.write(json.dumps(item, ensure_ascii=False) + '\n')
-    print(f"小模型答案已保存至: {ollama_results_path}")
-
-    print("\n--- 步骤 2: 在线大模型正在进行并发评估... ---")
-    evaluation_results = []
-    max_workers = global_config['evaluation']['max_workers']
-    
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_task = {
-            executor.submit(online_evaluator.evaluate_single, task_item): task_item 
-            for task_item in tasks_with_answers
-        }
-        
-        for future in tqdm(as_completed(future_to_task), total=len(tasks_with_answers), desc="Online Evaluating"):
-            task_item = future_to_task[future]
-            try:
-                eval_result = future.result()
-                if eval_result:
-                    scores = eval_result.pop('scores', {})
-                    task_item.update(eval_result)
-                    task_item.update(scores)
+    eval_results_path = os.path.join(output_dir, "evaluation_details.jsonl")
+
+    # 恢复运行：已完成评估的题目直接跳过（只记录ID），尚未完成评估但已有有效答案的题目跳过生成
+    finished = set()
+    answered = {}
+    if resuming:
+        with metrics.stage('load'):
+            # 同一ID以最后一条记录为准
+            finished_by_id = {}
+            for record in iter_jsonl_tolerant(eval_results_path):
+                finished_by_id[str(record.get('id'))] = is_evaluation_finished(record)
+            finished = {key for key, done in finished_by_id.items() if done}
+            del finished_by_id
+            for record in iter_jsonl_tolerant(ollama_results_path):
+                key = str(record.get('id'))
+                if key in finished:
+                    continue
+                if str(record.get('answer', '')).startswith(ERROR_PREFIX):
+                    answered.pop(key, None)
                 else:
-                    task_item.update({'reason': 'Evaluation failed', 'strengths': 'N/A', 'weaknesses': 'N/A'})
-                evaluation_results.append(task_item)
-            except Exception as e:
-                print(f"评估题目 {task_item['id']} 时主循环捕获到意外出错: {e}")
-                task_item.update({'reason': str(e), 'strengths': 'Error', 'weaknesses': 'Error'})
-                evaluation_results.append(task_item)
+                    answered[key] = record
+        logger.info(f"恢复运行：已完成评估 {len(finished)} 题，已有答案 {len(answered)} 题。")
 
+    # 完整的请求与响应写入运行目录下的压缩追踪文件，而不是输出到终端
+    trace = TraceWriter(new_trace_path(output_dir)) if global_config.get('logging', {}).get('trace', True) else None
+    ollama_runner = online_evaluator = None
     try:
-        evaluation_results.sort(key=lambda x: int(re.search(r'\d+', str(x.get('id', '0'))).group()))
-    except (ValueError, AttributeError):
-        print("警告：无法根据ID中的数字进行排序，将按原始顺序处理。")
-    
-    eval_results_path = os.path.join(output_dir, "evaluation_details.jsonl")
-    with open(eval_results_path, 'w', encoding='utf-8') as f:
-        for item in evaluation_results:
-            f.write(json.dumps(item, ensure_ascii=False) + '\n')
-    print(f"详细评估结果已保存至: {eval_results_path}")
+        # 实例化运行器和评估器
+        ollama_runner = OllamaRunner(ollama_model_config, max_concurrency=global_config['evaluation'].get('ollama_max_concurrency', 1), cache=cache, trace=trace, metrics=metrics,
+                                     stream=global_config['evaluation'].get('ollama_stream', True),
+                                     keep_alive=global_config['evaluation'].get('ollama_keep_alive', DEFAULT_KEEP_ALIVE))
+        online_evaluator = OnlineEvaluator(global_config['models']['online_evaluator'], global_config['evaluation']['prompt_persona'], rate_limiter=rate_limiter, cache=cache, runtime=runtime,
+                                           batch_size=global_config['evaluation'].get('batch_size', 1), summary_config=global_config['evaluation'].get('summary'),
+                                           trace=trace, metrics=metrics, self_consistency=global_config['evaluation'].get('self_consistency'),
+                                           cascade=global_config['evaluation'].get('cascade'), cheap_rate_limiter=cheap_rate_limiter,
+                                           judge_clients=judge_clients)
+        report_generator = ReportGenerator(output_dir)
 
-    print("\n--- 步骤 3: 在线大模型正在生成总结报告... ---")
-    summary = online_evaluator.generate_summary(evaluation_results)
-    
-    print("\n--- 步骤 4: 正在生成Markdown报告... ---")
-    # 创建一个临时config副本，用于报告中正确显示当前被评估的模型名称
-    report_config = global_config.copy()
-    report_config['models']['ollama'] = ollama_model_config
-    report_generator.generate_markdown_report(evaluation_results, summary, report_config)
-    print(f"Markdown评估报告已生成。")
-    print(f"\n模型 {ollama_model_name} 的评估流程完成！")
+        # 增量对比：与上次运行按题目ID配对，输入与评估标准都未变化的题目直接复用上次的裁判结论
+        comparison_config = {**DEFAULT_COMPARISON_CONFIG, **(global_config.get('comparison') or {})}
+        rubric = online_evaluator.rubric_fingerprint()
+        update_run_meta(output_dir, rubric_sha256=rubric)
+        previous_run = None
+        previous_dir = resolve_previous_run(comparison_config, global_config['paths']['results_dir'], ollama_model_config['model_name'], output_dir)
+        if previous_dir:
+            with metrics.stage('load'):
+                previous_run = PreviousRun(previous_dir)
+            if not comparison_config['reuse_verdicts']:
+                logger.info(f"将与上次运行 {previous_run.name} 对比（未开启结论复用）。")
+            elif previous_run.rubric_matches(rubric):
+                online_evaluator.previous_run = previous_run
+                logger.info(f"将与上次运行 {previous_run.name} 对比，输入未变化的题目复用其裁判结论（共 {len(previous_run)} 条可复用）。")
+            else:
+                logger.info(f"评估标准与上次运行 {previous_run.name} 不同，所有题目重新评估，仅输出对比。")
+
+        # 题目以流式方式送入流水线，不在内存中保留整个题库
+        with metrics.stage('load'):
+            total_questions = count_questions(question_jsonl_path, shard)
+        shard_note = f"（分片 {shard[0]}/{shard[1]}）" if shard else ""
+        logger.info(f"题库共 {total_questions} 道题目{shard_note}。")
+        pending_questions = (q for q in iter_questions(question_jsonl_path, shard) if str(q.get('id')) not in finished)
+        pending_total = max(0, total_questions - len(finished))
+        progress = progress_board.add_model(ollama_model_name, pending_total) if progress_board else None
+
+        logger.info("--- 步骤 1 & 2: 本地小模型生成答案，在线大模型流水线式并发评估... ---")
+        max_workers = global_config['evaluation']['max_workers']
+        logger.info(f"并发生成数: {ollama_runner.max_concurrency}, 在途评估请求上限: {max_workers}, 每次评估题目数: {online_evaluator.batch_size}")
+        # 模型生命周期：计时开始前预加载模型（加载耗时单独记录），全部答案生成后立即卸载并让出主机
+        if global_config['evaluation'].get('ollama_preload', True) and len(answered) < pending_total:
+            with metrics.stage('model_load'):
+                ollama_runner.preload()
+        generation_finished = []
+
+        def finish_generation():
+            if generation_finished:
+                return
+            generation_finished.append(True)
+            if global_config['evaluation'].get('ollama_unload_after_generation', True):
+                ollama_runner.unload()
+            if on_generation_done:
+                on_generation_done()
+
+        # 每条答案与评估结果完成后立即追加写盘，进程中断时已完成的工作不会丢失
+        answer_writer = JsonlAppender(ollama_results_path)
+        result_writer = JsonlAppender(eval_results_path)
+        pipeline_started = time.monotonic()
+        try:
+            if global_config['evaluation'].get('judge_mode', 'online') == 'batch_api':
+                # 离线批处理模式：生成全部答案后通过 Batch API 一次性提交评估
+                if online_evaluator.cascade_enabled:
+                    logger.warning("离线批处理模式不支持分级评估，所有题目都将提交给主裁判。")
+                batch_config = global_config.get('batch_api', {})
+                provider_config = global_config['models']['online_evaluator'][global_config['models']['online_evaluator']['provider']]
+                backend = create_batch_backend(batch_config, provider_config)
+                previous_batch_id = load_run_meta(output_dir).get('judge_batch_id') if resuming else None
+                batch_judge = lambda task_items: run_batch_judging(
+                    online_evaluator, task_items, backend, output_dir,
+                    poll_interval=batch_config.get('poll_interval_seconds', 30),
+                    completion_window=batch_config.get('completion_window', '24h'),
+                    existing_batch_id=previous_batch_id,
+                    on_submitted=lambda batch_id: update_run_meta(output_dir, judge_batch_id=batch_id),
+                )
+                run_generate_then_batch_judge(
+                    pending_questions, ollama_runner, batch_judge,
+                    desc=ollama_model_name,
+                    total=pending_total,
+                    progress=progress,
+                    answered=answered,
+                    on_answer=answer_writer.append,
+                    on_result=result_writer.append,
+                    metrics=metrics,
+                    on_generated=finish_generation,
+                )
+            else:
+                run_generate_and_judge(
+                    pending_questions, ollama_runner, online_evaluator, max_workers,
+                    queue_size=global_config['evaluation'].get('pipeline_queue_size'),
+                    desc=ollama_model_name,
+                    total=pending_total,
+                    progress=progress,
+                    answered=answered,
+                    on_answer=answer_writer.append,
+                    on_result=result_writer.append,
+                    batch_linger=global_config['evaluation'].get('batch_linger_seconds', 2.0),
+                    metrics=metrics,
+                    on_generated=finish_generation,
+                )
+        finally:
+            # 生成中途出错时同样卸载模型并让出主机；共享进度视图中本模型的进度条随之关闭
+            finish_generation()
+            if progress is not None:
+                progress.close()
+            answer_writer.close()
+            result_writer.close()
+            metrics.record_stage('generate_and_judge', time.monotonic() - pipeline_started)
+        metrics.set('cache', {'ollama': ollama_runner.cache_stats.as_dict(), 'judge': online_evaluator.cache_stats.as_dict()})
+        if cache:
+            logger.info(f"缓存统计 - Ollama答案: {ollama_runner.cache_stats}; 裁判评估: {online_evaluator.cache_stats}")
+
+        # 恢复运行时保留的已有答案已全部送入评估，不再需要
+        answered.clear()
+
+        # 全部完成后按题库顺序流式整理结果文件（同一ID保留最新一条），记录内容不整体读入内存
+        finalize_started = time.monotonic()
+        rewrite_jsonl_in_order(ollama_results_path, iter_question_ids(question_jsonl_path, shard))
+        logger.info(f"小模型答案已保存至: {ollama_results_path}")
+        rewrite_jsonl_in_order(eval_results_path, iter_question_ids(question_jsonl_path, shard))
+        metrics.record_stage('finalize', time.monotonic() - finalize_started)
+        logger.info(f"详细评估结果已保存至: {eval_results_path}")
+
+        comparison = None
+        if previous_run is not None:
+            if online_evaluator.previous_run is not None:
+                logger.info(f"本次复用上次运行的裁判结论 {previous_run.reused} 条。")
+            with metrics.stage('comparison'):
+                comparison = compare_runs(previous_run.details_path, eval_results_path, comparison_config, previous_run.name,
+                                          pandas_min_rows=global_config.get('report', {}).get('pandas_min_rows', DEFAULT_PANDAS_MIN_ROWS))
+            if comparison:
+                logger.info(f"与上次运行的对比已保存至: {write_comparison(output_dir, comparison)}")
+
+        logger.info("--- 步骤 3: 在线大模型正在生成总结报告... ---")
+        with metrics.stage('summary'):
+            summary = online_evaluator.generate_summary(iter_jsonl_tolerant(eval_results_path))
+
+        logger.info("--- 步骤 4: 正在生成Markdown报告... ---")
+        # 创建一个临时config副本，用于报告中正确显示当前被评估的模型名称
+        # 同时复制 models 层级，避免多个模型并发时相互覆盖共享配置
+        report_config = global_config.copy()
+        report_config['models'] = {**global_config['models'], 'ollama': ollama_model_config}
+        with metrics.stage('report'):
+            report_generator.generate_markdown_report(eval_results_path, summary, report_config, comparison=comparison)
+        logger.info("Markdown评估报告已生成。")
+
+        update_run_meta(output_dir, status='completed', finished_at=datetime.now().isoformat(timespec='seconds'))
+        logger.info(f"模型 {ollama_model_name} 的评估流程完成！")
+        return output_dir
+    finally:
+        # 无论成功与否都关闭客户端与追踪文件：裁判客户端需在追踪写入线程结束前关闭，其最后的请求记录才能写盘
+        if ollama_runner is not None:
+            ollama_runner.close()
+        if online_evaluator is not None:
+            online_evaluator.close()
+        if trace:
+            trace.close()
+        metrics_path = metrics.write(output_dir, prometheus=global_config.get('metrics', {}).get('prometheus', False), resume=resuming)
+        logger.info(f"运行指标已保存至: {metrics_path}")
+
+def create_scheduler(config):
+    """按 config.yaml 中的 scheduler 配置创建多模型调度器"""
+    scheduler_config = config.get('scheduler', {})
+    return ModelScheduler(
+        max_concurrent_models=scheduler_config.get('max_concurrent_models', 1),
+        max_models_per_host=scheduler_config.get('max_models_per_host', 1),
+    )
+
+def create_judge_rate_limiters(config):
+    """
+    创建所有模型共享的裁判限流器，返回 (裁判并发上限, 主裁判限流器, 低成本裁判限流器)。
+    只有开启分级评估且配置了 cheap_judge 时才创建低成本裁判的限流器，否则为 None。
+    """
+    # 限流器依赖 asyncio，导入较慢，只在真正评估时加载
+    from rate_limiter import JudgeRateLimiter
+
+    judge_max_concurrency = config['evaluation'].get('judge_max_concurrency', config['evaluation']['max_workers'])
+    rate_limiter = JudgeRateLimiter.from_config(config['evaluation'].get('judge_rate_limit'), judge_max_concurrency)
+    cheap_judge_config = config['models']['online_evaluator'].get('cheap_judge')
+    cheap_rate_limiter = None
+    if (config['evaluation'].get('cascade') or {}).get('enabled') and cheap_judge_config:
+        cheap_rate_limiter = JudgeRateLimiter.from_config(cheap_judge_config.get('rate_limit'), cheap_judge_config.get('max_concurrency', judge_max_concurrency))
+    return judge_max_concurrency, rate_limiter, cheap_rate_limiter
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="LLM-Auto-Evaluator")
+    parser.add_argument('--config', default='config.yaml', help="配置文件路径")
+    parser.add_argument('--resume', nargs='+', metavar='RUN_DIR',
+                        help="从中断的运行目录继续评估，跳过已完成的题目（可同时指定多个目录）")
+    parser.add_argument('--shard', type=parse_shard, metavar='i/N',
+                        help="只评估题库的第 i 个分片（共 N 片，i 从0开始），用于超大题库的分进程处理")
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], type=str.upper,
+                        help="日志级别，覆盖 config.yaml 中的 logging.level")
+    return parser.parse_args()
 
 def main():
     """主函数，加载配置并循环评估所有指定的模型"""
-    config = load_config()
-    
-    ollama_models_to_test = config.get('models', {}).get('ollama_models', [])
-    if not ollama_models_to_test:
-        print("错误：在 config.yaml 中没有找到要评估的Ollama模型 (models.ollama_models)。")
-        return
+    args = parse_args()
+    config = load_config(args.config)
+    logging_config = config.get('logging', {})
+    setup_logging(args.log_level or logging_config.get('level', 'INFO'), logging_config.get('log_file'))
+
+    if args.resume:
+        # 恢复模式：模型配置与题库路径取自各运行目录中的 run_meta.json
+        resume_dirs = {}
+        for run_dir in args.resume:
+            meta = load_run_meta(run_dir)
+            model_name = meta['model_config']['model_name']
+            if model_name in resume_dirs:
+                logger.error(f"模型 {model_name} 对应了多个待恢复的运行目录。")
+                return
+            resume_dirs[model_name] = (run_dir, meta)
+        ollama_models_to_test = [meta['model_config'] for _, meta in resume_dirs.values()]
+        logger.info(f"恢复 {len(resume_dirs)} 个中断的评估运行。")
+    else:
+        resume_dirs = {}
+        ollama_models_to_test = config.get('models', {}).get('ollama_models', [])
+        if not ollama_models_to_test:
+            logger.error("在 config.yaml 中没有找到要评估的Ollama模型 (models.ollama_models)。")
+            return
+        logger.info(f"检测到 {len(ollama_models_to_test)} 个本地模型待评估。")
+
+        # 题库只需转换一次，供所有模型共享；转换耗时计入每个模型的运行指标
+        conversion_started = time.monotonic()
+        try:
+            question_jsonl_path = convert_csv_to_jsonl_if_needed(config)
+        except ValueError as e:
+            logger.error(e)
+            sys.exit(1)
+        conversion_seconds = time.monotonic() - conversion_started
+
+    from result_cache import ResultCache
+    from async_runtime import BackgroundLoop
+
+    scheduler = create_scheduler(config)
+    # 所有模型共享同一个裁判事件循环与限流器（并发上限、RPM/TPM、重试退避）
+    judge_max_concurrency, rate_limiter, cheap_rate_limiter = create_judge_rate_limiters(config)
+    runtime = BackgroundLoop()
+    progress_board = ProgressBoard()
+    cache = ResultCache.from_config(config.get('cache'))
+    if cache:
+        logger.info(f"已启用结果缓存: {cache.path}")
+    logger.info(f"同时评估模型数: {scheduler.max_concurrent_models}, 单主机模型数上限: {scheduler.max_models_per_host}, 裁判API并发上限: {judge_max_concurrency}")
+
+    def run_model(model_config, release_host):
+        logger.info(f"{'='*25} 开始评估模型: {model_config['model_name']} {'='*25}\n")
+        if model_config['model_name'] in resume_dirs:
+            run_dir, meta = resume_dirs[model_config['model_name']]
+            evaluate_single_model(model_config, config, meta['question_bank'], rate_limiter, progress_board, cache,
+                                  output_dir=run_dir, runtime=runtime, shard=tuple(meta['shard']) if meta.get('shard') else None,
+                                  cheap_rate_limiter=cheap_rate_limiter, on_generation_done=release_host)
+        else:
+            metrics = RunMetrics(labels={'model': model_config['model_name']})
+            metrics.record_stage('csv_conversion', conversion_seconds)
+            evaluate_single_model(model_config, config, question_jsonl_path, rate_limiter, progress_board, cache,
+                                  runtime=runtime, shard=args.shard, metrics=metrics, cheap_rate_limiter=cheap_rate_limiter,
+                                  on_generation_done=release_host)
+
+    failures = scheduler.run(ollama_models_to_test, run_model)
+    progress_board.close()
+    runtime.close()
+    if cache:
+        logger.info(f"缓存统计 (全部模型): {cache.summary()}")
+        cache.close()
+
+    if failures:
+        logger.error(f"以下模型评估失败: {', '.join(failures)}")
 
-    print(f"检测到 {len(ollama_models_to_test)} 个本地模型待评估。")
+    if len(ollama_models_to_test) > 1 and config.get('report', {}).get('leaderboard', True):
+        from leaderboard import generate_leaderboard
 
-    for model_config in ollama_models_to_test:
-        print(f"\n{'='*25} 开始评估模型: {model_config['model_name']} {'='*25}\n")
-        evaluate_single_model(model_config, config)
+        # 只对本次 task_name 与题库上的运行排名；恢复模式下以被恢复运行的 run_meta 为准（旧运行没有记录 task_name 时只按题库筛选）
+        if args.resume:
+            banks = {meta['question_bank'] for _, meta in resume_dirs.values()}
+            tasks = {meta.get('task_name') for _, meta in resume_dirs.values()}
+            question_bank = banks.pop() if len(banks) == 1 else None
+            task = tasks.pop() if len(tasks) == 1 else None
+        else:
+            task, question_bank = sanitize_filename(config['evaluation'].get('task_name', 'default_task')), question_jsonl_path
+        leaderboard_path = generate_leaderboard(config['paths']['results_dir'], persona=config['evaluation']['prompt_persona'],
+                                                task=task, question_bank=question_bank)
+        if leaderboard_path:
+            logger.info(f"跨模型排行榜已生成: {leaderboard_path}")
 
-    print(f"\n{'='*30} 所有评估任务均已完成 {'='*30}")
+    logger.info(f"{'='*30} 所有评估任务均已完成 {'='*30}")
 
 
 if __name__ == "__main__":
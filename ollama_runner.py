@@ -1,46 +1,223 @@
 # ollama_runner.py
 # 负责与本地Ollama模型进行交互
+# 升级版：复用连接池(Session)，并支持按配置的并发数同时发起多个生成请求
+# 流式生成：逐块读取回答以测得首token延迟(TTFT)，并保留Ollama返回的耗时字段作为每题的生成性能指标
+# 模型生命周期：preload() 在计时开始前加载模型，生成请求带上 keep_alive 使模型在整个运行期间常驻，unload() 在生成结束后释放显存
 
-import requests
 import json
+import time
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from result_cache import CacheStats
+
+logger = logging.getLogger(__name__)
+
+ERROR_PREFIX = "Error: Could not get response from Ollama."
+
+_NANOSECONDS = 1e9
+
+# 模型在两次请求之间保持加载的时长（Ollama keep_alive 格式），可通过 evaluation.ollama_keep_alive 或模型配置覆盖
+DEFAULT_KEEP_ALIVE = "30m"
+
+
+def build_gen_metrics(final_chunk, wall_seconds, ttft_seconds=None):
+    """把Ollama最后一个响应块中的计数与耗时（纳秒）整理为每题的生成性能指标（秒）"""
+    eval_count = final_chunk.get('eval_count')
+    eval_duration = final_chunk.get('eval_duration')
+    metrics = {
+        'ttft_s': ttft_seconds,
+        'total_s': wall_seconds,
+        'tokens_per_s': eval_count / (eval_duration / _NANOSECONDS) if eval_count and eval_duration else None,
+        'eval_count': eval_count,
+        'prompt_eval_count': final_chunk.get('prompt_eval_count'),
+        'eval_s': eval_duration / _NANOSECONDS if eval_duration else None,
+        'prompt_eval_s': final_chunk['prompt_eval_duration'] / _NANOSECONDS if final_chunk.get('prompt_eval_duration') else None,
+        'load_s': final_chunk['load_duration'] / _NANOSECONDS if final_chunk.get('load_duration') else None,
+    }
+    return {key: round(value, 4) if isinstance(value, float) else value for key, value in metrics.items()}
+
 
 class OllamaRunner:
-    def __init__(self, config):
+    def __init__(self, config, max_concurrency=1, cache=None, stream=True, trace=None, metrics=None, keep_alive=DEFAULT_KEEP_ALIVE):
         self.base_url = config.get('base_url', 'http://localhost:11434').strip()
         self.model = config['model_name']
         self.options = config.get('options', {})
 
+        # 单个模型同时在途的请求数，应与服务端的 OLLAMA_NUM_PARALLEL 相匹配
+        self.max_concurrency = max(1, int(config.get('max_concurrency', max_concurrency)))
+        # 是否以流式方式生成（可在模型配置中单独覆盖），流式时才能测得首token延迟
+        self.stream = bool(config.get('stream', stream))
+        # 每个请求都带上 keep_alive，避免运行中途模型被Ollama换出后重新加载
+        self.keep_alive = config.get('keep_alive', keep_alive)
+        # 大模型首次加载可能需要数分钟
+        self.load_timeout = config.get('load_timeout', 600)
+
+        # 共享的keep-alive会话，连接池大小与并发数一致，避免每次请求都重新建立TCP连接
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # 可选的请求追踪 (run_logging.TraceWriter)，记录每次生成的完整 prompt 与回答
+        self.trace = trace
+        # 可选的运行级指标 (run_metrics.RunMetrics)
+        self.metrics = metrics
+
+        # 可选的持久化缓存 (result_cache.ResultCache)，按 (模型, 参数, prompt) 命中
+        self.cache = cache
+        self.cache_stats = CacheStats()
+
     def generate(self, prompt):
         """
         向Ollama发送请求并获取模型的回答
         """
-        # --- 新增日志 ---
-        print("\n" + "="*20 + " Ollama Input " + "="*20)
-        print(f"Model: {self.model}")
-        print(f"Prompt:\n---\n{prompt}\n---")
-        # ---------------
+        return self.generate_with_metrics(prompt)[0]
+
+    def generate_with_metrics(self, prompt):
+        """
+        向Ollama发送请求，返回 (回答, 生成性能指标)。
+        命中缓存或请求失败时指标为 None，避免把非真实的耗时计入延迟统计。
+        """
+        cache_key = None
+        if self.cache:
+            cache_key = self.cache.make_key(self.model, self.options, prompt, False)
+            cached = self.cache.get('ollama', cache_key, self.cache_stats)
+            if cached is not None:
+                return cached, None
 
         url = f"{self.base_url}/api/generate"
         payload = {
             "model": self.model,
             "prompt": prompt,
-            "stream": False,
+            "stream": self.stream,
             "options": self.options,
+            "keep_alive": self.keep_alive,
             "think": False
         }
         try:
-            response = requests.post(url, json=payload, timeout=120)
+            if self.stream:
+                answer, metrics = self._generate_streaming(url, payload)
+            else:
+                started = time.perf_counter()
+                response = self.session.post(url, json=payload, timeout=120)
+                response.raise_for_status()
+                response_data = response.json()
+                answer = response_data.get('response', '').strip()
+                metrics = build_gen_metrics(response_data, time.perf_counter() - started)
+
+            logger.debug("Ollama生成完成 (%s): prompt %d 字符, 回答 %d 字符", self.model, len(prompt), len(answer))
+            if self.trace:
+                self.trace.write('ollama', model=self.model, prompt=prompt, response=answer, gen_metrics=metrics)
+            if self.metrics:
+                self._record_metrics(metrics)
+
+            if cache_key:
+                self.cache.set('ollama', cache_key, answer)
+            return answer, metrics
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.warning(f"调用Ollama API时出错 ({self.model}): {e}")
+            if self.trace:
+                self.trace.write('ollama', model=self.model, prompt=prompt, error=str(e))
+            if self.metrics:
+                self.metrics.incr('ollama_errors')
+            return f"{ERROR_PREFIX} Details: {e}", None
+
+    def _record_metrics(self, gen_metrics):
+        self.metrics.incr('ollama_requests')
+        self.metrics.observe('ollama_generate', gen_metrics['total_s'])
+        if gen_metrics.get('ttft_s') is not None:
+            self.metrics.observe('ollama_ttft', gen_metrics['ttft_s'])
+        self.metrics.incr('ollama_prompt_tokens', gen_metrics.get('prompt_eval_count') or 0)
+        self.metrics.incr('ollama_eval_tokens', gen_metrics.get('eval_count') or 0)
+
+    def _generate_streaming(self, url, payload):
+        """逐行读取Ollama的NDJSON流，记录首个非空token到达的时间"""
+        started = time.perf_counter()
+        ttft = None
+        pieces = []
+        final_chunk = {}
+        with self.session.post(url, json=payload, timeout=120, stream=True) as response:
             response.raise_for_status()
-            response_data = response.json()
-            answer = response_data.get('response', '').strip()
+            for line in response.iter_lines(chunk_size=None):
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get('error'):
+                    raise ValueError(f"Ollama返回错误: {chunk['error']}")
+                piece = chunk.get('response', '')
+                if piece:
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                    pieces.append(piece)
+                if chunk.get('done'):
+                    final_chunk = chunk
+                    break
+        if not final_chunk:
+            raise ValueError("Ollama的流式响应在完成前中断。")
+        return "".join(pieces).strip(), build_gen_metrics(final_chunk, time.perf_counter() - started, ttft)
 
-            # --- 新增日志 ---
-            print("\n" + "="*20 + " Ollama Output " + "="*20)
-            print(f"Response:\n---\n{answer}\n---")
-            print("="*55 + "\n")
-            # ---------------
+    def preload(self):
+        """
+        加载模型并按 keep_alive 保持常驻，返回加载耗时（秒），单独记录为 ollama_load，不计入每题的生成延迟。
+        失败时返回 None，首个生成请求会照常触发加载。
+        """
+        started = time.perf_counter()
+        try:
+            response = self.session.post(f"{self.base_url}/api/generate", json={"model": self.model, "keep_alive": self.keep_alive, "stream": False},
+                                         timeout=self.load_timeout)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"预加载模型 {self.model} 失败: {e}")
+            return None
+        seconds = time.perf_counter() - started
+        if self.metrics:
+            self.metrics.observe('ollama_load', seconds)
+        logger.info(f"模型 {self.model} 已加载，耗时 {seconds:.1f}秒。")
+        return seconds
 
-            return answer
+    def unload(self):
+        """立即从Ollama中卸载模型（keep_alive=0），为同一主机上的下一个模型腾出显存"""
+        try:
+            response = self.session.post(f"{self.base_url}/api/generate", json={"model": self.model, "keep_alive": 0, "stream": False}, timeout=60)
+            response.raise_for_status()
         except requests.exceptions.RequestException as e:
-            print(f"调用Ollama API时出错: {e}")
-            return f"Error: Could not get response from Ollama. Details: {e}"
+            logger.warning(f"卸载模型 {self.model} 失败: {e}")
+            return False
+        logger.info(f"模型 {self.model} 已卸载。")
+        return True
+
+    def generate_many(self, tasks, with_metrics=False):
+        """
+        并发生成多个回答。
+        tasks 为 (tag, prompt) 的可迭代对象，按完成顺序逐个产出 (tag, answer)；
+        with_metrics 为 True 时产出 (tag, answer, gen_metrics)。
+        同时在途的请求数不超过 max_concurrency，且只有在调用方取走结果后才会继续提交新请求，
+        因此 tasks 可以是惰性迭代器，调用方也可以借此施加背压。
+        """
+        task_iter = iter(tasks)
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            pending = {}
+
+            def submit_next():
+                for tag, prompt in task_iter:
+                    pending[executor.submit(self.generate_with_metrics, prompt)] = tag
+                    return True
+                return False
+
+            for _ in range(self.max_concurrency):
+                if not submit_next():
+                    break
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tag = pending.pop(future)
+                    answer, metrics = future.result()
+                    yield (tag, answer, metrics) if with_metrics else (tag, answer)
+                    submit_next()
+
+    def close(self):
+        """关闭连接池"""
+        self.session.close()
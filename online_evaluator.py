@@ -1,127 +1,856 @@
 # online_evaluator.py
 # 升级版：从config读取temperature，修复API调用错误
+# 异步版：基于 AsyncOpenAI 发起裁判请求，共享限流器，遇到429/5xx时带抖动指数退避重试
+# openai SDK 导入较慢，只在第一次真正发起裁判请求时才导入并创建客户端，全部命中缓存的运行不需要导入
 
 import os
 import json
-import traceback
-from openai import OpenAI
-from prompts import EVALUATION_PROMPTS, SUMMARY_PROMPT
+import time
+import asyncio
+import logging
+import statistics
+import unicodedata
+from prompts import (EVALUATION_PROMPTS, PERSONA_DIMENSIONS, BATCH_EVALUATION_PROMPTS, BATCH_ITEM_TEMPLATE, PAIRWISE_PROMPTS, SUMMARY_PROMPT,
+                     CHUNK_SUMMARY_PROMPT, MERGE_PARTIAL_SUMMARY_PROMPT, MERGE_SUMMARY_PROMPT)
+from result_cache import CacheStats, ResultCache
+from async_runtime import BackgroundLoop
+from rate_limiter import JudgeRateLimiter, estimate_tokens
+from pipeline import score_columns_of
+from ollama_runner import ERROR_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# 预估单次评估回复的token数，用于TPM令牌桶的预扣
+EXPECTED_COMPLETION_TOKENS = 600
+
+# 总结阶段的默认配置，可被 config.yaml 中的 evaluation.summary 覆盖
+DEFAULT_SUMMARY_CONFIG = {
+    'mode': 'map_reduce',
+    'chunk_token_budget': 12000,
+    'merge_token_budget': 12000,
+    'max_field_chars': 1000,
+}
+
+# 自洽采样的默认配置，可被 config.yaml 中的 evaluation.self_consistency 覆盖；samples 为1时关闭
+DEFAULT_SELF_CONSISTENCY = {
+    'samples': 1,
+    'min_samples': 2,
+    'aggregate': 'median',
+    'tolerance': 1.0,
+}
+
+# 成对比较中裁判可给出的偏好；位置互换时 A 与 B 对调
+PAIRWISE_CHOICES = ('A', 'B', 'tie')
+_SWAPPED_CHOICE = {'A': 'B', 'B': 'A', 'tie': 'tie'}
+
+# 分级评估的默认配置，可被 config.yaml 中的 evaluation.cascade 覆盖
+DEFAULT_CASCADE = {
+    'enabled': False,
+    'heuristics': True,
+    'failure_score': 1,
+    'exact_match_score': 10,
+    'min_length_ratio': 0.2,
+    'max_length_ratio': 5.0,
+    'confident_high': 8,
+    'confident_low': 3,
+}
+
+
+def normalize_text(text):
+    """用于精确匹配的归一化：全角转半角、转小写，并去掉空白与标点"""
+    text = unicodedata.normalize('NFKC', str(text or '')).lower()
+    return "".join(ch for ch in text if not (ch.isspace() or unicodedata.category(ch).startswith('P')))
+
+
+def _retry_after_seconds(error):
+    """从异常的响应头中读取 Retry-After（秒）"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    value = response.headers.get('retry-after')
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
 
 class OnlineEvaluator:
-    def __init__(self, config, persona='default'):
+    def __init__(self, config, persona='default', rate_limiter=None, cache=None, runtime=None, batch_size=1, summary_config=None, trace=None, metrics=None,
+                 self_consistency=None, cascade=None, cheap_rate_limiter=None, judge_clients=None):
         provider = config.get('provider', 'bytedance')
         provider_config = config.get(provider)
 
         if not provider_config:
             raise ValueError(f"评估服务商 '{provider}' 的配置不存在于 config.yaml 中。")
-        
-        print(f"Initializing evaluator with provider: {provider}")
 
-        self.client = OpenAI(
-            base_url=provider_config.get('base_url'),
-            api_key=os.environ.get(provider_config['api_key_env']),
-            timeout=120.0
-        )
+        logger.debug(f"Initializing evaluator with provider: {provider}")
+
+        # 客户端在第一次发起请求时创建（见 client 属性）；
+        # 常驻服务中各任务共享 judge_clients ({(base_url, api_key_env): AsyncOpenAI})，连接池跨任务复用
+        self._provider_config = provider_config
+        self._judge_clients = judge_clients
+        self._client = None
+        # 只有自行创建、未放入共享 judge_clients 的客户端由本实例负责关闭；共享的由其所有者（常驻服务）关闭
+        self._owns_client = False
         self.model = provider_config['model_name']
-        
+
         # --- MODIFIED: Read temperature from config ---
         self.evaluation_temperature = provider_config.get('evaluation_temperature', 0.0)
         self.summary_temperature = provider_config.get('summary_temperature', 0.5)
-        print(f"Using temperature {self.evaluation_temperature} for evaluation and {self.summary_temperature} for summary.")
+        logger.debug(f"Using temperature {self.evaluation_temperature} for evaluation and {self.summary_temperature} for summary.")
         # ---------------------------------------------
-        
+
         if persona not in EVALUATION_PROMPTS:
             raise ValueError(f"评估角色 '{persona}' 不存在于 prompts.py 中。")
         self.evaluation_prompt_template = EVALUATION_PROMPTS[persona]
-        
+
+        # 批量评估：batch_size 可以是整数，也可以是 {角色名: 整数} 形式按角色分别配置
+        if isinstance(batch_size, dict):
+            batch_size = batch_size.get(persona, 1)
+        self.batch_size = max(1, int(batch_size or 1))
+        self.batch_prompt_template = BATCH_EVALUATION_PROMPTS.get(persona)
+        if self.batch_size > 1 and self.batch_prompt_template is None:
+            logger.warning(f"评估角色 '{persona}' 没有批量评估模板，将逐题评估。")
+            self.batch_size = 1
+
+        # 自洽采样：每题并行采样多次后按维度取中位数/均值；前 min_samples 次各维度极差不超过 tolerance 时提前停止
+        self.self_consistency = {**DEFAULT_SELF_CONSISTENCY, **(self_consistency or {})}
+        self.samples = max(1, int(self.self_consistency['samples']))
+        if self.self_consistency['aggregate'] not in ('median', 'mean'):
+            raise ValueError(f"未知的自洽聚合方式 '{self.self_consistency['aggregate']}'，可选: median, mean")
+        if self.samples > 1 and self.batch_size > 1:
+            logger.warning("自洽采样模式下逐题评估，忽略 batch_size。")
+            self.batch_size = 1
+
+        # 成对比较模板：同一道题目的两个回答在一次请求中比较（没有对应模板的角色不支持成对比较）
+        self.pairwise_prompt_template = PAIRWISE_PROMPTS.get(persona)
+
         self.summary_prompt_template = SUMMARY_PROMPT
+        self.summary_config = {**DEFAULT_SUMMARY_CONFIG, **(summary_config or {})}
+
+        # 多个模型并发评估时共享同一个限流器与事件循环；未传入时各自创建
+        self.rate_limiter = rate_limiter or JudgeRateLimiter()
+        self._owns_runtime = runtime is None
+        self.runtime = runtime or BackgroundLoop()
+
+        # 可选的请求追踪 (run_logging.TraceWriter)，记录每次裁判请求的完整 prompt 与响应
+        self.trace = trace
+        # 可选的运行级指标 (run_metrics.RunMetrics)：请求延迟、token用量与重试次数
+        self.metrics = metrics
+
+        # 可选的持久化缓存 (result_cache.ResultCache)，按 (裁判模型, 温度, 评估模板, 完整prompt) 命中
+        self.cache = cache
+        self.cache_stats = CacheStats()
+        # 可选的上次运行结果 (run_comparison.PreviousRun)，由调用方在确认评估标准一致后设置
+        self.previous_run = None
+
+        # 分级评估：规则层直接判定明显的题目，其余先交给 online_evaluator.cheap_judge 配置的低成本裁判，
+        # 低成本裁判给分不明确（或回答长度异常）时才升级给主裁判
+        self.cascade = {**DEFAULT_CASCADE, **(cascade or {})}
+        self.cascade_enabled = bool(self.cascade['enabled'])
+        self.dimensions = PERSONA_DIMENSIONS.get(persona, [])
+        self.cheap_judge = None
+        if self.cascade_enabled:
+            if self.batch_size > 1:
+                logger.warning("分级评估模式下逐题评估，忽略 batch_size。")
+                self.batch_size = 1
+            cheap_config = config.get('cheap_judge')
+            if cheap_config:
+                # cheap_judge 可以只写 model_name，其余连接参数沿用 provider 指定的服务商配置
+                cheap_provider = cheap_config.get('provider', provider)
+                cheap_rate_limiter = cheap_rate_limiter or JudgeRateLimiter.from_config(cheap_config.get('rate_limit'), cheap_config.get('max_concurrency', 10))
+                self.cheap_judge = OnlineEvaluator(
+                    {'provider': cheap_provider, cheap_provider: {**config.get(cheap_provider, {}), **cheap_config}}, persona,
+                    rate_limiter=cheap_rate_limiter, runtime=self.runtime, trace=trace, metrics=metrics, judge_clients=judge_clients,
+                )
+                logger.info(f"分级评估：低成本裁判 {self.cheap_judge.model}，主裁判 {self.model}")
+            else:
+                logger.warning("分级评估已开启但未配置 online_evaluator.cheap_judge，规则层未判定的题目将全部交给主裁判。")
+
+    @property
+    def client(self):
+        """裁判使用的 AsyncOpenAI 客户端，第一次访问时才导入 openai 并创建（只在裁判事件循环中访问）"""
+        if self._client is None:
+            client_key = (self._provider_config.get('base_url'), self._provider_config['api_key_env'])
+            if self._judge_clients is not None and client_key in self._judge_clients:
+                self._client = self._judge_clients[client_key]
+            else:
+                from openai import AsyncOpenAI
+
+                # 重试由本类统一处理（限流器感知），因此关闭SDK自带的重试
+                self._client = AsyncOpenAI(
+                    base_url=self._provider_config.get('base_url'),
+                    api_key=os.environ.get(self._provider_config['api_key_env']),
+                    timeout=120.0,
+                    max_retries=0,
+                )
+                if self._judge_clients is not None:
+                    self._client = self._judge_clients.setdefault(client_key, self._client)
+                else:
+                    self._owns_client = True
+        return self._client
+
+    @staticmethod
+    def _extract_json(response_text):
+        if '```json' in response_text:
+            return response_text.split('```json')[1].split('```')[0].strip()
+        return response_text
+
+    @staticmethod
+    def _normalize_evaluation(data):
+        if 'scores' not in data or not isinstance(data['scores'], dict):
+             raise ValueError("解析JSON失败：缺少 'scores' 字典或格式不正确。")
+
+        return {
+            'scores': data.get('scores', {}),
+            'reason': data.get('reason', 'No reason provided.'),
+            'strengths': data.get('strengths', 'No strengths provided.'),
+            'weaknesses': data.get('weaknesses', 'No weaknesses provided.')
+        }
 
     def _parse_evaluation_response(self, response_text):
         try:
-            if '```json' in response_text:
-                json_str = response_text.split('```json')[1].split('```')[0].strip()
-            else:
-                json_str = response_text
+            json_str = self._extract_json(response_text)
             data = json.loads(json_str)
             if not isinstance(data, dict):
                 raise json.JSONDecodeError("Data is not a dictionary", json_str, 0)
-            
-            if 'scores' not in data or not isinstance(data['scores'], dict):
-                 raise ValueError("解析JSON失败：缺少 'scores' 字典或格式不正确。")
 
-            return {
-                'scores': data.get('scores', {}),
-                'reason': data.get('reason', 'No reason provided.'),
-                'strengths': data.get('strengths', 'No strengths provided.'),
-                'weaknesses': data.get('weaknesses', 'No weaknesses provided.')
-            }
+            return self._normalize_evaluation(data)
         except (json.JSONDecodeError, ValueError, IndexError) as e:
-            print(f"解析评估JSON失败: {e}")
+            logger.warning(f"解析评估JSON失败: {e}")
             return None
         except Exception as e:
-            print(f"在解析过程中发生未知错误: {e}")
+            logger.warning(f"在解析过程中发生未知错误: {e}")
             return None
 
-    def evaluate_single(self, task_item):
+    def _parse_batch_response(self, response_text, expected_ids):
         """
-        评估单个任务，并打印输入输出日志。
+        解析批量评估返回的JSON数组，返回 {题目ID: 评估结果}。
+        缺失、重复之外的ID或格式不正确的条目会被忽略，由调用方回退为逐题评估。
         """
         try:
-            prompt_payload = {
-                "scenario": task_item.get("scenario", ""),
-                "sub_scenario": task_item.get("sub_scenario", ""),
-                "prompt": task_item.get("prompt", ""),
-                "answer": task_item.get("answer", ""),
-                "ideal_output": task_item.get("ideal_output", ""),
-                "notes_for_evaluation": task_item.get("notes_for_evaluation", "")
-            }
-            prompt = self.evaluation_prompt_template.format(**prompt_payload)
-            
-            print("\n" + "#"*20 + f" Evaluator Input (ID: {task_item.get('id')}) " + "#"*20)
-            print(f"Model: {self.model}")
-            print(f"Full Prompt:\n---\n{prompt}\n---")
-
-            response = self.client.chat.completions.create(
-                model=self.model, 
-                messages=[{"role": "user", "content": prompt}], 
-                # --- MODIFIED: Use temperature from config ---
-                temperature=self.evaluation_temperature,
-                # ---------------------------------------------
-            )
-            response_text = response.choices[0].message.content
+            data = json.loads(self._extract_json(response_text))
+        except (json.JSONDecodeError, IndexError) as e:
+            logger.warning(f"解析批量评估JSON失败: {e}")
+            return {}
+        if isinstance(data, dict):
+            data = data.get('results', [])
+        if not isinstance(data, list):
+            logger.warning("解析批量评估JSON失败：返回内容不是数组。")
+            return {}
+
+        parsed = {}
+        for entry in data:
+            if not isinstance(entry, dict):
+                continue
+            item_id = str(entry.get('id'))
+            if item_id not in expected_ids or item_id in parsed:
+                continue
+            try:
+                parsed[item_id] = self._normalize_evaluation(entry)
+            except ValueError:
+                continue
+        return parsed
+
+    @staticmethod
+    def _prompt_payload(task_item):
+        return {
+            "scenario": task_item.get("scenario", ""),
+            "sub_scenario": task_item.get("sub_scenario", ""),
+            "prompt": task_item.get("prompt", ""),
+            "answer": task_item.get("answer", ""),
+            "ideal_output": task_item.get("ideal_output", ""),
+            "notes_for_evaluation": task_item.get("notes_for_evaluation", "")
+        }
+
+    def render_evaluation_prompt(self, task_item):
+        return self.evaluation_prompt_template.format(**self._prompt_payload(task_item))
+
+    def _judge_settings(self):
+        """评估模板之外会影响裁判结论的设置"""
+        settings = []
+        if self.batch_size > 1:
+            # 批量评估的结论（多道题目同一请求）与逐题评估的结论分开缓存，评估标准指纹也随之区分
+            settings.append(['batch', self.batch_size])
+        if self.samples > 1:
+            # 自洽采样的聚合结果与单次采样的结果分开缓存
+            sc = self.self_consistency
+            settings.append(['self_consistency', self.samples, sc['min_samples'], sc['aggregate'], sc['tolerance']])
+        if self.cheap_judge is not None:
+            # 分级评估的结果可能来自低成本裁判，与只用主裁判的结果分开缓存
+            cascade = self.cascade
+            settings.append(['cascade', self.cheap_judge.model, self.cheap_judge.evaluation_temperature, cascade['confident_high'],
+                             cascade['confident_low'], cascade['min_length_ratio'], cascade['max_length_ratio']])
+        return settings
+
+    def _judge_cache_key(self, prompt):
+        return self.cache.make_key(self.model, self.evaluation_temperature, self.evaluation_prompt_template, prompt, *self._judge_settings())
+
+    def rubric_fingerprint(self):
+        """评估标准指纹（裁判模型、温度、评估模板与评估方式），写入 run_meta.json，用于判断跨运行能否复用裁判结论"""
+        return ResultCache.make_key(self.model, self.evaluation_temperature, self.evaluation_prompt_template, *self._judge_settings())
+
+    def cached_evaluation(self, task_item, prompt=None):
+        """
+        查询该题目可直接使用的评估结果：先查上次运行中输入未变化的裁判结论 (previous_run)，再查缓存；都未命中时返回 None
+        """
+        if self.previous_run is not None:
+            reused = self.previous_run.reusable_verdict(task_item)
+            if reused is not None:
+                if self.metrics:
+                    self.metrics.incr('judge_reused')
+                return reused
+        if not self.cache:
+            return None
+        prompt = prompt or self.render_evaluation_prompt(task_item)
+        return self.cache.get('judge', self._judge_cache_key(prompt), self.cache_stats)
+
+    def store_evaluation(self, task_item, result, prompt=None):
+        """把评估结果写入缓存（解析失败的结果不缓存）"""
+        if not self.cache or result is None:
+            return
+        prompt = prompt or self.render_evaluation_prompt(task_item)
+        self.cache.set('judge', self._judge_cache_key(prompt), result)
 
-            print("\n" + "#"*20 + f" Evaluator Output (ID: {task_item.get('id')}) " + "#"*20)
-            print(f"Raw Response:\n---\n{response_text}\n---")
-            print("#"*65 + "\n")
+    def build_batch_request(self, custom_id, task_item):
+        """渲染为 OpenAI Batch API 的单行请求"""
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": self.model,
+                "messages": [{"role": "user", "content": self.render_evaluation_prompt(task_item)}],
+                "temperature": self.evaluation_temperature,
+            },
+        }
 
-            return self._parse_evaluation_response(response_text)
+    def parse_batch_output(self, record):
+        """解析 Batch API 输出文件中的一行；请求失败或内容无法解析时返回 None"""
+        response = record.get('response') or {}
+        if record.get('error') or response.get('status_code') != 200:
+            logger.warning(f"批处理请求失败 (ID: {record.get('custom_id')}): {record.get('error') or response.get('status_code')}")
+            return None
+        try:
+            response_text = response['body']['choices'][0]['message']['content']
+        except (KeyError, IndexError, TypeError):
+            logger.warning(f"批处理结果格式不正确 (ID: {record.get('custom_id')})")
+            return None
+        if self.trace:
+            self.trace.write('judge_batch_api', model=self.model, request_id=record.get('custom_id'), response=response_text)
+        if self.metrics:
+            self.metrics.incr('judge_batch_api_requests')
+            self.metrics.record_usage('judge', response['body'].get('usage'))
+        return self._parse_evaluation_response(response_text)
+
+    async def _chat_async(self, prompt, temperature, request_id=None, expected_completion_tokens=EXPECTED_COMPLETION_TOKENS, kind='judge'):
+        """
+        发起一次裁判请求并返回回复文本。
+        429与5xx/超时/连接错误会按限流器的退避策略重试，其余错误直接抛出。
+        kind 用于在运行指标中区分评估请求 ('judge') 与总结请求 ('summary')。
+        """
+        import openai
+
+        estimated_tokens = estimate_tokens(prompt) + expected_completion_tokens
+        limiter = self.rate_limiter
+        attempt = 0
+        while True:
+            retry_after = None
+            async with limiter.slot(estimated_tokens):
+                started = time.monotonic()
+                try:
+                    response = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=[{"role": "user", "content": prompt}],
+                        temperature=temperature,
+                    )
+                except openai.RateLimitError as e:
+                    retry_after = _retry_after_seconds(e)
+                    limiter.on_throttle(retry_after)
+                    if self.metrics:
+                        self.metrics.incr(f"{kind}_throttled")
+                    error = e
+                except openai.APIStatusError as e:
+                    if e.status_code < 500:
+                        raise
+                    retry_after = _retry_after_seconds(e)
+                    limiter.on_error()
+                    error = e
+                except (openai.APITimeoutError, openai.APIConnectionError) as e:
+                    limiter.on_error()
+                    error = e
+                else:
+                    latency = time.monotonic() - started
+                    usage = getattr(response, 'usage', None)
+                    limiter.on_success(latency, estimated_tokens, usage.total_tokens if usage is not None else None)
+                    content = response.choices[0].message.content
+                    if self.metrics:
+                        self.metrics.incr(f"{kind}_requests")
+                        self.metrics.observe(kind, latency)
+                        self.metrics.record_usage(kind, usage)
+                    if self.trace:
+                        self.trace.write('judge', model=self.model, request_id=request_id, prompt=prompt, response=content,
+                                         latency_s=round(latency, 3), attempts=attempt + 1,
+                                         total_tokens=usage.total_tokens if usage is not None else None)
+                    return content
+
+            if attempt >= limiter.max_retries:
+                if self.metrics:
+                    self.metrics.incr(f"{kind}_failures")
+                raise error
+            delay = limiter.retry_delay(attempt, retry_after)
+            attempt += 1
+            if self.metrics:
+                self.metrics.incr(f"{kind}_retries")
+            logger.warning(f"[重试] 裁判请求失败 (ID: {request_id}): {error}，{delay:.1f}秒后进行第{attempt}次重试。")
+            await asyncio.sleep(delay)
+
+    async def evaluate_single_async(self, task_item, check_cache=True):
+        """
+        评估单个任务；完整的输入输出写入请求追踪文件，日志中只保留摘要。
+        check_cache 为 False 时跳过缓存与上次结论的查询（调用方已经查过，避免重复计入缓存统计）。
+        """
+        try:
+            prompt = self.render_evaluation_prompt(task_item)
+
+            if self.cascade_enabled:
+                verdict = self._heuristic_verdict(task_item, prompt)
+                if verdict is not None:
+                    return verdict
+
+            cached = self.cached_evaluation(task_item, prompt) if check_cache else None
+            if cached is not None:
+                return cached
+
+            if self.cascade_enabled:
+                result = await self._evaluate_cascade(prompt, task_item)
+            else:
+                result = await self._evaluate_main(prompt, task_item.get('id'))
+            self.store_evaluation(task_item, result, prompt)
+            return result
         except Exception as e:
-            print(f"\n[错误] 调用在线评估API时发生错误 (ID: {task_item.get('id')}): {e}")
-            traceback.print_exc()
+            logger.error(f"调用在线评估API时发生错误 (ID: {task_item.get('id')}): {e}", exc_info=True)
             return None
 
-    def generate_summary(self, evaluation_results):
-        results_str = ""
-        # Dynamically find score columns from the first result if available
-        if evaluation_results:
-            score_columns = set(evaluation_results[0].keys()) - {'id', 'scenario', 'sub_scenario', 'prompt', 'ideal_output', 'notes_for_evaluation', 'answer', 'reason', 'strengths', 'weaknesses'}
+    async def _evaluate_main(self, prompt, item_id):
+        """由主裁判评估（自洽采样模式下采样多次后聚合）"""
+        if self.samples > 1:
+            return await self._evaluate_self_consistent(prompt, item_id)
+        response_text = await self._chat_async(prompt, self.evaluation_temperature, item_id)
+        logger.debug("裁判评估完成 (ID: %s): prompt %d 字符, 响应 %d 字符", item_id, len(prompt), len(response_text or ''))
+        return self._parse_evaluation_response(response_text)
+
+    def _main_judge_tokens(self, prompt):
+        """估算主裁判评估一道题目所需的token数，用于统计分级评估节省的开销"""
+        calls = 1 if self.samples == 1 else min(self.samples, max(1, int(self.self_consistency['min_samples'])))
+        return (estimate_tokens(prompt) + EXPECTED_COMPLETION_TOKENS) * calls
+
+    def _record_tier(self, tier, saved_tokens=0):
+        if self.metrics:
+            self.metrics.incr(f"cascade_{tier}")
+            if saved_tokens:
+                self.metrics.incr('cascade_main_tokens_saved', saved_tokens)
+
+    def _heuristic_verdict(self, task_item, prompt):
+        """
+        规则层：回答为空或生成失败时判最低分，归一化后与理想答案一致时判满分，其余返回 None 交给裁判。
+        """
+        if not self.cascade['heuristics'] or not self.dimensions:
+            return None
+        answer = str(task_item.get('answer') or '').strip()
+        ideal = str(task_item.get('ideal_output') or '').strip()
+        if not answer or answer.startswith(ERROR_PREFIX):
+            score = self.cascade['failure_score']
+            reason, strengths, weaknesses = "回答为空或本地模型生成失败，按规则直接判为最低分。", "N/A", "未给出有效回答。"
+        elif ideal and normalize_text(answer) == normalize_text(ideal):
+            score = self.cascade['exact_match_score']
+            reason, strengths, weaknesses = "回答与理想答案在归一化后完全一致，按规则直接判为满分。", "与理想答案一致。", "无。"
         else:
-            score_columns = set()
+            return None
+        saved_tokens = self._main_judge_tokens(prompt)
+        self._record_tier('heuristic', saved_tokens)
+        return {
+            'scores': {dim: score for dim in self.dimensions},
+            'reason': reason,
+            'strengths': strengths,
+            'weaknesses': weaknesses,
+            'cascade': {'tier': 'heuristic', 'main_tokens_saved': saved_tokens},
+        }
+
+    def _length_ratio(self, task_item):
+        """回答长度与理想答案长度之比；没有理想答案时返回 None"""
+        ideal = str(task_item.get('ideal_output') or '').strip()
+        if not ideal:
+            return None
+        return len(str(task_item.get('answer') or '').strip()) / len(ideal)
+
+    def _uncertainty(self, verdict):
+        """低成本裁判的给分全部偏高或全部偏低时视为明确，返回 None；否则返回需要升级的原因"""
+        values = [verdict['scores'].get(dim) for dim in (self.dimensions or verdict['scores'])]
+        if not values or any(not isinstance(value, (int, float)) or isinstance(value, bool) for value in values):
+            return "低成本裁判的评分缺失或格式异常"
+        if min(values) >= self.cascade['confident_high'] or max(values) <= self.cascade['confident_low']:
+            return None
+        return f"低成本裁判的评分落在不确定区间 ({min(values)}-{max(values)})"
+
+    async def _evaluate_cascade(self, prompt, task_item):
+        """
+        规则层未能判定的题目：先交给低成本裁判，给分明确时直接采用；
+        低成本裁判失败、给分不明确或回答长度与理想答案相差悬殊时升级给主裁判。
+        """
+        item_id = task_item.get('id')
+        cheap = self.cheap_judge
+        cheap_tokens = 0
+        if cheap is None:
+            escalation = "未配置低成本裁判"
+        else:
+            ratio = self._length_ratio(task_item)
+            if ratio is not None and not (self.cascade['min_length_ratio'] <= ratio <= self.cascade['max_length_ratio']):
+                escalation = f"回答长度为理想答案的 {ratio:.2f} 倍"
+            else:
+                cheap_tokens = estimate_tokens(prompt) + EXPECTED_COMPLETION_TOKENS
+                try:
+                    response_text = await cheap._chat_async(prompt, cheap.evaluation_temperature, f"{item_id}#cheap", kind='judge_cheap')
+                    verdict = cheap._parse_evaluation_response(response_text)
+                except Exception as e:
+                    logger.warning(f"低成本裁判请求失败 (ID: {item_id}): {e}")
+                    verdict = None
+                escalation = "低成本裁判评估失败" if verdict is None else self._uncertainty(verdict)
+                if escalation is None:
+                    saved_tokens = self._main_judge_tokens(prompt)
+                    self._record_tier('cheap', saved_tokens)
+                    return {**verdict, 'cascade': {'tier': 'cheap', 'model': cheap.model, 'cheap_tokens': cheap_tokens, 'main_tokens_saved': saved_tokens}}
+
+        result = await self._evaluate_main(prompt, item_id)
+        if result is None:
+            return None
+        self._record_tier('main')
+        logger.debug(f"[分级评估] 题目 {item_id} 升级给主裁判: {escalation}")
+        return {**result, 'cascade': {'tier': 'main', 'escalation_reason': escalation, 'cheap_tokens': cheap_tokens, 'main_tokens_saved': 0}}
+
+    async def _sample_evaluations(self, prompt, item_id, start, count):
+        """并行发起 count 次采样，返回成功解析的评估结果（单次失败不影响其余采样）"""
+        responses = await asyncio.gather(
+            *(self._chat_async(prompt, self.evaluation_temperature, f"{item_id}#s{start + i}") for i in range(count)),
+            return_exceptions=True,
+        )
+        results = []
+        for response in responses:
+            if isinstance(response, BaseException):
+                logger.warning(f"自洽采样请求失败 (ID: {item_id}): {response}")
+                continue
+            result = self._parse_evaluation_response(response)
+            if result is not None:
+                results.append(result)
+        return results
+
+    def _samples_agree(self, samples):
+        dims = set().union(*(sample['scores'] for sample in samples))
+        for dim in dims:
+            values = [sample['scores'].get(dim) for sample in samples]
+            if any(not isinstance(value, (int, float)) for value in values):
+                return False
+            if max(values) - min(values) > self.self_consistency['tolerance']:
+                return False
+        return True
+
+    def _aggregate_samples(self, samples):
+        """按维度聚合多次采样的评分，理由等文字取自与聚合分最接近的那次采样，离散度记录在 score_spread 中"""
+        aggregate = statistics.median if self.self_consistency['aggregate'] == 'median' else statistics.fmean
+        scores, std, spread_range = {}, {}, {}
+        dims = list(dict.fromkeys(dim for sample in samples for dim in sample['scores']))
+        for dim in dims:
+            values = [sample['scores'][dim] for sample in samples if isinstance(sample['scores'].get(dim), (int, float))]
+            if not values:
+                continue
+            scores[dim] = round(aggregate(values), 2)
+            std[dim] = round(statistics.pstdev(values), 3)
+            spread_range[dim] = max(values) - min(values)
+
+        def distance(sample):
+            return sum(abs(sample['scores'].get(dim, scores[dim]) - scores[dim]) for dim in scores
+                       if isinstance(sample['scores'].get(dim, scores[dim]), (int, float)))
+        representative = min(samples, key=distance)
+        return {
+            **representative,
+            'scores': scores,
+            'score_spread': {'samples': len(samples), 'std': std, 'range': spread_range},
+        }
+
+    async def _evaluate_self_consistent(self, prompt, item_id):
+        """
+        先并行采样 min_samples 次，各维度极差都不超过 tolerance 时直接聚合（稳定的题目约2次调用）；
+        否则并行补齐剩余的采样次数后再聚合。
+        """
+        first_wave = min(self.samples, max(1, int(self.self_consistency['min_samples'])))
+        samples = await self._sample_evaluations(prompt, item_id, 0, first_wave)
+        if len(samples) < self.samples and not (len(samples) >= 2 and self._samples_agree(samples)):
+            samples += await self._sample_evaluations(prompt, item_id, first_wave, self.samples - first_wave)
+        if self.metrics:
+            self.metrics.incr('judge_self_consistency_items')
+            self.metrics.incr('judge_self_consistency_samples', len(samples))
+        if not samples:
+            return None
+        return self._aggregate_samples(samples)
+
+    async def evaluate_batch_async(self, task_items):
+        """
+        在一次裁判请求中评估多道题目，返回与 task_items 一一对应的结果列表。
+        评估标准只发送一次；返回结果中缺失或格式错误的题目会回退为逐题评估。
+        结果按单题写入缓存，缓存键包含 batch_size，与逐题评估模式的结论分开；每道题目只查询一次缓存。
+        """
+        if len(task_items) == 1:
+            return [await self.evaluate_single_async(task_items[0])]
+
+        results = [None] * len(task_items)
+        pending = []
+        for index, task_item in enumerate(task_items):
+            cached = self.cached_evaluation(task_item)
+            if cached is not None:
+                results[index] = cached
+            else:
+                pending.append(index)
+
+        parsed = {}
+        batch_ids = [str(task_items[index].get('id')) for index in pending]
+        if len(pending) > 1 and len(set(batch_ids)) == len(batch_ids):
+            items_text = "".join(
+                BATCH_ITEM_TEMPLATE.format(id=task_items[index].get('id'), **self._prompt_payload(task_items[index]))
+                for index in pending
+            )
+            prompt = self.batch_prompt_template.format(items=items_text)
+            logger.debug(f"[批量评估] 本次请求包含 {len(pending)} 道题目: {', '.join(batch_ids)}")
+            try:
+                response_text = await self._chat_async(
+                    prompt, self.evaluation_temperature, f"batch:{batch_ids[0]}..{batch_ids[-1]}",
+                    expected_completion_tokens=EXPECTED_COMPLETION_TOKENS * len(pending),
+                )
+                parsed = self._parse_batch_response(response_text, set(batch_ids))
+            except Exception as e:
+                logger.warning(f"批量评估请求失败，将逐题评估: {e}")
+
+        fallback = []
+        for index, item_id in zip(pending, batch_ids):
+            if item_id in parsed:
+                results[index] = parsed[item_id]
+                self.store_evaluation(task_items[index], parsed[item_id])
+            else:
+                fallback.append(index)
+        if fallback:
+            if len(pending) > 1:
+                logger.info(f"[批量评估] {len(fallback)} 道题目未能从批量结果中解析，回退为逐题评估。")
+            fallback_results = await asyncio.gather(*(self.evaluate_single_async(task_items[index], check_cache=False) for index in fallback))
+            for index, result in zip(fallback, fallback_results):
+                results[index] = result
+        return results
+
+    def evaluate_single(self, task_item):
+        """同步接口：在后台事件循环中执行 evaluate_single_async 并等待结果"""
+        return self.runtime.run(self.evaluate_single_async(task_item))
+
+    def render_pairwise_prompt(self, task_item, answer_a, answer_b):
+        if self.pairwise_prompt_template is None:
+            raise ValueError(f"当前评估角色没有成对比较模板，可用角色: {', '.join(PAIRWISE_PROMPTS)}")
+        payload = self._prompt_payload(task_item)
+        del payload['answer']
+        return self.pairwise_prompt_template.format(answer_a=answer_a, answer_b=answer_b, **payload)
+
+    def _parse_pairwise_response(self, response_text):
+        """解析成对比较结果，返回 {'winner', 'preferences', 'reason'}；格式不正确时返回 None"""
+        try:
+            data = json.loads(self._extract_json(response_text))
+            if not isinstance(data, dict) or not isinstance(data.get('preferences'), dict):
+                raise ValueError("缺少 'preferences' 字典或格式不正确。")
+
+            def choice(value):
+                value = str(value).strip()
+                value = value.upper() if value.upper() in ('A', 'B') else value.lower()
+                if value not in PAIRWISE_CHOICES:
+                    raise ValueError(f"无法识别的偏好: {value}")
+                return value
 
+            return {
+                'winner': choice(data.get('winner')),
+                'preferences': {dim: choice(value) for dim, value in data['preferences'].items()},
+                'reason': data.get('reason', 'No reason provided.'),
+            }
+        except (json.JSONDecodeError, ValueError, IndexError) as e:
+            logger.warning(f"解析成对比较JSON失败: {e}")
+            return None
+
+    async def evaluate_pair_async(self, task_item, answer_a, answer_b, swap=False):
+        """
+        在一次请求中比较同一道题目的两个回答，返回 {'winner', 'preferences', 'reason', 'swapped'}，取值以调用方的 A/B 为准。
+        swap 为 True 时把回答B放在前面展示（由调用方随机决定以抵消位置偏好），结果会映射回原来的 A/B。
+        请求失败或结果无法解析时返回 None。
+        """
+        try:
+            shown_a, shown_b = (answer_b, answer_a) if swap else (answer_a, answer_b)
+            prompt = self.render_pairwise_prompt(task_item, shown_a, shown_b)
+            cache_key = self.cache.make_key(self.model, self.evaluation_temperature, self.pairwise_prompt_template, prompt) if self.cache else None
+            verdict = self.cache.get('judge_pairwise', cache_key, self.cache_stats) if cache_key else None
+            if verdict is None:
+                response_text = await self._chat_async(prompt, self.evaluation_temperature, task_item.get('id'), kind='judge_pairwise')
+                verdict = self._parse_pairwise_response(response_text)
+                if verdict is None:
+                    return None
+                if cache_key:
+                    self.cache.set('judge_pairwise', cache_key, verdict)
+            if swap:
+                verdict = {
+                    **verdict,
+                    'winner': _SWAPPED_CHOICE[verdict['winner']],
+                    'preferences': {dim: _SWAPPED_CHOICE[value] for dim, value in verdict['preferences'].items()},
+                }
+            return {**verdict, 'swapped': swap}
+        except Exception as e:
+            logger.error(f"成对比较请求出错 (ID: {task_item.get('id')}): {e}", exc_info=True)
+            return None
+
+    def evaluate_pair(self, task_item, answer_a, answer_b, swap=False):
+        """同步接口：在后台事件循环中执行 evaluate_pair_async 并等待结果"""
+        return self.runtime.run(self.evaluate_pair_async(task_item, answer_a, answer_b, swap))
+
+    @staticmethod
+    def _clip(text, limit):
+        text = 'N/A' if text is None else str(text)
+        return text if len(text) <= limit else text[:limit] + "…(已截断)"
+
+    def _summary_view(self, res):
+        """只保留总结需要的字段：长文本按 max_field_chars 截断，评分原样保留，完整记录随即可以释放"""
+        limit = self.summary_config['max_field_chars']
+        view = {key: res.get(key) for key in ('id', 'scenario', 'sub_scenario')}
+        view.update((key, self._clip(res.get(key), limit)) for key in ('prompt', 'answer', 'reason'))
+        view.update((col, res[col]) for col in score_columns_of(res))
+        return view
+
+    def _summary_entry(self, res, score_columns):
+        """把单题结果格式化为总结请求中的一段文本"""
+        limit = self.summary_config['max_field_chars']
+        scores_str = ", ".join([f"{key}: {res.get(key, 'N/A')}" for key in score_columns])
+        return (f"题目ID: {res['id']}\n业务场景: {res['scenario']}/{res['sub_scenario']}\n问题: {self._clip(res['prompt'], limit)}\n"
+                f"小模型回答: {self._clip(res['answer'], limit)}\n得分详情: {scores_str}\n评分理由: {self._clip(res.get('reason'), limit)}\n---\n")
+
+    @staticmethod
+    def _score_overview(results, score_columns):
+        """按场景汇总题数与各维度平均分，作为分块/合并请求中的统计数据"""
+        sums = {}
+        for res in results:
+            scenario_sums = sums.setdefault(res.get('scenario'), {'_count': 0})
+            scenario_sums['_count'] += 1
+            for col in score_columns:
+                value = res.get(col)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    total, n = scenario_sums.get(col, (0.0, 0))
+                    scenario_sums[col] = (total + value, n + 1)
+        lines = [f"共 {len(results)} 道题目。"]
+        for scenario, scenario_sums in sums.items():
+            scores = ", ".join(f"{col} {scenario_sums[col][0] / scenario_sums[col][1]:.2f}" for col in score_columns if col in scenario_sums)
+            lines.append(f"- {scenario} ({scenario_sums['_count']}题): {scores or '无有效评分'}")
+        return "\n".join(lines)
+
+    @staticmethod
+    def _pack_by_budget(items, budget, min_group=1):
+        """按token预算把 (文本, token数, ...) 顺序打包成若干组；每组至少 min_group 项以保证合并能收敛"""
+        groups, current, used = [], [], 0
+        for item in items:
+            if current and used + item[1] > budget and len(current) >= min_group:
+                groups.append(current)
+                current, used = [], 0
+            current.append(item)
+            used += item[1]
+        if current:
+            groups.append(current)
+        return groups
+
+    async def _map_reduce_summary_async(self, entries, score_columns, evaluation_results):
+        """
+        分块总结：按场景把结果切成不超过 chunk_token_budget 的块并行总结，
+        阶段性总结超过 merge_token_budget 时先分组合并（可多层），最后合并为完整报告。
+        """
+        by_scenario = {}
+        for entry in entries:
+            by_scenario.setdefault(entry[2].get('scenario'), []).append(entry)
+
+        chunk_prompts = []
+        for scenario, scenario_entries in by_scenario.items():
+            chunks = self._pack_by_budget(scenario_entries, self.summary_config['chunk_token_budget'])
+            for index, chunk in enumerate(chunks, 1):
+                chunk_prompts.append((f"{scenario} ({index}/{len(chunks)})", CHUNK_SUMMARY_PROMPT.format(
+                    scenario=scenario, chunk_index=index, chunk_count=len(chunks),
+                    chunk_stats=self._score_overview([entry[2] for entry in chunk], score_columns),
+                    evaluation_results="".join(entry[0] for entry in chunk),
+                )))
+        logger.info(f"总结报告：评估结果分为 {len(chunk_prompts)} 块并行总结。")
+
+        responses = await asyncio.gather(
+            *(self._chat_async(prompt, self.summary_temperature, f'summary-chunk-{i}', kind='summary') for i, (_, prompt) in enumerate(chunk_prompts)),
+            return_exceptions=True,
+        )
+        partials = []
+        for (label, _), response in zip(chunk_prompts, responses):
+            if isinstance(response, BaseException):
+                logger.warning(f"分块 {label} 总结失败，已跳过: {response}")
+                continue
+            text = f"## {label}\n{response}"
+            partials.append((text, estimate_tokens(text)))
+        if not partials:
+            raise RuntimeError("所有分块总结均失败。")
+
+        level = 1
+        budget = self.summary_config['merge_token_budget']
+        while len(partials) > 1 and sum(tokens for _, tokens in partials) > budget:
+            groups = self._pack_by_budget(partials, budget, min_group=2)
+            logger.info(f"总结报告：第 {level} 层合并，{len(partials)} 份阶段性总结合并为 {len(groups)} 份。")
+            merged = await asyncio.gather(*(
+                self._chat_async(MERGE_PARTIAL_SUMMARY_PROMPT.format(partial_summaries="\n\n".join(text for text, _ in group)),
+                                 self.summary_temperature, f'summary-merge-{level}-{i}', kind='summary')
+                for i, group in enumerate(groups)
+            ))
+            partials = [(text, estimate_tokens(text)) for text in merged]
+            level += 1
+
+        prompt = MERGE_SUMMARY_PROMPT.format(
+            overall_stats=self._score_overview(evaluation_results, score_columns),
+            partial_summaries="\n\n".join(text for text, _ in partials),
+        )
+        return await self._chat_async(prompt, self.summary_temperature, 'summary', kind='summary')
+
+    def generate_summary(self, evaluation_results):
+        """
+        生成整体总结。结果估算的token数不超过 chunk_token_budget（或 mode 为 single）时单次请求，
+        否则走分块并行总结再合并的 map-reduce 流程。
+        evaluation_results 可以是逐行读取结果文件的迭代器，每题只保留截断后的文本与评分。
+        """
+        evaluation_results = [self._summary_view(res) for res in evaluation_results]
+        score_columns = sorted({col for res in evaluation_results for col in score_columns_of(res)})
+        entries = []
         for res in evaluation_results:
-            scores_str = ", ".join([f"{key}: {res.get(key, 'N/A')}" for key in sorted(list(score_columns))])
-            results_str += (f"题目ID: {res['id']}\n业务场景: {res['scenario']}/{res['sub_scenario']}\n问题: {res['prompt']}\n小模型回答: {res['answer']}\n得分详情: {scores_str}\n评分理由: {res.get('reason', 'N/A')}\n---\n")
-        
-        prompt = self.summary_prompt_template.format(evaluation_results=results_str)
+            text = self._summary_entry(res, score_columns)
+            entries.append((text, estimate_tokens(text), res))
+        total_tokens = sum(tokens for _, tokens, _ in entries)
+
         try:
-            response = self.client.chat.completions.create(
-                model=self.model, 
-                messages=[{"role": "user", "content": prompt}], 
-                # --- MODIFIED: Use temperature from config ---
-                temperature=self.summary_temperature
-                # ---------------------------------------------
-            )
-            return response.choices[0].message.content
+            if self.summary_config['mode'] == 'single' or total_tokens <= self.summary_config['chunk_token_budget']:
+                prompt = self.summary_prompt_template.format(evaluation_results="".join(text for text, _, _ in entries))
+                return self.runtime.run(self._chat_async(prompt, self.summary_temperature, 'summary', kind='summary'))
+            logger.info(f"总结报告：评估结果约 {total_tokens} tokens，超过单次预算 {self.summary_config['chunk_token_budget']}，改用分块总结。")
+            return self.runtime.run(self._map_reduce_summary_async(entries, score_columns, evaluation_results))
         except Exception as e:
-            print(f"生成总结报告时出错: {e}")
-            return f"Error generating summary: {e}"
\ No newline at end of file
+            logger.error(f"生成总结报告时出错: {e}")
+            return f"Error generating summary: {e}"
+
+    def close(self):
+        """
+        关闭本实例创建的客户端连接池与事件循环。
+        共享事件循环时同样要关闭自己的客户端，否则每个模型的连接池都会留到进程退出；
+        低成本裁判总是共享主裁判的事件循环，它的客户端也按同样的规则由它自己关闭。
+        连接池必须在所属事件循环关闭之前、在该循环中关闭。可重复调用。
+        """
+        if self.cheap_judge is not None:
+            self.cheap_judge.close()
+        if self._owns_client and self._client is not None:
+            self.runtime.run(self._client.close())
+            self._client, self._owns_client = None, False
+        if self._owns_runtime:
+            self.runtime.close()
@@ -0,0 +1,378 @@
+# pairwise.py
+# 成对比较 (A/B)：读取多个模型已完成运行中的回答，对同一道题目的两个回答在一次裁判请求中直接比较，
+# 得到总体胜/平/负与各维度偏好；回答的展示位置按题目与模型对随机交换，以抵消裁判的位置偏好。
+# 汇总时用 Bradley-Terry 模型（以 Elo 刻度表示）给出所有模型的综合评分与各维度、各场景评分。
+# 比较两个模型时每道题只需一次裁判请求（分别打分需要两次），且直接比较比对照绝对分数的差异更有区分度。
+#
+# 用法（在项目根目录执行）：
+#   python pairwise.py                                  # results_dir 中每个模型最近一次完成的运行两两比较
+#   python pairwise.py --models qwen3:8b gemma3:270m
+#   python pairwise.py --runs results/<run_a> results/<run_b>   # 分片运行列出各分片目录，同一模型的分片会合并
+
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+import itertools
+import numpy as np
+from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from main import load_config, sanitize_filename, create_judge_rate_limiters
+from online_evaluator import OnlineEvaluator
+from prompts import PAIRWISE_PROMPTS, PERSONA_DIMENSIONS
+from report_generator import iter_details
+from leaderboard import scan_runs, group_shard_runs, DETAILS_FILE
+from result_cache import ResultCache
+from run_store import JsonlAppender, load_run_meta
+from run_logging import setup_logging, TraceWriter, TRACE_FILE
+from run_metrics import RunMetrics
+
+logger = logging.getLogger(__name__)
+
+PAIRWISE_DETAILS_FILE = "pairwise_details.jsonl"
+PAIRWISE_REPORT_FILE = "pairwise_report.md"
+PAIRWISE_RESULT_FILE = "pairwise.json"
+TIE = 'tie'
+
+# 成对比较配置的默认值，可被 config.yaml 中的 pairwise 覆盖
+DEFAULT_PAIRWISE_CONFIG = {
+    'seed': 0,
+    'base_rating': 1000,
+}
+
+# 回答比较时需要的题目字段
+_QUESTION_FIELDS = ('id', 'scenario', 'sub_scenario', 'prompt', 'ideal_output', 'notes_for_evaluation', 'answer')
+
+
+def load_answers(run_dirs):
+    """读取运行（分片运行为多个目录）中每道题目的问题与回答（只保留比较所需的字段），返回 {题目ID: 记录}"""
+    answers = {}
+    for run_dir in run_dirs:
+        for record in iter_details(os.path.join(run_dir, DETAILS_FILE)):
+            answers[str(record.get('id'))] = {field: record.get(field) for field in _QUESTION_FIELDS}
+    return answers
+
+
+def swap_position(item_id, model_a, model_b, seed=0):
+    """按 (种子, 题目, 模型对) 决定是否交换展示位置；结果是确定的，重复运行时请求相同、可以命中缓存"""
+    digest = hashlib.sha256(json.dumps([seed, str(item_id), model_a, model_b], ensure_ascii=False).encode('utf-8')).digest()
+    return bool(digest[0] & 1)
+
+
+def iter_matchups(models, answers, seed=0):
+    """
+    产出所有待比较的 (题目, 模型A, 模型B, 是否交换位置)。
+    只比较两个模型都回答过、且问题原文一致的题目。
+    """
+    for model_a, model_b in itertools.combinations(models, 2):
+        shared = [item_id for item_id in answers[model_a] if item_id in answers[model_b]]
+        skipped = 0
+        for item_id in shared:
+            item_a, item_b = answers[model_a][item_id], answers[model_b][item_id]
+            if item_a.get('prompt') != item_b.get('prompt'):
+                skipped += 1
+                continue
+            yield item_a, item_b, model_a, model_b, swap_position(item_id, model_a, model_b, seed)
+        if skipped:
+            logger.warning(f"{model_a} 与 {model_b} 有 {skipped} 道同ID题目的问题原文不一致，已跳过。")
+
+
+def run_pairwise(evaluator, matchups, on_result=None, max_in_flight=16, total=None):
+    """
+    把对战逐个提交到裁判的后台事件循环，在途请求数不超过 max_in_flight；每完成一场调用 on_result(record)。
+    返回 (完成的比较记录列表, 失败数)。
+    """
+    records, failures = [], 0
+    in_flight = {}
+    started = time.monotonic()
+
+    def collect(done):
+        nonlocal failures
+        for future in done:
+            item, model_a, model_b, swapped = in_flight.pop(future)
+            verdict = future.result()
+            if verdict is None:
+                failures += 1
+                continue
+            name_of = {'A': model_a, 'B': model_b, TIE: TIE}
+            record = {
+                'id': item.get('id'),
+                'scenario': item.get('scenario'),
+                'model_a': model_a,
+                'model_b': model_b,
+                'winner': name_of[verdict['winner']],
+                'preferences': {dim: name_of[choice] for dim, choice in verdict['preferences'].items()},
+                'swapped': swapped,
+                'reason': verdict['reason'],
+            }
+            records.append(record)
+            if on_result:
+                on_result(record)
+            if total and len(records) % 100 == 0:
+                logger.info(f"成对比较进度: {len(records) + failures}/{total}（{time.monotonic() - started:.0f}秒）")
+
+    for item_a, item_b, model_a, model_b, swapped in matchups:
+        if len(in_flight) >= max_in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            collect(done)
+        future = evaluator.runtime.submit(evaluator.evaluate_pair_async(item_a, item_a.get('answer'), item_b.get('answer'), swapped))
+        in_flight[future] = (item_a, model_a, model_b, swapped)
+    while in_flight:
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        collect(done)
+    return records, failures
+
+
+def bradley_terry(points, base_rating=1000, iterations=500, tolerance=1e-9):
+    """
+    用 MM 迭代拟合 Bradley-Terry 模型，返回以 Elo 刻度表示的评分（400·log10 强度，几何平均对应 base_rating）。
+    points[i, j] 为模型 i 对模型 j 的得分（胜计1，平计0.5）。每对交过手的模型额外加一场虚拟平局，
+    避免全胜或全负的模型评分发散；从未交手的模型评分为 base_rating。
+    """
+    points = np.asarray(points, dtype=np.float64)
+    games = points + points.T
+    points = points + 0.5 * (games > 0)
+    games = points + points.T
+    wins = points.sum(axis=1)
+    played = games.sum(axis=1) > 0
+    strength = np.ones(len(points))
+    for _ in range(iterations):
+        denominator = (games / (strength[:, None] + strength[None, :])).sum(axis=1)
+        updated = np.where(played, wins / np.where(played, denominator, 1.0), 1.0)
+        updated /= np.exp(np.log(updated).mean())
+        converged = np.max(np.abs(updated - strength)) < tolerance
+        strength = updated
+        if converged:
+            break
+    return base_rating + 400 * np.log10(strength)
+
+
+def _points_matrix(records, models, outcome):
+    """按 outcome(record) 给出的胜者（模型名或 tie）累计得分矩阵；outcome 返回 None 的记录不计入"""
+    index = {model: i for i, model in enumerate(models)}
+    points = np.zeros((len(models), len(models)))
+    for record in records:
+        winner = outcome(record)
+        if winner is None:
+            continue
+        a, b = index[record['model_a']], index[record['model_b']]
+        if winner == TIE:
+            points[a, b] += 0.5
+            points[b, a] += 0.5
+        elif winner == record['model_a']:
+            points[a, b] += 1
+        else:
+            points[b, a] += 1
+    return points
+
+
+def aggregate_pairwise(records, models, dims, base_rating=1000):
+    """汇总比较记录：综合评分、胜/平/负、两两对战、各维度与各场景评分，以及位置偏好"""
+    ratings = bradley_terry(_points_matrix(records, models, lambda r: r['winner']), base_rating)
+    standings = {model: {'wins': 0, 'ties': 0, 'losses': 0} for model in models}
+    matchups = {}
+    first_won, decided = 0, 0
+    for record in records:
+        model_a, model_b, winner = record['model_a'], record['model_b'], record['winner']
+        pair = matchups.setdefault((model_a, model_b), {'model_a': model_a, 'model_b': model_b, 'a_wins': 0, 'ties': 0, 'b_wins': 0})
+        if winner == TIE:
+            pair['ties'] += 1
+            standings[model_a]['ties'] += 1
+            standings[model_b]['ties'] += 1
+            continue
+        loser = model_b if winner == model_a else model_a
+        pair['a_wins' if winner == model_a else 'b_wins'] += 1
+        standings[winner]['wins'] += 1
+        standings[loser]['losses'] += 1
+        # 展示在前面的回答：交换位置时为模型B
+        decided += 1
+        first_won += (winner == model_a) != record['swapped']
+    for pair in matchups.values():
+        games = pair['a_wins'] + pair['ties'] + pair['b_wins']
+        pair['a_win_rate'] = (pair['a_wins'] + 0.5 * pair['ties']) / games if games else None
+
+    dimension_ratings = {}
+    for dim in dims:
+        matrix = _points_matrix(records, models, lambda r, dim=dim: r['preferences'].get(dim))
+        if matrix.any():
+            dimension_ratings[dim] = dict(zip(models, bradley_terry(matrix, base_rating).round(1).tolist()))
+
+    scenario_ratings = {}
+    for scenario in sorted({str(record.get('scenario')) for record in records}):
+        scenario_records = [record for record in records if str(record.get('scenario')) == scenario]
+        scenario_ratings[scenario] = dict(zip(models, bradley_terry(_points_matrix(scenario_records, models, lambda r: r['winner']), base_rating).round(1).tolist()))
+
+    rows = []
+    for rank, i in enumerate(np.argsort(-ratings)):
+        standing = standings[models[i]]
+        games = sum(standing.values())
+        rows.append({
+            'rank': rank + 1,
+            'model': models[i],
+            'rating': round(float(ratings[i]), 1),
+            **standing,
+            'win_rate': (standing['wins'] + 0.5 * standing['ties']) / games if games else None,
+        })
+    return {
+        'models': rows,
+        'matchups': list(matchups.values()),
+        'dimensions': dimension_ratings,
+        'scenarios': scenario_ratings,
+        'comparisons': len(records),
+        'first_position_win_rate': first_won / decided if decided else None,
+    }
+
+
+def _fmt(value, spec=".1f", suffix=""):
+    return "N/A" if value is None else f"{value:{spec}}{suffix}"
+
+
+def write_pairwise_markdown(result, path):
+    """把汇总结果写为 Markdown 报告"""
+    models = [row['model'] for row in result['models']]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("# 成对比较报告\n\n")
+        f.write(f"**生成时间:** {result['generated_at']}\n")
+        f.write(f"**裁判模型:** `{result['judge_model']}`\n")
+        f.write(f"**评估角色:** `{result['persona']}`\n")
+        f.write(f"**比较次数:** {result['comparisons']}（失败 {result['failures']}）\n")
+        f.write(f"**先展示的回答胜率:** {_fmt(result['first_position_win_rate'], '.1%')}（不含平局；明显偏离50%说明裁判存在位置偏好，已通过随机交换位置抵消）\n\n")
+
+        f.write("## 综合评分 (Bradley-Terry，Elo 刻度)\n\n")
+        f.write("| 排名 | 模型 | 评分 | 胜 | 平 | 负 | 胜率 (平局计半) |\n|---|---|---|---|---|---|---|\n")
+        for row in result['models']:
+            f.write(f"| {row['rank']} | `{row['model']}` | {row['rating']:.1f} | {row['wins']} | {row['ties']} | {row['losses']} | {_fmt(row['win_rate'], '.1%')} |\n")
+
+        if result['dimensions']:
+            dims = list(result['dimensions'])
+            f.write("\n## 各维度评分\n\n")
+            f.write("| 模型 | " + " | ".join(dims) + " |\n|---" + "|---" * len(dims) + "|\n")
+            for model in models:
+                f.write(f"| `{model}` | " + " | ".join(_fmt(result['dimensions'][dim].get(model)) for dim in dims) + " |\n")
+
+        if len(result['scenarios']) > 1:
+            scenarios = list(result['scenarios'])
+            f.write("\n## 各场景评分\n\n")
+            f.write("| 模型 | " + " | ".join(scenarios) + " |\n|---" + "|---" * len(scenarios) + "|\n")
+            for model in models:
+                f.write(f"| `{model}` | " + " | ".join(_fmt(result['scenarios'][scenario].get(model)) for scenario in scenarios) + " |\n")
+
+        f.write("\n## 两两对战\n\n")
+        f.write("| 模型A | 模型B | A胜 | 平 | B胜 | A胜率 (平局计半) |\n|---|---|---|---|---|---|\n")
+        for pair in result['matchups']:
+            f.write(f"| `{pair['model_a']}` | `{pair['model_b']}` | {pair['a_wins']} | {pair['ties']} | {pair['b_wins']} | {_fmt(pair['a_win_rate'], '.1%')} |\n")
+
+        f.write("\n## 参与比较的运行\n\n")
+        for model, run_dirs in result['runs'].items():
+            f.write(f"- `{model}`: {', '.join(os.path.basename(os.path.normpath(run_dir)) for run_dir in run_dirs)}\n")
+    return path
+
+
+def select_runs(results_dir, models=None, run_dirs=None, task=None):
+    """
+    确定参与比较的运行：显式指定的运行目录，或 results_dir 中各模型最近一次完成的运行（可按模型名筛选）。
+    两种方式下同一模型的分片运行都合并为一组；显式指定的分片不全或同一模型有多组运行时抛出 ValueError。
+    返回 {模型名: [运行目录, ...]}。
+    """
+    if run_dirs:
+        groups = group_shard_runs(((run_dir, load_run_meta(run_dir)) for run_dir in run_dirs), strict=True)
+    else:
+        groups = scan_runs(results_dir, task)
+        if models:
+            found = {group[0][1].get('model_config', {}).get('model_name') for group in groups}
+            missing = [model for model in models if model not in found]
+            if missing:
+                logger.warning(f"以下模型没有已完成的运行: {', '.join(missing)}")
+            groups = [group for group in groups if group[0][1].get('model_config', {}).get('model_name') in models]
+    selected = {}
+    for group in groups:
+        run_dir, meta = group[0]
+        model = meta.get('model_config', {}).get('model_name', os.path.basename(os.path.normpath(run_dir)))
+        selected[model] = [run_dir for run_dir, _ in group]
+    return selected
+
+
+def compare_models(config, runs, output_dir=None):
+    """
+    对 runs ({模型名: [运行目录, ...]}) 中的模型两两进行成对比较，写入报告并返回报告路径。
+    裁判、限流、缓存与重试沿用 config.yaml 中 online_evaluator 与 evaluation 的配置。
+    """
+    pairwise_config = {**DEFAULT_PAIRWISE_CONFIG, **(config.get('pairwise') or {})}
+    persona = config['evaluation']['prompt_persona']
+    if persona not in PAIRWISE_PROMPTS:
+        raise ValueError(f"评估角色 '{persona}' 没有成对比较模板，可用角色: {', '.join(PAIRWISE_PROMPTS)}")
+    if len(runs) < 2:
+        raise ValueError("成对比较至少需要两个模型的运行结果。")
+    models = sorted(runs)
+
+    if output_dir is None:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        task_name = sanitize_filename(config['evaluation'].get('task_name', 'default_task'))
+        output_dir = os.path.join(config['paths']['results_dir'], f"pairwise_{task_name}_{timestamp}")
+    os.makedirs(output_dir, exist_ok=True)
+    logger.info(f"成对比较结果将保存在: {output_dir}")
+
+    metrics = RunMetrics(labels={'mode': 'pairwise'})
+    with metrics.stage('load'):
+        answers = {model: load_answers(run_dirs) for model, run_dirs in runs.items()}
+    total = sum(len(answers[a].keys() & answers[b].keys()) for a, b in itertools.combinations(models, 2))
+    logger.info(f"共 {len(models)} 个模型、{total} 场比较（每场一次裁判请求）。")
+
+    judge_max_concurrency, rate_limiter, _ = create_judge_rate_limiters(config)
+    cache = ResultCache.from_config(config.get('cache'))
+    trace = TraceWriter(os.path.join(output_dir, TRACE_FILE)) if config.get('logging', {}).get('trace', True) else None
+    writer = JsonlAppender(os.path.join(output_dir, PAIRWISE_DETAILS_FILE))
+    evaluator = OnlineEvaluator(config['models']['online_evaluator'], persona, rate_limiter=rate_limiter, cache=cache, trace=trace, metrics=metrics)
+    try:
+        with metrics.stage('judge'):
+            records, failures = run_pairwise(evaluator, iter_matchups(models, answers, pairwise_config['seed']), writer.append,
+                                             max_in_flight=config['evaluation'].get('max_workers', judge_max_concurrency), total=total)
+        del answers
+        metrics.set('cache', {'judge_pairwise': evaluator.cache_stats.as_dict()})
+        with metrics.stage('report'):
+            result = aggregate_pairwise(records, models, PERSONA_DIMENSIONS.get(persona, []), pairwise_config['base_rating'])
+            result.update(generated_at=datetime.now().isoformat(timespec='seconds'), judge_model=evaluator.model, persona=persona,
+                          failures=failures, runs=runs)
+            with open(os.path.join(output_dir, PAIRWISE_RESULT_FILE), 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            report_path = write_pairwise_markdown(result, os.path.join(output_dir, PAIRWISE_REPORT_FILE))
+    finally:
+        writer.close()
+        evaluator.close()
+        if cache:
+            cache.close()
+        if trace:
+            trace.close()
+        metrics.write(output_dir, prometheus=config.get('metrics', {}).get('prometheus', False))
+    if failures:
+        logger.warning(f"{failures} 场比较失败（请求出错或结果无法解析），未计入评分。")
+    return report_path
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="LLM-Auto-Evaluator 成对比较")
+    parser.add_argument('--config', default='config.yaml', help="配置文件路径")
+    parser.add_argument('--models', nargs='+', metavar='MODEL', help="只比较这些模型（取各自最近一次完成的运行）")
+    parser.add_argument('--runs', nargs='+', metavar='RUN_DIR', help="直接指定参与比较的运行目录")
+    parser.add_argument('--task', help="只使用该 task_name 的运行")
+    parser.add_argument('--output-dir', help="输出目录（默认 results_dir/pairwise_<任务名>_<时间戳>）")
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], type=str.upper,
+                        help="日志级别，覆盖 config.yaml 中的 logging.level")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    config = load_config(args.config)
+    logging_config = config.get('logging', {})
+    setup_logging(args.log_level or logging_config.get('level', 'INFO'), logging_config.get('log_file'))
+    runs = select_runs(config['paths']['results_dir'], args.models, args.runs, args.task)
+    report_path = compare_models(config, runs, args.output_dir)
+    logger.info(f"成对比较报告已生成: {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+# pipeline.py
+# 流水线式的“生成 -> 评估”执行器：每生成一个答案就立即送入有界队列交给评估线程，
+# 评估阶段无需等待全部答案生成完毕，总耗时约为 max(生成, 评估) 而不是两者之和。
+# 评估请求以协程形式提交到裁判的后台事件循环 (async_runtime.BackgroundLoop)，少量线程即可支撑大量在途请求。
+
+import time
+import logging
+import queue
+import threading
+from progress import ProgressBoard
+
+logger = logging.getLogger(__name__)
+
+_SENTINEL = object()
+
+# 生成线程向已满的队列写入时，每隔这么多秒检查一次分发线程是否已退出
+_PUT_POLL_SECONDS = 0.5
+
+# 非评分字段；其余取值为数字的顶层字段都视为评分维度（附加的元数据应使用嵌套字典或字符串）
+META_COLUMNS = frozenset({'id', 'scenario', 'sub_scenario', 'prompt', 'ideal_output', 'notes_for_evaluation', 'answer', 'reason', 'strengths', 'weaknesses'})
+
+
+def score_columns_of(record):
+    """返回记录中的评分维度（数值型、非元数据字段）"""
+    return [key for key, value in record.items()
+            if key not in META_COLUMNS and isinstance(value, (int, float)) and not isinstance(value, bool)]
+
+
+def merge_evaluation(task_item, eval_result):
+    """把评估结果合并回题目记录（评分维度平铺到顶层）"""
+    if eval_result:
+        eval_result = dict(eval_result)
+        scores = eval_result.pop('scores', {})
+        task_item.update(eval_result)
+        task_item.update(scores)
+    else:
+        task_item.update({'reason': 'Evaluation failed', 'strengths': 'N/A', 'weaknesses': 'N/A'})
+    return task_item
+
+
+def score_view(record):
+    """只保留题目ID与评分维度的轻量视图，作为流水线的返回值；完整记录只保存在结果文件中"""
+    view = {'id': record.get('id')}
+    view.update((col, record[col]) for col in score_columns_of(record))
+    return view
+
+
+def _iter_answers(questions, ollama_runner, answered, on_answer):
+    """
+    按完成顺序产出带答案的记录。questions 可以是惰性迭代器，只会被遍历一次。
+    answered 中已有答案的题目（恢复运行时，只应包含尚未完成评估的题目）不再生成，与新生成的答案交替产出；
+    它们不经过额外的缓冲区，进入评估队列的速度同样受流水线背压约束。其余题目交给 ollama_runner 并发生成。
+    """
+    previous_answers = iter(answered.values())
+
+    def generation_tasks():
+        for q in questions:
+            if str(q.get('id')) not in answered:
+                yield q, q['prompt']
+
+    for q, answer, metrics in ollama_runner.generate_many(generation_tasks(), with_metrics=True):
+        previous = next(previous_answers, None)
+        if previous is not None:
+            yield previous
+        q['answer'] = answer
+        if metrics:
+            q['gen_metrics'] = metrics
+        if on_answer:
+            on_answer(q)
+        yield q
+    yield from previous_answers
+
+
+def run_generate_and_judge(questions, ollama_runner, online_evaluator, max_workers, queue_size=None, desc="", progress=None,
+                           answered=None, on_answer=None, on_result=None, batch_linger=2.0, total=None, metrics=None, on_generated=None):
+    """
+    以流水线方式执行生成与评估。questions 可以是惰性迭代器（流式读取题库），total 为题目数，仅用于进度显示。
+    - 生成线程通过 ollama_runner.generate_many 并发生成答案，并放入有界队列；
+      队列已满时生成线程会阻塞，从而对生成端施加背压，避免答案在内存中堆积。
+    - 分发线程从队列中取出答案，立即提交 online_evaluator.evaluate_single_async，
+      每个模型同时在途的评估请求不超过 max_workers（全局并发与RPM/TPM由裁判的共享限流器控制）。
+    progress 为 progress.ModelProgress 句柄；多模型并发时由调用方传入以汇总到同一进度视图。
+    answered 为 {题目ID: 已有答案记录}，用于恢复运行时跳过已生成的题目，直接送入评估。
+    on_answer / on_result 在每个新答案、每条评估结果完成时被调用，用于逐条追加写盘；
+    完整记录交给 on_result 后即被释放，流水线只保留每题的ID与评分。
+    online_evaluator.batch_size > 1 时，分发线程会把最多 batch_size 道题目打包成一次裁判请求；
+    凑批最多等待 batch_linger 秒，避免生成较慢时答案长时间积压。
+    metrics 为 run_metrics.RunMetrics 时记录 generation（至最后一个答案生成）与 judging（至最后一条评估完成）阶段耗时，
+    两者在流水线中相互重叠，均从流水线启动时开始计时。
+    on_generated 在全部答案生成完毕（评估可能仍在进行）时于生成线程中调用一次，用于卸载模型、让出Ollama主机。
+    分发线程出错时生成线程随即停止，已提交的评估照常收集，随后把分发线程的异常抛给调用方。
+    返回按完成顺序排列的 score_view 列表（题目ID与评分）。
+    """
+    queue_size = queue_size or max_workers * 2
+    answered = answered or {}
+    answer_queue = queue.Queue(maxsize=queue_size)
+    done_queue = queue.Queue()
+    in_flight = threading.BoundedSemaphore(max_workers)
+    evaluation_results = []
+    producer_errors = []
+    dispatcher_errors = []
+    # 分发线程退出后不再有人从 answer_queue 取数据，生成线程据此停止写入，避免永久阻塞
+    dispatch_stopped = threading.Event()
+
+    own_board = None
+    if progress is None:
+        own_board = ProgressBoard()
+        progress = own_board.add_model(desc, total or 0)
+
+    started = time.monotonic()
+
+    def put(item):
+        """队列已满时阻塞等待（背压）；分发线程已退出时放弃写入并返回 False"""
+        while not dispatch_stopped.is_set():
+            try:
+                answer_queue.put(item, timeout=_PUT_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for task_item in _iter_answers(questions, ollama_runner, answered, on_answer):
+                progress.generated()
+                if not put(task_item):
+                    logger.warning(f"{desc} 评估分发已停止，不再继续生成答案。")
+                    break
+        except Exception as e:
+            producer_errors.append(e)
+        finally:
+            if metrics:
+                metrics.record_stage('generation', time.monotonic() - started)
+            put(_SENTINEL)
+            if on_generated:
+                try:
+                    on_generated()
+                except Exception as e:
+                    logger.warning(f"生成结束回调出错: {e}")
+
+    batch_size = getattr(online_evaluator, 'batch_size', 1)
+
+    def next_batch():
+        """从队列中凑一批答案，返回 (批次, 是否已到队列末尾)"""
+        first = answer_queue.get()
+        if first is _SENTINEL:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + batch_linger
+        while len(batch) < batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                task_item = answer_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if task_item is _SENTINEL:
+                return batch, True
+            batch.append(task_item)
+        return batch, False
+
+    def dispatch():
+        # 把答案提交到裁判的后台事件循环；同时在途（含等待收集）的评估请求不超过 max_workers
+        submitted = 0
+        try:
+            finished = False
+            while not finished:
+                batch, finished = next_batch()
+                if not batch:
+                    break
+                in_flight.acquire()
+                future = online_evaluator.runtime.submit(online_evaluator.evaluate_batch_async(batch))
+                future.add_done_callback(lambda f, items=batch: done_queue.put((items, f)))
+                submitted += 1
+        except Exception as e:
+            logger.error(f"{desc} 分发评估请求时出错: {e}")
+            dispatcher_errors.append(e)
+        finally:
+            dispatch_stopped.set()
+            done_queue.put((_SENTINEL, submitted))
+
+    producer = threading.Thread(target=produce, name="ollama-producer", daemon=True)
+    dispatcher = threading.Thread(target=dispatch, name="judge-dispatcher", daemon=True)
+    producer.start()
+    dispatcher.start()
+
+    # 在当前线程收集评估结果，文件写入等操作不会阻塞事件循环
+    collected = 0
+    total_submitted = None
+    while total_submitted is None or collected < total_submitted:
+        batch, future = done_queue.get()
+        if batch is _SENTINEL:
+            total_submitted = future
+            continue
+        try:
+            batch_results = future.result()
+            batch_error = None
+        except Exception as e:
+            batch_results = [None] * len(batch)
+            batch_error = e
+        for result_item, eval_result in zip(batch, batch_results):
+            # 答案在入队前已写入 ollama_answers，这里直接在原记录上合并评估结果，不再复制
+            if batch_error is not None:
+                logger.error(f"评估题目 {result_item['id']} 时主循环捕获到意外出错: {batch_error}")
+                result_item.update({'reason': str(batch_error), 'strengths': 'Error', 'weaknesses': 'Error'})
+            else:
+                merge_evaluation(result_item, eval_result)
+            if on_result:
+                on_result(result_item)
+            evaluation_results.append(score_view(result_item))
+            progress.judged()
+        collected += 1
+        in_flight.release()
+
+    producer.join()
+    dispatcher.join()
+    if metrics:
+        metrics.record_stage('judging', time.monotonic() - started)
+
+    if own_board is not None:
+        progress.close()
+        own_board.close()
+
+    if dispatcher_errors:
+        raise dispatcher_errors[0]
+    if producer_errors:
+        raise producer_errors[0]
+
+    return evaluation_results
+
+
+def run_generate_then_batch_judge(questions, ollama_runner, batch_judge, desc="", progress=None,
+                                  answered=None, on_answer=None, on_result=None, total=None, metrics=None, on_generated=None):
+    """
+    离线批处理模式：先生成全部答案，再通过 batch_judge(task_items) -> {题目ID: 评估结果} 一次性评估。
+    批处理请求需要一次性提交，本次待评估的全部答案记录会在内存中保留到评估结束。
+    参数与返回值与 run_generate_and_judge 相同。
+    """
+    answered = answered or {}
+    own_board = None
+    if progress is None:
+        own_board = ProgressBoard()
+        progress = own_board.add_model(desc, total or 0)
+
+    started = time.monotonic()
+    tasks_with_answers = []
+    for task_item in _iter_answers(questions, ollama_runner, answered, on_answer):
+        tasks_with_answers.append(task_item)
+        progress.generated()
+    generated = time.monotonic()
+    if on_generated:
+        on_generated()
+
+    batch_results = batch_judge(tasks_with_answers)
+    if metrics:
+        metrics.record_stage('generation', generated - started)
+        metrics.record_stage('judging', time.monotonic() - generated)
+    evaluation_results = []
+    for task_item in tasks_with_answers:
+        result_item = merge_evaluation(task_item, batch_results.get(str(task_item.get('id'))))
+        if on_result:
+            on_result(result_item)
+        evaluation_results.append(score_view(result_item))
+        progress.judged()
+
+    if own_board is not None:
+        progress.close()
+        own_board.close()
+
+    return evaluation_results
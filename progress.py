@@ -0,0 +1,82 @@
+# progress.py
+# 多模型并发评估时的合并进度视图：顶部一条总进度条，每个模型各占一行
+
+import threading
+
+
+class ModelProgress:
+    """单个模型的进度句柄，供流水线中的生成/评估线程调用"""
+
+    def __init__(self, board, bar, total, position):
+        self._board = board
+        self._bar = bar
+        self._lock = threading.Lock()
+        self._position = position
+        self._closed = False
+        self.total = total
+        self.generated_count = 0
+        self.judged_count = 0
+
+    def generated(self, n=1):
+        with self._lock:
+            self.generated_count += n
+            self._bar.set_postfix_str(f"生成 {self.generated_count}/{self.total}")
+
+    def judged(self, n=1):
+        with self._lock:
+            self.judged_count += n
+            self._bar.update(n)
+        self._board.advance(n)
+
+    def close(self):
+        """模型评估结束时关闭其进度条，并把所在行让给之后加入的模型；重复调用无副作用"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._bar.close()
+        self._board.release(self._position)
+
+
+class ProgressBoard:
+    """
+    合并进度视图。每个模型一行，显示“已评估/总数”以及生成进度；
+    第一行汇总所有模型的评估进度。模型结束后其所在行会被之后加入的模型复用。
+    """
+
+    def __init__(self):
+        # tqdm 只在真正显示进度时导入，不计入 main 的启动耗时
+        from tqdm import tqdm
+
+        self._lock = threading.Lock()
+        self._slots = 0
+        self._free_slots = []
+        self._overall = tqdm(total=0, desc="全部模型", position=0)
+
+    def add_model(self, name, total):
+        from tqdm import tqdm
+
+        with self._lock:
+            if self._free_slots:
+                position = min(self._free_slots)
+                self._free_slots.remove(position)
+            else:
+                self._slots += 1
+                position = self._slots
+            self._overall.total += total
+            self._overall.refresh()
+        bar = tqdm(total=total, desc=f"{name} 评估", position=position)
+        progress = ModelProgress(self, bar, total, position)
+        progress.generated(0)
+        return progress
+
+    def release(self, position):
+        with self._lock:
+            self._free_slots.append(position)
+
+    def advance(self, n=1):
+        with self._lock:
+            self._overall.update(n)
+
+    def close(self):
+        self._overall.close()
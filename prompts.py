@@ -131,6 +131,203 @@ EVALUATION_PROMPTS = {
     "strict_code_reviewer": STRICT_CODE_REVIEWER_PERSONA,
 }
 
+# 各角色的评分维度，与上面模板中 "scores" 的键一致；分级评估的规则层按这些维度直接给分
+PERSONA_DIMENSIONS = {
+    "default": ["accuracy", "relevance", "completeness", "logic", "instruction_following"],
+    "strict_code_reviewer": ["correctness", "efficiency", "style_and_convention", "readability", "security"],
+}
+
+
+# --- 批量评估角色 (Batch Evaluation Personas) ---
+# 一次请求打包多道题目，评估标准只出现一次，以节省重复的提示词开销。
+# {items} 由多个 BATCH_ITEM_TEMPLATE 拼接而成，要求裁判按题目ID返回JSON数组。
+
+BATCH_ITEM_TEMPLATE = """
+## 题目 ID: {id}
+- **主场景:** {scenario}
+- **子场景:** {sub_scenario}
+
+- **用户问题 (Prompt):**
+```
+{prompt}
+```
+
+- **AI助手的回答:**
+```
+{answer}
+```
+
+- **理想答案参考 (Ideal Output):**
+```
+{ideal_output}
+```
+
+- **评估要点 (Notes for Evaluation):**
+```
+{notes_for_evaluation}
+```
+"""
+
+DEFAULT_BATCH_PERSONA = """
+你现在是一个专业、严格、公正的大语言模型能力评估专家。
+你的任务是基于丰富的上下文信息，逐一评估一个AI助手对下列多道题目的回答质量。各题目相互独立，请分别评估，不要相互影响。
+
+请综合利用每道题目的所有输入信息，特别是【理想答案参考】和【评估要点】，对AI助手的回答在【每个维度】上进行1-10分的打分。
+请尽可能严格，对于微小的错误也要扣分，避免给出过高的分数。
+
+# 评估维度
+- **准确性 (accuracy)**：回答是否准确无误，没有事实性错误。
+- **相关性 (relevance)**：回答是否紧扣问题，没有偏离主题。
+- **完整性 (completeness)**：回答是否全面，覆盖了问题的主要方面。
+- **逻辑性 (logic)**：回答的逻辑是否清晰、连贯，没有矛盾之处。
+- **遵循指令 (instruction_following)**：回答是否严格遵循了【评估要点】中的所有指示。
+
+# 待评估题目
+{items}
+
+# 输出要求
+请严格按照以下JSON数组格式返回所有题目的评估结果，每道题目一个对象，"id" 必须与题目ID完全一致，不要添加任何额外的解释或说明。
+
+```json
+[
+  {{
+    "id": "<题目ID>",
+    "scores": {{
+      "accuracy": <1-10的整数>,
+      "relevance": <1-10的整数>,
+      "completeness": <1-10的整数>,
+      "logic": <1-10的整数>,
+      "instruction_following": <1-10的整数>
+    }},
+    "reason": "<你给出这个综合评分的详细理由，说明AI的回答与理想答案的差距，以及是否满足了评估要点>",
+    "strengths": "<总结回答的优点>",
+    "weaknesses": "<总结回答的缺点>"
+  }}
+]
+```
+"""
+
+STRICT_CODE_REVIEWER_BATCH_PERSONA = """
+你现在是一个极其严格和挑剔的代码评审专家 (Code Reviewer)。
+你的任务是基于代码需求、理想实现和评估要点，逐一评估一个AI助手对下列多道题目生成的代码质量。各题目相互独立，请分别评估，不要相互影响。
+
+请综合每道题目的所有信息，对AI助手的代码回答在【每个维度】上进行1-10分的打分。
+请极度严格，任何不符合最佳实践、潜在的bug、不够优雅的实现都应该被严厉扣分。
+
+# 评估维度
+- **正确性 (correctness)**：代码是否能正确运行并实现功能，没有bug。
+- **效率 (efficiency)**：代码的性能如何，是否使用了高效的算法和数据结构。
+- **规范性 (style_and_convention)**：代码是否遵循了通用的编码规范（如PEP8），命名是否清晰。
+- **可读性 (readability)**：代码是否易于理解和维护，是否有必要的注释。
+- **安全性 (security)**：代码是否存在明显的安全漏洞。
+
+# 待评估题目
+{items}
+
+# 输出要求
+请严格按照以下JSON数组格式返回所有题目的评估结果，每道题目一个对象，"id" 必须与题目ID完全一致，不要添加任何额外的解释或说明。
+
+```json
+[
+  {{
+    "id": "<题目ID>",
+    "scores": {{
+      "correctness": <1-10的整数>,
+      "efficiency": <1-10的整数>,
+      "style_and_convention": <1-10的整数>,
+      "readability": <1-10的整数>,
+      "security": <1-10的整数>
+    }},
+    "reason": "<你给出这个综合评分的详细理由，说明AI的代码与理想实现的差距>",
+    "strengths": "<总结代码的优点>",
+    "weaknesses": "<总结代码的缺点>"
+  }}
+]
+```
+"""
+
+# 与 EVALUATION_PROMPTS 按角色名一一对应；没有批量模板的角色只能逐题评估
+BATCH_EVALUATION_PROMPTS = {
+    "default": DEFAULT_BATCH_PERSONA,
+    "strict_code_reviewer": STRICT_CODE_REVIEWER_BATCH_PERSONA,
+}
+
+
+# --- 成对比较角色 (Pairwise Personas) ---
+# 同一道题目的两个回答在一次请求中比较，裁判按维度给出偏好（A / B / tie）以及总体胜负。
+# 两个回答的先后位置由调用方随机打乱，以抵消裁判对位置的偏好。
+
+PAIRWISE_PERSONA = """
+你现在是一个专业、严格、公正的大语言模型能力评估专家。
+你的任务是基于丰富的上下文信息，比较两个AI助手（回答A与回答B）对同一问题的回答，判断哪一个更好。
+
+请综合利用所有输入信息，特别是【理想答案参考】和【评估要点】，在【每个维度】上分别判断哪个回答更好。
+两个回答的先后顺序是随机的，不代表任何优劣，请不要因为位置或长度而偏向任何一方。
+只有两个回答在该维度上确实难分高下时才判为平局 (tie)。
+
+# 评估维度
+- **准确性 (accuracy)**：回答是否准确无误，没有事实性错误。
+- **相关性 (relevance)**：回答是否紧扣问题，没有偏离主题。
+- **完整性 (completeness)**：回答是否全面，覆盖了问题的主要方面。
+- **逻辑性 (logic)**：回答的逻辑是否清晰、连贯，没有矛盾之处。
+- **遵循指令 (instruction_following)**：回答是否严格遵循了【评估要点】中的所有指示。
+
+# 输入信息
+## 场景
+- **主场景:** {scenario}
+- **子场景:** {sub_scenario}
+
+## 评估任务
+- **用户问题 (Prompt):**
+```
+{prompt}
+```
+
+- **回答A:**
+```
+{answer_a}
+```
+
+- **回答B:**
+```
+{answer_b}
+```
+
+## 评估参考标准
+- **理想答案参考 (Ideal Output):**
+```
+{ideal_output}
+```
+
+- **评估要点 (Notes for Evaluation):**
+```
+{notes_for_evaluation}
+```
+
+# 输出要求
+请严格按照以下JSON格式返回你的比较结果，不要添加任何额外的解释或说明。
+每个取值只能是 "A"、"B" 或 "tie"。
+
+```json
+{{
+  "preferences": {{
+    "accuracy": "<A|B|tie>",
+    "relevance": "<A|B|tie>",
+    "completeness": "<A|B|tie>",
+    "logic": "<A|B|tie>",
+    "instruction_following": "<A|B|tie>"
+  }},
+  "winner": "<A|B|tie>",
+  "reason": "<你做出这个判断的详细理由，说明两个回答各自与理想答案的差距>"
+}}
+```
+"""
+
+# 可用于成对比较的角色，维度与 PERSONA_DIMENSIONS 中的同名角色一致
+PAIRWISE_PROMPTS = {
+    "default": PAIRWISE_PERSONA,
+}
+
 
 # --- 总结报告 Prompt (保持不变) ---
 SUMMARY_PROMPT = """
@@ -159,3 +356,66 @@ SUMMARY_PROMPT = """
 
 请确保你的分析客观、深入，并直接以Markdown格式输出报告内容。
 """
+
+# --- 分块(Map-Reduce)总结 ---
+# 评估结果过多、无法放入单次请求时，先按场景分块分别总结，再把各块的阶段性总结合并为最终报告。
+
+CHUNK_SUMMARY_PROMPT = """
+你是一位资深的大语言模型分析师。
+以下是某个小模型在业务场景「{scenario}」下的一部分逐题评估结果（第 {chunk_index}/{chunk_count} 块）。
+请提炼这部分结果中的关键结论，供后续汇总成完整报告使用。
+
+# 本块统计
+{chunk_stats}
+
+# 评估结果详情
+---
+{evaluation_results}
+---
+
+# 输出要求
+请用简洁的Markdown要点输出（不超过400字）：
+1. 本块的整体表现。
+2. 突出的亮点，附上题目ID和得分作为证据。
+3. 普遍性的问题或弱点，附上题目ID和得分作为证据。
+只输出要点，不要写开场白。
+"""
+
+MERGE_PARTIAL_SUMMARY_PROMPT = """
+你是一位资深的大语言模型分析师。
+以下是对同一个小模型若干部分评估结果的阶段性总结。请把它们合并为一份更精炼的阶段性总结，
+保留关键的数据、题目ID证据以及不同场景之间的差异，去除重复内容（不超过600字）。
+
+# 阶段性总结
+---
+{partial_summaries}
+---
+"""
+
+MERGE_SUMMARY_PROMPT = """
+你是一位资深的大语言模型分析师。
+你的任务是基于对某个小模型评估结果的分块总结，撰写一份全面的能力总结报告。
+
+# 整体统计
+{overall_stats}
+
+# 分块总结
+以下是按业务场景分块得到的阶段性总结：
+---
+{partial_summaries}
+---
+
+# 报告撰写要求
+请根据以上数据，撰写一份Markdown格式的总结报告，内容应包括：
+
+1.  **整体表现概述 (Overall Performance)**：对模型的整体能力给出一个综合性的评价。
+2.  **能力亮点分析 (Strengths Analysis)**：
+    * 分析模型在哪些业务场景或能力维度上表现突出。
+    * 请结合具体的题目ID和得分作为证据。
+3.  **主要弱点分析 (Weaknesses Analysis)**：
+    * 分析模型在哪些方面存在普遍性的问题或不足。
+    * 请结合具体的题目ID和得分作为证据。
+4.  **改进建议 (Suggestions for Improvement)**：基于以上分析，为模型的后续优化提出具体的建议。
+
+请确保你的分析客观、深入，并直接以Markdown格式输出报告内容。
+"""
@@ -0,0 +1,182 @@
+# rate_limiter.py
+# 裁判API的限流与重试策略：
+# - 令牌桶分别限制每分钟请求数(RPM)与每分钟token数(TPM)
+# - 自适应并发：根据观测到的延迟与限流/错误情况动态调整同时在途的请求数 (AIMD)
+# - 抖动指数退避，并优先遵循服务端返回的 Retry-After
+# 所有异步原语都在首次使用时于事件循环内创建，因此需在同一个事件循环（async_runtime.BackgroundLoop）中使用。
+
+import time
+import random
+import asyncio
+from contextlib import asynccontextmanager
+
+
+def estimate_tokens(text):
+    """粗略估算文本的token数：中文约1字1token，其他字符约4字符1token"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if '一' <= ch <= '鿿')
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0, retry_after=None):
+    """
+    计算第 attempt 次重试（从0开始）前的等待秒数。
+    有 Retry-After 时以其为准并加少量抖动，否则使用 full-jitter 指数退避。
+    """
+    if retry_after is not None:
+        return min(cap, retry_after) + random.uniform(0, base)
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class TokenBucket:
+    """按分钟速率补充的令牌桶；rate_per_minute 为空时不限制"""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate_per_second = rate_per_minute / 60.0 if rate_per_minute else None
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate_per_second)
+        self._updated = now
+
+    async def acquire(self, amount=1):
+        if self.rate_per_second is None:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        amount = min(amount, self.capacity)
+        # 持锁等待，保证先到先得，避免大请求被小请求持续插队
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate_per_second)
+
+    def adjust(self, delta):
+        """按实际用量修正预扣的令牌数（delta>0 表示多用，<0 表示退还）"""
+        if self.rate_per_second is None:
+            return
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD 自适应并发：
+    - 请求成功且延迟未明显劣化时，每轮(约 limit 个请求)并发上限加1
+    - 延迟超过基线的 latency_tolerance 倍时小幅收缩，遇到限流/服务端错误时减半
+    """
+
+    def __init__(self, initial, min_limit=1, max_limit=None, latency_tolerance=2.0):
+        self.max_limit = max_limit or initial
+        self.min_limit = max(1, min_limit)
+        self.limit = float(max(self.min_limit, min(initial, self.max_limit)))
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self._latency_ewma = None
+        self._baseline_latency = None
+        self._condition = None
+
+    def _cond(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self):
+        cond = self._cond()
+        async with cond:
+            while self.in_flight >= int(self.limit):
+                await cond.wait()
+            self.in_flight += 1
+
+    async def release(self):
+        cond = self._cond()
+        async with cond:
+            self.in_flight -= 1
+            cond.notify_all()
+
+    def on_success(self, latency):
+        self._latency_ewma = latency if self._latency_ewma is None else 0.8 * self._latency_ewma + 0.2 * latency
+        if self._baseline_latency is None or self._latency_ewma < self._baseline_latency:
+            self._baseline_latency = self._latency_ewma
+        if self._latency_ewma > self._baseline_latency * self.latency_tolerance:
+            self.limit = max(self.min_limit, self.limit * 0.9)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def on_overload(self):
+        self.limit = max(self.min_limit, self.limit / 2)
+
+
+class JudgeRateLimiter:
+    """
+    组合RPM/TPM令牌桶与自适应并发，供所有模型的裁判请求共享。
+    用法：
+        async with limiter.slot(estimated_tokens):
+            ...发起请求...
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, max_concurrency=10, min_concurrency=1,
+                 initial_concurrency=None, latency_tolerance=2.0, max_retries=5, backoff_base=1.0, backoff_cap=60.0):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.concurrency = AdaptiveConcurrencyLimiter(
+            initial_concurrency or max_concurrency, min_limit=min_concurrency,
+            max_limit=max_concurrency, latency_tolerance=latency_tolerance,
+        )
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._paused_until = 0.0
+
+    @classmethod
+    def from_config(cls, rate_limit_config, max_concurrency):
+        rate_limit_config = rate_limit_config or {}
+        return cls(
+            requests_per_minute=rate_limit_config.get('requests_per_minute'),
+            tokens_per_minute=rate_limit_config.get('tokens_per_minute'),
+            max_concurrency=max_concurrency,
+            min_concurrency=rate_limit_config.get('min_concurrency', 1),
+            initial_concurrency=rate_limit_config.get('initial_concurrency'),
+            latency_tolerance=rate_limit_config.get('latency_tolerance', 2.0),
+            max_retries=rate_limit_config.get('max_retries', 5),
+            backoff_base=rate_limit_config.get('backoff_base_seconds', 1.0),
+            backoff_cap=rate_limit_config.get('backoff_cap_seconds', 60.0),
+        )
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens=0):
+        await self.concurrency.acquire()
+        try:
+            # 收到 Retry-After 后全局暂停，避免其他请求继续撞上限流
+            delay = self._paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self.requests.acquire(1)
+            await self.tokens.acquire(estimated_tokens)
+            yield
+        finally:
+            await self.concurrency.release()
+
+    def on_success(self, latency, estimated_tokens=0, actual_tokens=None):
+        self.concurrency.on_success(latency)
+        if actual_tokens is not None:
+            self.tokens.adjust(actual_tokens - estimated_tokens)
+
+    def on_throttle(self, retry_after=None):
+        self.concurrency.on_overload()
+        if retry_after:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+    def on_error(self):
+        self.concurrency.on_overload()
+
+    def retry_delay(self, attempt, retry_after=None):
+        return backoff_delay(attempt, self.backoff_base, self.backoff_cap, retry_after)
@@ -1,46 +1,265 @@
 # report_generator.py
 # 升级版：在报告中展示更丰富的上下文信息
+# 统计部分只读取 id/场景/评分列并使用紧凑的数值类型，逐题详情以流式方式从 evaluation_details.jsonl 写出
+# 题目较少时统计由 report_stats 用标准库完成，只有结果较多时才导入 pandas
 
 import os
 import json
-import pandas as pd
 from datetime import datetime
+from pipeline import score_columns_of
+
+DEFAULT_PASS_THRESHOLD = 6
+
+# 题目数超过该值时才用 pandas 计算统计，可被 config.yaml 中的 report.pandas_min_rows 覆盖
+DEFAULT_PANDAS_MIN_ROWS = 20000
+
+# 统计表中代表“全部场景”的分组键
+OVERALL_KEY = '__overall__'
+
+# 报告中展示的本地模型生成性能指标（来自答案记录的 gen_metrics）
+LATENCY_METRICS = ('ttft_s', 'total_s', 'tokens_per_s')
+
+# 分级评估各层在报告中的名称（来自评估结果的 cascade.tier）
+CASCADE_TIERS = {'heuristic': "规则层", 'cheap': "低成本裁判", 'main': "主裁判"}
+
+
+def _with_overall(long_df):
+    """追加一份场景标记为 OVERALL_KEY 的副本，使整体与分场景的统计在同一次 groupby 中得到"""
+    import pandas as pd
+
+    overall_df = long_df.assign(scenario=OVERALL_KEY)
+    long_df = long_df.assign(scenario=long_df['scenario'].astype(str))
+    long_df = pd.concat([long_df, overall_df], ignore_index=True)
+    long_df['scenario'] = long_df['scenario'].astype('category')
+    return long_df
+
+
+def _is_missing(value):
+    """None 或 NaN"""
+    return value is None or value != value
+
+
+def iter_details(details_path):
+    """逐行读取 evaluation_details.jsonl"""
+    with open(details_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
 
 class ReportGenerator:
     def __init__(self, output_dir):
         self.output_dir = output_dir
 
-    def _calculate_stats(self, df):
-        """计算多维度统计数据"""
+    def _load_score_frame(self, details_path):
+        """
+        只提取 id、场景、评分列与生成性能指标，构建使用 float32/category 类型的紧凑DataFrame，
+        prompt、answer 等长文本不会进入内存。返回 (DataFrame, 评分列)。
+        """
+        import numpy as np
+        import pandas as pd
+
+        ids, scenarios, tiers = [], [], []
+        score_data = {}
+        extra_data = {}
+        metric_data = {name: [] for name in LATENCY_METRICS}
+
+        def put(columns, col, row_index, value):
+            if col not in columns:
+                columns[col] = [np.nan] * row_index
+            columns[col].append(value)
+
+        for row_index, record in enumerate(iter_details(details_path)):
+            ids.append(str(record.get('id')))
+            scenarios.append(record.get('scenario'))
+            for col in score_columns_of(record):
+                put(score_data, col, row_index, record[col])
+            score_spread = record.get('score_spread')
+            if score_spread:
+                put(extra_data, 'judge_samples', row_index, score_spread.get('samples', np.nan))
+                for dim, value in (score_spread.get('std') or {}).items():
+                    put(extra_data, f"{dim}__std", row_index, value)
+                for dim, value in (score_spread.get('range') or {}).items():
+                    put(extra_data, f"{dim}__range", row_index, value)
+            cascade = record.get('cascade')
+            tiers.append(cascade.get('tier') if cascade else None)
+            if cascade:
+                put(extra_data, 'cheap_tokens', row_index, cascade.get('cheap_tokens', 0))
+                put(extra_data, 'main_tokens_saved', row_index, cascade.get('main_tokens_saved', 0))
+            gen_metrics = record.get('gen_metrics') or {}
+            for name in LATENCY_METRICS:
+                value = gen_metrics.get(name)
+                metric_data[name].append(np.nan if value is None else value)
+            for columns in (score_data, extra_data):
+                for values in columns.values():
+                    if len(values) <= row_index:
+                        values.append(np.nan)
+
+        columns = {col: np.asarray(values, dtype=np.float32) for col, values in score_data.items()}
+        columns.update({name: np.asarray(values, dtype=np.float32) for name, values in metric_data.items()})
+        columns.update({name: np.asarray(values, dtype=np.float32) for name, values in extra_data.items()})
+        df = pd.DataFrame(columns, index=pd.RangeIndex(len(ids)))
+        df.insert(0, 'judge_tier', pd.Categorical(tiers, categories=list(CASCADE_TIERS)))
+        df.insert(0, 'scenario', pd.Categorical(scenarios))
+        df.insert(0, 'id', ids)
+        return df, list(score_data)
+
+    def _calculate_spread_stats(self, df, score_columns):
+        """自洽采样的评分离散度：各维度的平均标准差与平均极差，以及平均采样次数"""
+        if 'judge_samples' not in df or not df['judge_samples'].notna().any():
+            return {}
+        dims = [dim for dim in score_columns if f"{dim}__std" in df]
+        std = df[[f"{dim}__std" for dim in dims]].mean()
+        spread_range = df[[f"{dim}__range" for dim in dims if f"{dim}__range" in df]].mean()
+        return {
+            'avg_samples': float(df['judge_samples'].mean()),
+            'items': int(df['judge_samples'].notna().sum()),
+            'dimensions': {dim: {'std': float(std[f"{dim}__std"]), 'range': float(spread_range.get(f"{dim}__range", float('nan')))} for dim in dims},
+        }
+
+    def _calculate_cascade_stats(self, df):
+        """分级评估：各层题数、规则层之外的题目升级给主裁判的比例，以及估算节省的主裁判token"""
+        counts = df['judge_tier'].value_counts()
+        if not counts.sum():
+            return {}
+        judged = int(counts['cheap'] + counts['main'])
+        return {
+            'tiers': {tier: int(counts[tier]) for tier in CASCADE_TIERS},
+            'items': int(counts.sum()),
+            'escalation_rate': counts['main'] / judged if judged else 0.0,
+            'main_tokens_saved': float(df['main_tokens_saved'].sum()),
+            'cheap_tokens': float(df['cheap_tokens'].sum()),
+        }
+
+    def _calculate_latency_stats(self, df):
+        """按场景计算生成性能指标的分位数；命中缓存或生成失败的题目没有 gen_metrics，不计入统计"""
+        import pandas as pd
+
+        metrics = [name for name in LATENCY_METRICS if df[name].notna().any()]
+        if not metrics:
+            return {}
+        long_df = df.melt(id_vars=['scenario'], value_vars=metrics, var_name='metric', value_name='value').dropna(subset=['value'])
+        long_df = _with_overall(long_df)
+        values = long_df.groupby(['scenario', 'metric'], observed=True)['value']
+        table = pd.DataFrame({
+            'count': values.count(),
+            'mean': values.mean(),
+            'p50': values.median(),
+            'p90': values.quantile(0.9),
+            'p99': values.quantile(0.99),
+        })
+        latency_stats = {}
+        for (scenario, metric), row in table.iterrows():
+            latency_stats.setdefault(scenario, {})[metric] = row.to_dict()
+        return latency_stats
+
+    def _calculate_stats(self, df, score_columns, pass_threshold=DEFAULT_PASS_THRESHOLD):
+        """计算多维度统计数据：均值、中位数、标准差、P10/P90与通过率"""
+        import numpy as np
+        import pandas as pd
+
         stats = {'total_questions': len(df)}
-        
-        # 动态找出所有评分维度列
-        score_columns = [col for col in df.columns if col not in ['id', 'scenario', 'sub_scenario', 'prompt', 'ideal_output', 'notes_for_evaluation', 'answer', 'reason', 'strengths', 'weaknesses']]
-        
+
         if not score_columns:
             return stats # 如果没有评分列，直接返回
 
-        for col in score_columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-
         valid_df = df.dropna(subset=score_columns, how='all')
         stats['evaluated_questions'] = len(valid_df)
 
         if len(valid_df) == 0:
             return stats
 
-        avg_scores = valid_df[score_columns].mean().to_dict()
-        stats['avg_scores'] = avg_scores
-        
-        scenario_avg_scores = valid_df.groupby('scenario')[score_columns].mean().to_dict('index')
-        stats['scenario_avg_scores'] = {k: {dim: round(score, 2) for dim, score in v.items()} for k, v in scenario_avg_scores.items()}
+        # 转为长表 (scenario, dimension, score)，并追加整体分组
+        long_df = valid_df.melt(id_vars=['scenario'], value_vars=score_columns, var_name='dimension', value_name='score').dropna(subset=['score'])
+        long_df['dimension'] = pd.Categorical(long_df['dimension'], categories=score_columns)
+        long_df['passed'] = (long_df['score'] >= pass_threshold).astype(np.float32)
+        long_df = _with_overall(long_df)
+
+        grouped = long_df.groupby(['scenario', 'dimension'], observed=True)
+        scores = grouped['score']
+        table = pd.DataFrame({
+            'count': scores.count(),
+            'mean': scores.mean(),
+            'median': scores.median(),
+            'std': scores.std(),
+            'p10': scores.quantile(0.1),
+            'p90': scores.quantile(0.9),
+            'pass_rate': grouped['passed'].mean(),
+        })
+        overall = table.xs(OVERALL_KEY, level='scenario')
+        by_scenario = table.drop(index=OVERALL_KEY, level='scenario')
+
+        stats['avg_scores'] = {dim: float(overall.at[dim, 'mean']) for dim in score_columns if dim in overall.index}
+        stats['dimension_stats'] = {dim: overall.loc[dim].to_dict() for dim in stats['avg_scores']}
+        stats['pass_threshold'] = pass_threshold
+
+        scenario_avg_scores = {}
+        scenario_pass_rates = {}
+        for (scenario, dim), row in by_scenario.iterrows():
+            scenario_avg_scores.setdefault(scenario, {})[dim] = round(float(row['mean']), 2)
+            scenario_pass_rates.setdefault(scenario, {})[dim] = float(row['pass_rate'])
+        stats['scenario_avg_scores'] = scenario_avg_scores
+        stats['scenario_pass_rates'] = scenario_pass_rates
 
         return stats
 
-    def generate_markdown_report(self, evaluation_results, summary, config):
-        """生成包含多维度评分和丰富上下文的主评估报告"""
-        df = pd.DataFrame(evaluation_results)
-        stats = self._calculate_stats(df.copy())
+    def _calculate_report_stats(self, details_path, pass_threshold):
+        """用 pandas 计算报告所需的全部统计，返回 (stats, 评分列)"""
+        df, score_columns = self._load_score_frame(details_path)
+        stats = self._calculate_stats(df, score_columns, pass_threshold)
+        stats['latency_stats'] = self._calculate_latency_stats(df)
+        stats['spread_stats'] = self._calculate_spread_stats(df, score_columns)
+        stats['cascade_stats'] = self._calculate_cascade_stats(df)
+        return stats, score_columns
+
+    @staticmethod
+    def _format_metric(row, metric, quantile, unit=""):
+        value = row.get(metric, {}).get(quantile)
+        return "-" if _is_missing(value) else f"{value:.2f}{unit}"
+
+    @staticmethod
+    def _write_comparison(f, comparison):
+        """与上次运行的对比：整体各维度的变化与置信区间，以及各场景的变化（* 表示显著）"""
+        confidence = comparison['confidence']
+        f.write("### 与上次运行的对比\n\n")
+        f.write(f"对比运行: `{comparison['previous_run']}`，按题目ID配对 {comparison['paired_items']} 题"
+                f"（新增 {comparison['new_items']} 题，移除 {comparison['removed_items']} 题，复用上次裁判结论 {comparison['reused_items']} 题）。"
+                f"置信区间由 {comparison['bootstrap_samples']} 次配对 bootstrap 重采样得到。\n\n")
+        overall = comparison['scenarios'].get(OVERALL_KEY, {})
+        f.write(f"| 维度 | 上次 | 本次 | 变化 | {confidence:.0%} 置信区间 | p值 | 显著 |\n")
+        f.write("|:---|:---:|:---:|:---:|:---:|:---:|:---:|\n")
+        for dim, row in overall.items():
+            f.write(f"| {dim} | {row['previous']:.2f} | {row['current']:.2f} | {row['delta']:+.2f} | "
+                    f"[{row['ci_low']:+.2f}, {row['ci_high']:+.2f}] | {row['p_value']:.3f} | {'是' if row['significant'] else '否'} |\n")
+        f.write("\n")
+
+        dims = list(overall)
+        scenarios = [scenario for scenario in comparison['scenarios'] if scenario != OVERALL_KEY]
+        if dims and scenarios:
+            f.write("| 场景 | " + " | ".join(dims) + " |\n")
+            f.write("|:---|" + ":---:|" * len(dims) + "\n")
+            for scenario in scenarios:
+                cells = []
+                for dim in dims:
+                    row = comparison['scenarios'][scenario].get(dim)
+                    cells.append("-" if row is None else f"{row['delta']:+.2f}{'*' if row['significant'] else ''}")
+                f.write(f"| {scenario} | " + " | ".join(cells) + " |\n")
+            f.write("\n")
+
+    def generate_markdown_report(self, details_path, summary, config, comparison=None):
+        """
+        生成包含多维度评分和丰富上下文的主评估报告；details_path 为 evaluation_details.jsonl 的路径，
+        comparison 为 run_comparison.compare_runs 的结果，传入时在报告中加入与上次运行的对比
+        """
+        report_config = config.get('report', {})
+        pass_threshold = report_config.get('pass_threshold', DEFAULT_PASS_THRESHOLD)
+        # 题目较少时用标准库统计，避免为小规模评估导入 pandas；超过 pandas_min_rows 时改用向量化统计
+        from report_stats import calculate_report_stats
+        calculated = calculate_report_stats(details_path, pass_threshold, report_config.get('pandas_min_rows', DEFAULT_PANDAS_MIN_ROWS))
+        if calculated is not None:
+            stats, score_columns = calculated
+        else:
+            stats, score_columns = self._calculate_report_stats(details_path, pass_threshold)
 
         report_path = os.path.join(self.output_dir, "evaluation_report.md")
         summary_path = os.path.join(self.output_dir, "summary.md")
@@ -53,7 +272,7 @@ class ReportGenerator:
             f.write(f"**评估时间:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
             f.write(f"**被评估模型:** `{config['models']['ollama']['model_name']}`\n")
             f.write(f"**评估角色:** `{config['evaluation']['prompt_persona']}`\n\n")
-            
+
             f.write("## 1. 整体评估总结\n\n")
             f.write(summary)
             f.write("\n\n")
@@ -65,6 +284,16 @@ class ReportGenerator:
                 f.write("|" + ":---:|" * len(stats['avg_scores']) + "\n")
                 f.write("| " + " | ".join([f"{score:.2f}" for score in stats['avg_scores'].values()]) + " |\n\n")
 
+            if 'dimension_stats' in stats:
+                f.write(f"### 各维度分布 (通过线: ≥{stats['pass_threshold']})\n\n")
+                f.write("| 维度 | 题数 | 均值 | 中位数 | 标准差 | P10 | P90 | 通过率 |\n")
+                f.write("|:---|:---:|:---:|:---:|:---:|:---:|:---:|:---:|\n")
+                for dim, row in stats['dimension_stats'].items():
+                    std = "-" if _is_missing(row['std']) else f"{row['std']:.2f}"
+                    f.write(f"| {dim} | {int(row['count'])} | {row['mean']:.2f} | {row['median']:.2f} | {std} | "
+                            f"{row['p10']:.2f} | {row['p90']:.2f} | {row['pass_rate']:.1%} |\n")
+                f.write("\n")
+
             if 'scenario_avg_scores' in stats:
                 f.write("### 各场景 & 各维度平均分\n\n")
                 scenarios = list(stats['scenario_avg_scores'].keys())
@@ -77,12 +306,75 @@ class ReportGenerator:
                         f.write(f"| {scenario} | " + " | ".join(scores) + " |\n")
                     f.write("\n")
 
+                    f.write("### 各场景 & 各维度通过率\n\n")
+                    f.write("| 场景 | " + " | ".join(dims) + " |\n")
+                    f.write("|:---|"+ ":---:|" * len(dims) + "\n")
+                    for scenario in scenarios:
+                        rates = [f"{stats['scenario_pass_rates'][scenario].get(dim, 0):.1%}" for dim in dims]
+                        f.write(f"| {scenario} | " + " | ".join(rates) + " |\n")
+                    f.write("\n")
+
+            if comparison:
+                self._write_comparison(f, comparison)
+
+            if stats['spread_stats']:
+                spread_stats = stats['spread_stats']
+                f.write("### 评分一致性 (自洽采样)\n\n")
+                f.write(f"共 {spread_stats['items']} 道题目使用多次采样评分，平均每题采样 {spread_stats['avg_samples']:.2f} 次。"
+                        "标准差与极差越小，裁判对该维度的评分越稳定。\n\n")
+                f.write("| 维度 | 平均标准差 | 平均极差 |\n")
+                f.write("|:---|:---:|:---:|\n")
+                for dim, row in spread_stats['dimensions'].items():
+                    spread_range = "-" if _is_missing(row['range']) else f"{row['range']:.2f}"
+                    f.write(f"| {dim} | {row['std']:.2f} | {spread_range} |\n")
+                f.write("\n")
+
+            if stats['cascade_stats']:
+                cascade_stats = stats['cascade_stats']
+                f.write("### 分级评估\n\n")
+                f.write("| 评估层级 | 题数 | 占比 |\n")
+                f.write("|:---|:---:|:---:|\n")
+                for tier, label in CASCADE_TIERS.items():
+                    count = cascade_stats['tiers'][tier]
+                    f.write(f"| {label} | {count} | {count / cascade_stats['items']:.1%} |\n")
+                f.write(f"\n规则层之外的题目中有 {cascade_stats['escalation_rate']:.1%} 升级给主裁判；"
+                        f"估算节省主裁判 token 约 {cascade_stats['main_tokens_saved']:,.0f}，低成本裁判消耗约 {cascade_stats['cheap_tokens']:,.0f}。\n\n")
+
+            if stats['latency_stats']:
+                latency_stats = stats['latency_stats']
+                f.write("### 本地模型生成性能\n\n")
+                f.write("命中缓存或生成失败的题目不计入。TTFT 为首token延迟，总耗时为单题端到端生成时间。\n\n")
+                f.write("| 场景 | 题数 | TTFT P50 | TTFT P90 | TTFT P99 | 总耗时 P50 | 总耗时 P90 | 总耗时 P99 | tokens/s P50 |\n")
+                f.write("|:---|" + ":---:|" * 8 + "\n")
+                scenarios = [OVERALL_KEY] + [scenario for scenario in latency_stats if scenario != OVERALL_KEY]
+                for scenario in scenarios:
+                    row = latency_stats.get(scenario, {})
+                    label = "整体" if scenario == OVERALL_KEY else scenario
+                    count = int(row['total_s']['count']) if 'total_s' in row else 0
+                    cells = [self._format_metric(row, 'ttft_s', q, 's') for q in ('p50', 'p90', 'p99')]
+                    cells += [self._format_metric(row, 'total_s', q, 's') for q in ('p50', 'p90', 'p99')]
+                    cells.append(self._format_metric(row, 'tokens_per_s', 'p50'))
+                    f.write(f"| {label} | {count} | " + " | ".join(cells) + " |\n")
+                f.write("\n")
+
+            # 逐题详情以流式方式再读一遍结果文件，不在内存中保留长文本
             f.write("## 3. 逐题评估详情\n\n")
-            score_columns = [col for col in df.columns if col not in ['id', 'scenario', 'sub_scenario', 'prompt', 'ideal_output', 'notes_for_evaluation', 'answer', 'reason', 'strengths', 'weaknesses']]
-            for _, row in df.iterrows():
-                scores_str = " | ".join([f"**{col.capitalize()}:** {row.get(col, 'N/A')}" for col in score_columns])
+            for row in iter_details(details_path):
+                spread_std = (row.get('score_spread') or {}).get('std') or {}
+                scores_str = " | ".join([f"**{col.capitalize()}:** {row.get(col, 'N/A')}" + (f" (±{spread_std[col]})" if col in spread_std else "")
+                                         for col in score_columns])
                 f.write(f"### 题目 ID: {row['id']} | 场景: {row['scenario']} / {row['sub_scenario']}\n\n")
                 f.write(f"**得分详情:** {scores_str}\n\n")
+                if row.get('reused_from'):
+                    f.write(f"**裁判结论:** 复用自上次运行 `{row['reused_from']}`\n\n")
+                cascade = row.get('cascade')
+                if cascade:
+                    escalation = f"（升级原因: {cascade['escalation_reason']}）" if cascade.get('escalation_reason') else ""
+                    f.write(f"**评估层级:** {CASCADE_TIERS.get(cascade.get('tier'), cascade.get('tier'))}{escalation}\n\n")
+                gen_metrics = row.get('gen_metrics')
+                if gen_metrics:
+                    f.write(f"**生成性能:** TTFT {gen_metrics.get('ttft_s', 'N/A')}s | 总耗时 {gen_metrics.get('total_s', 'N/A')}s | "
+                            f"{gen_metrics.get('tokens_per_s', 'N/A')} tokens/s\n\n")
                 f.write(f"**问题 (Prompt):**\n```\n{row.get('prompt', 'N/A')}\n```\n\n")
                 f.write(f"**模型回答:**\n```\n{row.get('answer', 'N/A')}\n```\n\n")
                 f.write(f"**理想答案参考:**\n```\n{row.get('ideal_output', 'N/A')}\n```\n\n")
@@ -0,0 +1,185 @@
+# report_stats.py
+# 不依赖 pandas/numpy 的报告统计：题目较少时（不超过 report.pandas_min_rows）直接用标准库计算，
+# 省去导入 pandas 的开销，冒烟评估几乎可以立即出报告。输出结构与 ReportGenerator 的 pandas 统计完全一致。
+
+import math
+from collections import defaultdict
+from pipeline import score_columns_of
+from report_generator import iter_details, OVERALL_KEY, LATENCY_METRICS, CASCADE_TIERS
+
+_NAN = float('nan')
+
+
+def _quantile(sorted_values, q):
+    """线性插值分位数，与 pandas/numpy 的默认方法一致"""
+    position = (len(sorted_values) - 1) * q
+    lower = math.floor(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def _mean(values):
+    return sum(values) / len(values) if values else _NAN
+
+
+def _std(values, mean):
+    """样本标准差 (ddof=1)，与 pandas 一致；少于两个值时为 NaN"""
+    if len(values) < 2:
+        return _NAN
+    return math.sqrt(sum((value - mean) ** 2 for value in values) / (len(values) - 1))
+
+
+def _is_number(value):
+    return value is not None and value == value
+
+
+def load_score_rows(details_path, max_rows=None):
+    """
+    只提取每题的场景、评分、生成性能指标、自洽采样离散度与分级评估信息。
+    题目数超过 max_rows 时返回 None，由调用方改用 pandas 统计。返回 (rows, 评分列)。
+    """
+    rows = []
+    score_columns = {}
+    for record in iter_details(details_path):
+        if max_rows is not None and len(rows) >= max_rows:
+            return None
+        scores = {col: record[col] for col in score_columns_of(record)}
+        for col in scores:
+            score_columns.setdefault(col, None)
+        gen_metrics = record.get('gen_metrics') or {}
+        rows.append({
+            'scenario': str(record.get('scenario')),
+            'scores': scores,
+            'latency': {name: gen_metrics[name] for name in LATENCY_METRICS if _is_number(gen_metrics.get(name))},
+            'score_spread': record.get('score_spread'),
+            'cascade': record.get('cascade'),
+        })
+    return rows, list(score_columns)
+
+
+def calculate_stats(rows, score_columns, pass_threshold):
+    """计算多维度统计数据：均值、中位数、标准差、P10/P90与通过率"""
+    stats = {'total_questions': len(rows)}
+    if not score_columns:
+        return stats
+
+    valid_rows = [row for row in rows if any(_is_number(value) for value in row['scores'].values())]
+    stats['evaluated_questions'] = len(valid_rows)
+    if not valid_rows:
+        return stats
+
+    groups = defaultdict(list)
+    for row in valid_rows:
+        for dim, value in row['scores'].items():
+            if _is_number(value):
+                groups[(row['scenario'], dim)].append(float(value))
+                groups[(OVERALL_KEY, dim)].append(float(value))
+
+    def describe(values):
+        values = sorted(values)
+        mean = _mean(values)
+        return {
+            'count': float(len(values)),
+            'mean': mean,
+            'median': _quantile(values, 0.5),
+            'std': _std(values, mean),
+            'p10': _quantile(values, 0.1),
+            'p90': _quantile(values, 0.9),
+            'pass_rate': sum(1 for value in values if value >= pass_threshold) / len(values),
+        }
+
+    dimension_stats = {dim: describe(groups[(OVERALL_KEY, dim)]) for dim in score_columns if (OVERALL_KEY, dim) in groups}
+    stats['avg_scores'] = {dim: row['mean'] for dim, row in dimension_stats.items()}
+    stats['dimension_stats'] = dimension_stats
+    stats['pass_threshold'] = pass_threshold
+
+    scenario_avg_scores = {}
+    scenario_pass_rates = {}
+    for scenario in sorted({row['scenario'] for row in valid_rows}):
+        for dim in score_columns:
+            values = groups.get((scenario, dim))
+            if not values:
+                continue
+            scenario_avg_scores.setdefault(scenario, {})[dim] = round(_mean(values), 2)
+            scenario_pass_rates.setdefault(scenario, {})[dim] = sum(1 for value in values if value >= pass_threshold) / len(values)
+    stats['scenario_avg_scores'] = scenario_avg_scores
+    stats['scenario_pass_rates'] = scenario_pass_rates
+    return stats
+
+
+def calculate_latency_stats(rows):
+    """按场景计算生成性能指标的分位数；命中缓存或生成失败的题目没有 gen_metrics，不计入统计"""
+    groups = defaultdict(list)
+    for row in rows:
+        for metric, value in row['latency'].items():
+            groups[(row['scenario'], metric)].append(float(value))
+            groups[(OVERALL_KEY, metric)].append(float(value))
+    latency_stats = {}
+    for scenario, metric in sorted(groups):
+        values = sorted(groups[(scenario, metric)])
+        latency_stats.setdefault(scenario, {})[metric] = {
+            'count': float(len(values)),
+            'mean': _mean(values),
+            'p50': _quantile(values, 0.5),
+            'p90': _quantile(values, 0.9),
+            'p99': _quantile(values, 0.99),
+        }
+    return latency_stats
+
+
+def calculate_spread_stats(rows, score_columns):
+    """自洽采样的评分离散度：各维度的平均标准差与平均极差，以及平均采样次数"""
+    samples = [row['score_spread'].get('samples') for row in rows if row['score_spread']]
+    samples = [value for value in samples if _is_number(value)]
+    if not samples:
+        return {}
+    std, spread_range = defaultdict(list), defaultdict(list)
+    for row in rows:
+        spread = row['score_spread'] or {}
+        for dim, value in (spread.get('std') or {}).items():
+            std[dim].append(value)
+        for dim, value in (spread.get('range') or {}).items():
+            spread_range[dim].append(value)
+    return {
+        'avg_samples': _mean(samples),
+        'items': len(samples),
+        'dimensions': {dim: {'std': _mean(std[dim]), 'range': _mean(spread_range.get(dim, []))} for dim in score_columns if dim in std},
+    }
+
+
+def calculate_cascade_stats(rows):
+    """分级评估：各层题数、规则层之外的题目升级给主裁判的比例，以及估算节省的主裁判token"""
+    tiers = {tier: 0 for tier in CASCADE_TIERS}
+    cheap_tokens = main_tokens_saved = 0.0
+    for row in rows:
+        cascade = row['cascade']
+        if not cascade:
+            continue
+        if cascade.get('tier') in tiers:
+            tiers[cascade['tier']] += 1
+        cheap_tokens += cascade.get('cheap_tokens', 0) or 0
+        main_tokens_saved += cascade.get('main_tokens_saved', 0) or 0
+    items = sum(tiers.values())
+    if not items:
+        return {}
+    judged = tiers['cheap'] + tiers['main']
+    return {
+        'tiers': tiers,
+        'items': items,
+        'escalation_rate': tiers['main'] / judged if judged else 0.0,
+        'main_tokens_saved': main_tokens_saved,
+        'cheap_tokens': cheap_tokens,
+    }
+
+
+def calculate_report_stats(details_path, pass_threshold, max_rows=None):
+    """一次读取结果文件并计算报告所需的全部统计；题目数超过 max_rows 时返回 None。返回 (stats, 评分列)"""
+    loaded = load_score_rows(details_path, max_rows)
+    if loaded is None:
+        return None
+    rows, score_columns = loaded
+    stats = calculate_stats(rows, score_columns, pass_threshold)
+    stats['latency_stats'] = calculate_latency_stats(rows)
+    stats['spread_stats'] = calculate_spread_stats(rows, score_columns)
+    stats['cascade_stats'] = calculate_cascade_stats(rows)
+    return stats, score_columns
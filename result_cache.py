@@ -0,0 +1,153 @@
+# result_cache.py
+# 持久化的内容寻址缓存（SQLite），用于缓存Ollama答案与裁判评估结果
+# 缓存键为请求内容的哈希，题目、答案、模板或模型参数任一改变都会自然失效
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+class CacheStats:
+    """线程安全的命中/未命中计数器"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def as_dict(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': round(self.hits / total, 4) if total else 0.0}
+
+    def __str__(self):
+        d = self.as_dict()
+        return f"命中 {d['hits']} / 未命中 {d['misses']} (命中率 {d['hit_rate']:.1%})"
+
+
+class ResultCache:
+    """
+    基于SQLite的键值缓存，按命名空间（如 'ollama'、'judge'）区分不同类型的条目。
+    - max_age_days: 超过该时长未被写入的条目会被淘汰
+    - max_size_mb: 缓存总大小超出上限时，按最近访问时间(LRU)淘汰
+    """
+
+    EVICT_EVERY_N_WRITES = 500
+
+    def __init__(self, path, max_size_mb=None, max_age_days=None):
+        self.path = path
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024) if max_size_mb else None
+        self.max_age_seconds = max_age_days * 86400 if max_age_days else None
+
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._writes_since_evict = 0
+        self._stats = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " size INTEGER NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache (accessed_at)")
+        self.evict()
+
+    @classmethod
+    def from_config(cls, cache_config):
+        """根据 config.yaml 中的 cache 配置创建缓存；未启用时返回 None"""
+        if not cache_config or not cache_config.get('enabled', False):
+            return None
+        return cls(
+            cache_config.get('path', './cache/results_cache.sqlite'),
+            max_size_mb=cache_config.get('max_size_mb'),
+            max_age_days=cache_config.get('max_age_days'),
+        )
+
+    @staticmethod
+    def make_key(*parts):
+        """把任意可JSON序列化的内容哈希成缓存键"""
+        raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def stats(self, namespace):
+        with self._lock:
+            return self._stats.setdefault(namespace, CacheStats())
+
+    def get(self, namespace, key, stats=None):
+        """读取缓存；stats 为调用方自己的 CacheStats，用于统计单次运行的命中情况"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM cache WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if row and self.max_age_seconds and now - row[1] > self.max_age_seconds:
+                self._conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+                row = None
+            if row:
+                self._conn.execute(
+                    "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?", (now, namespace, key)
+                )
+        hit = row is not None
+        self.stats(namespace).record(hit)
+        if stats is not None:
+            stats.record(hit)
+        return json.loads(row[0]) if hit else None
+
+    def set(self, namespace, key, value):
+        data = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, data, len(data.encode('utf-8')), now, now),
+            )
+            self._writes_since_evict += 1
+            should_evict = self._writes_since_evict >= self.EVICT_EVERY_N_WRITES
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """按时长与总大小淘汰过期/最久未访问的条目"""
+        with self._lock:
+            self._writes_since_evict = 0
+            if self.max_age_seconds:
+                self._conn.execute("DELETE FROM cache WHERE created_at < ?", (time.time() - self.max_age_seconds,))
+            if self.max_size_bytes:
+                total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+                if total > self.max_size_bytes:
+                    excess = total - self.max_size_bytes
+                    freed = 0
+                    stale_keys = []
+                    for namespace, key, size in self._conn.execute(
+                        "SELECT namespace, key, size FROM cache ORDER BY accessed_at ASC"
+                    ):
+                        stale_keys.append((namespace, key))
+                        freed += size
+                        if freed >= excess:
+                            break
+                    self._conn.executemany("DELETE FROM cache WHERE namespace = ? AND key = ?", stale_keys)
+
+    def summary(self):
+        """返回各命名空间的命中统计文字描述"""
+        with self._lock:
+            items = list(self._stats.items())
+        return "; ".join(f"{namespace}: {stats}" for namespace, stats in items) or "无缓存访问"
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
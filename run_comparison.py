@@ -0,0 +1,361 @@
+# run_comparison.py
+# 跨运行的增量对比：
+# - PreviousRun 按题目ID索引上次运行的 evaluation_details.jsonl，题目输入（问题、答案、理想答案、评估要点）
+#   与评估标准都未变化时直接复用上次的裁判结论，只有发生变化的题目才重新评估
+# - compare_runs 按题目ID配对两次运行的评分，计算各维度、各场景的均值变化，并用配对 bootstrap 给出置信区间与显著性；
+#   与报告统计一样，题目较少时（不超过 report.pandas_min_rows）只用标准库计算，不导入 pandas/numpy
+
+import os
+import json
+import math
+import random
+import hashlib
+import logging
+from pipeline import score_columns_of
+from run_store import read_jsonl_tolerant, load_run_meta, RUN_META_FILE
+from report_generator import iter_details, OVERALL_KEY, DEFAULT_PANDAS_MIN_ROWS
+
+logger = logging.getLogger(__name__)
+
+COMPARISON_FILE = "comparison.json"
+
+# 这些字段中任一发生变化，上次的裁判结论就不能复用
+VERDICT_INPUT_FIELDS = ('scenario', 'sub_scenario', 'prompt', 'answer', 'ideal_output', 'notes_for_evaluation')
+
+# 对比配置的默认值，可被 config.yaml 中的 comparison 覆盖
+DEFAULT_COMPARISON_CONFIG = {
+    'previous_run_dir': '',
+    'reuse_verdicts': True,
+    'bootstrap_samples': 2000,
+    'confidence': 0.95,
+    'seed': 0,
+}
+
+# 这些运行参数（题库、分片、评估角色）都与本次一致的运行才能作为 "latest" 的对比对象
+RUN_IDENTITY_FIELDS = ('question_bank', 'shard', 'prompt_persona')
+
+# 评分列之外的列
+_KEY_COLUMNS = ('id', 'scenario', 'reused')
+
+# 单次 bootstrap 重采样矩阵的元素数上限，控制内存占用（numpy/pandas 只在真正对比时导入，查找与复用上次结论不需要它们）
+_BOOTSTRAP_CHUNK_ELEMENTS = 2_000_000
+
+# 标准库 bootstrap 逐个抽样，开销随 题目数 × bootstrap_samples 增长；超过该值时即使题目数未到 pandas_min_rows 也改用 numpy
+_STDLIB_BOOTSTRAP_DRAWS = 1_000_000
+
+
+def _input_digest(record):
+    raw = json.dumps([str(record.get(field) or '') for field in VERDICT_INPUT_FIELDS], ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _is_finished(record):
+    return record.get('reason') != 'Evaluation failed' and record.get('strengths') != 'Error'
+
+
+def _run_identity(meta):
+    """运行的题库（规范化为绝对路径）、分片与评估角色"""
+    identity = {field: meta.get(field) for field in RUN_IDENTITY_FIELDS}
+    if identity['question_bank']:
+        identity['question_bank'] = os.path.abspath(identity['question_bank'])
+    identity['shard'] = list(identity['shard']) if identity['shard'] else None
+    return identity
+
+
+def resolve_previous_run(comparison_config, results_dir, model_name, current_dir=None):
+    """
+    解析要对比的上次运行目录：previous_run_dir 为具体目录时直接使用（被评估模型须一致），
+    为 "latest" 时在 results_dir 中查找同一模型、同一题库、分片与评估角色（取自 current_dir 的 run_meta.json）
+    最近一次完成的运行。找不到时返回 None。
+    """
+    previous_run_dir = (comparison_config or {}).get('previous_run_dir')
+    if not previous_run_dir:
+        return None
+    current_identity = None
+    if current_dir and os.path.exists(os.path.join(current_dir, RUN_META_FILE)):
+        current_identity = _run_identity(load_run_meta(current_dir))
+    if previous_run_dir != 'latest':
+        try:
+            meta = load_run_meta(previous_run_dir)
+        except FileNotFoundError as e:
+            logger.warning(f"无法读取对比的上次运行: {e}")
+            return None
+        if meta.get('model_config', {}).get('model_name') != model_name:
+            logger.info(f"上次运行 {previous_run_dir} 评估的不是模型 {model_name}，跳过对比。")
+            return None
+        if current_identity and _run_identity(meta) != current_identity:
+            logger.warning(f"上次运行 {previous_run_dir} 的题库、分片或评估角色与本次不同，对比结果仅供参考。")
+        return previous_run_dir
+
+    candidates = []
+    for name in os.listdir(results_dir) if os.path.isdir(results_dir) else []:
+        run_dir = os.path.join(results_dir, name)
+        if os.path.abspath(run_dir) == os.path.abspath(current_dir or '') or not os.path.exists(os.path.join(run_dir, RUN_META_FILE)):
+            continue
+        meta = load_run_meta(run_dir)
+        if meta.get('status') != 'completed' or meta.get('model_config', {}).get('model_name') != model_name:
+            continue
+        if current_identity and _run_identity(meta) != current_identity:
+            continue
+        candidates.append((meta.get('finished_at') or '', run_dir))
+    return max(candidates)[1] if candidates else None
+
+
+class PreviousRun:
+    """上次运行的裁判结论索引；只保留输入摘要与结论，不在内存中保留问题与答案原文"""
+
+    def __init__(self, run_dir):
+        self.run_dir = run_dir
+        self.name = os.path.basename(os.path.normpath(run_dir))
+        self.meta = load_run_meta(run_dir)
+        self.details_path = os.path.join(run_dir, "evaluation_details.jsonl")
+        self._verdicts = {}
+        for record in read_jsonl_tolerant(self.details_path):
+            scores = {col: record[col] for col in score_columns_of(record)}
+            if not scores or not _is_finished(record):
+                continue
+            verdict = {
+                'scores': scores,
+                'reason': record.get('reason'),
+                'strengths': record.get('strengths'),
+                'weaknesses': record.get('weaknesses'),
+                'reused_from': self.name,
+            }
+            if record.get('score_spread'):
+                verdict['score_spread'] = record['score_spread']
+            self._verdicts[str(record.get('id'))] = (_input_digest(record), verdict)
+        self.reused = 0
+
+    def __len__(self):
+        return len(self._verdicts)
+
+    def rubric_matches(self, fingerprint):
+        """评估标准（裁判模型、模板与评估方式）与本次一致时才能复用结论"""
+        return self.meta.get('rubric_sha256') == fingerprint
+
+    def reusable_verdict(self, task_item):
+        """题目输入与上次完全一致时返回上次的裁判结论，否则返回 None"""
+        entry = self._verdicts.get(str(task_item.get('id')))
+        if entry is None or entry[0] != _input_digest(task_item):
+            return None
+        self.reused += 1
+        verdict = entry[1]
+        return {**verdict, 'scores': dict(verdict['scores'])}
+
+
+def _is_number(value):
+    return value is not None and value == value
+
+
+def _quantile(sorted_values, q):
+    """线性插值分位数，与 numpy.quantile 的默认方法一致"""
+    position = (len(sorted_values) - 1) * q
+    lower = math.floor(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def _load_score_rows(details_path, max_rows=None):
+    """
+    标准库版本的 _load_scores：返回 {id: row}（同一ID保留最后一条，顺序与 pandas 版本一致）与评分列。
+    题目数超过 max_rows 时返回 None，由调用方改用 pandas。
+    """
+    rows = {}
+    score_columns = {}
+    count = 0
+    for record in iter_details(details_path):
+        count += 1
+        if max_rows is not None and count > max_rows:
+            return None
+        if not _is_finished(record):
+            continue
+        scores = {col: record[col] for col in score_columns_of(record)}
+        for col in scores:
+            score_columns.setdefault(col, None)
+        item_id = str(record.get('id'))
+        rows.pop(item_id, None)
+        rows[item_id] = {'scenario': record.get('scenario'), 'reused': bool(record.get('reused_from')), 'scores': scores}
+    return rows, list(score_columns)
+
+
+def _load_scores(details_path):
+    """读取 id、场景与评分列，返回使用 float32 的紧凑DataFrame"""
+    import numpy as np
+    import pandas as pd
+
+    rows = []
+    for record in iter_details(details_path):
+        if not _is_finished(record):
+            continue
+        row = {col: record[col] for col in score_columns_of(record)}
+        row['id'] = str(record.get('id'))
+        row['scenario'] = record.get('scenario')
+        row['reused'] = bool(record.get('reused_from'))
+        rows.append(row)
+    df = pd.DataFrame(rows)
+    if df.empty:
+        return df
+    score_columns = [col for col in df.columns if col not in _KEY_COLUMNS]
+    return df.astype({col: np.float32 for col in score_columns}).drop_duplicates('id', keep='last')
+
+
+def paired_bootstrap(diffs, samples=2000, confidence=0.95, rng=None):
+    """
+    对配对差值做 bootstrap 重采样，返回 (置信区间下限, 上限, 双侧p值)。
+    重采样矩阵按块生成，题目较多时内存占用不会随 samples 线性增长。
+    """
+    import numpy as np
+
+    rng = rng or np.random.default_rng()
+    n = len(diffs)
+    means = np.empty(samples, dtype=np.float64)
+    chunk = max(1, min(samples, _BOOTSTRAP_CHUNK_ELEMENTS // max(n, 1)))
+    for start in range(0, samples, chunk):
+        size = min(chunk, samples - start)
+        means[start:start + size] = diffs[rng.integers(0, n, size=(size, n))].mean(axis=1)
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(means, [alpha, 1 - alpha])
+    p_value = min(1.0, 2 * min((means <= 0).mean(), (means >= 0).mean()))
+    return float(low), float(high), float(p_value)
+
+
+def _paired_bootstrap_stdlib(diffs, samples, confidence, rng):
+    """标准库版本的 paired_bootstrap，diffs 为列表，rng 为 random.Random"""
+    n = len(diffs)
+    means = sorted(sum(rng.choices(diffs, k=n)) / n for _ in range(samples))
+    alpha = (1 - confidence) / 2
+    p_value = min(1.0, 2 * min(sum(1 for mean in means if mean <= 0), sum(1 for mean in means if mean >= 0)) / samples)
+    return _quantile(means, alpha), _quantile(means, 1 - alpha), p_value
+
+
+def _compare_rows(previous, current, samples, confidence, seed):
+    """标准库版本的配对对比，previous 与 current 为 _load_score_rows 的结果"""
+    (previous_rows, previous_columns), (current_rows, current_columns) = previous, current
+    if not previous_rows or not current_rows:
+        return None
+    paired = [(row, previous_rows[item_id]) for item_id, row in current_rows.items() if item_id in previous_rows]
+    dims = [col for col in current_columns if col in previous_columns]
+    if not paired or not dims:
+        return None
+
+    rng = random.Random(seed)
+
+    def dimension_deltas(group):
+        deltas = {}
+        for dim in dims:
+            pairs = [(row['scores'].get(dim), previous_row['scores'].get(dim)) for row, previous_row in group]
+            pairs = [(float(now), float(before)) for now, before in pairs if _is_number(now) and _is_number(before)]
+            if not pairs:
+                continue
+            diffs = [now - before for now, before in pairs]
+            low, high, p_value = _paired_bootstrap_stdlib(diffs, samples, confidence, rng)
+            deltas[dim] = {
+                'count': len(diffs),
+                'previous': sum(before for _, before in pairs) / len(pairs),
+                'current': sum(now for now, _ in pairs) / len(pairs),
+                'delta': sum(diffs) / len(diffs),
+                'ci_low': low,
+                'ci_high': high,
+                'p_value': p_value,
+                'significant': not (low <= 0 <= high),
+            }
+        return deltas
+
+    scenarios = {OVERALL_KEY: dimension_deltas(paired)}
+    groups = {}
+    for row, previous_row in paired:
+        # 与 pandas groupby 一致：没有场景的题目只计入整体
+        if row['scenario'] is not None:
+            groups.setdefault(row['scenario'], []).append((row, previous_row))
+    for scenario, group in groups.items():
+        scenarios[scenario] = dimension_deltas(group)
+    return {
+        'paired_items': len(paired),
+        'reused_items': sum(1 for row in current_rows.values() if row['reused']),
+        'new_items': sum(1 for item_id in current_rows if item_id not in previous_rows),
+        'removed_items': sum(1 for item_id in previous_rows if item_id not in current_rows),
+        'scenarios': scenarios,
+    }
+
+
+def _compare_frames(previous, current, samples, confidence, seed):
+    """pandas/numpy 版本的配对对比，previous 与 current 为 _load_scores 的结果"""
+    import numpy as np
+
+    if previous.empty or current.empty:
+        return None
+    paired = current.merge(previous.drop(columns=['scenario', 'reused']), on='id', suffixes=('', '__previous'))
+    dims = [col for col in current.columns if col not in _KEY_COLUMNS and f"{col}__previous" in paired]
+    if paired.empty or not dims:
+        return None
+
+    rng = np.random.default_rng(seed)
+
+    def dimension_deltas(group):
+        deltas = {}
+        for dim in dims:
+            pair = group[[dim, f"{dim}__previous"]].dropna()
+            if pair.empty:
+                continue
+            diffs = (pair[dim] - pair[f"{dim}__previous"]).to_numpy(dtype=np.float64)
+            low, high, p_value = paired_bootstrap(diffs, samples, confidence, rng)
+            deltas[dim] = {
+                'count': len(diffs),
+                'previous': float(pair[f"{dim}__previous"].mean()),
+                'current': float(pair[dim].mean()),
+                'delta': float(diffs.mean()),
+                'ci_low': low,
+                'ci_high': high,
+                'p_value': p_value,
+                'significant': not (low <= 0 <= high),
+            }
+        return deltas
+
+    scenarios = {OVERALL_KEY: dimension_deltas(paired)}
+    for scenario, group in paired.groupby('scenario', sort=False):
+        scenarios[scenario] = dimension_deltas(group)
+    return {
+        'paired_items': len(paired),
+        'reused_items': int(current['reused'].sum()),
+        'new_items': int((~current['id'].isin(previous['id'])).sum()),
+        'removed_items': int((~previous['id'].isin(current['id'])).sum()),
+        'scenarios': scenarios,
+    }
+
+
+def compare_runs(previous_details_path, current_details_path, comparison_config=None, previous_name=None,
+                 pandas_min_rows=DEFAULT_PANDAS_MIN_ROWS):
+    """
+    按题目ID配对两次运行的评分，返回各维度（整体与分场景）的均值、变化量、bootstrap 置信区间与显著性。
+    两次运行的题目数都不超过 pandas_min_rows（且 bootstrap 抽样量不大）时用标准库计算，否则用 pandas/numpy。
+    没有可配对的题目时返回 None。
+    """
+    comparison_config = {**DEFAULT_COMPARISON_CONFIG, **(comparison_config or {})}
+    samples, confidence, seed = int(comparison_config['bootstrap_samples']), comparison_config['confidence'], comparison_config['seed']
+
+    max_rows = min(pandas_min_rows, _STDLIB_BOOTSTRAP_DRAWS // max(samples, 1))
+    previous = _load_score_rows(previous_details_path, max_rows)
+    current = _load_score_rows(current_details_path, max_rows) if previous is not None else None
+    if previous is not None and current is not None:
+        result = _compare_rows(previous, current, samples, confidence, seed)
+    else:
+        result = _compare_frames(_load_scores(previous_details_path), _load_scores(current_details_path), samples, confidence, seed)
+    if result is None:
+        return None
+    return {
+        'previous_run': previous_name or os.path.basename(os.path.dirname(os.path.abspath(previous_details_path))),
+        'paired_items': result['paired_items'],
+        'reused_items': result['reused_items'],
+        'new_items': result['new_items'],
+        'removed_items': result['removed_items'],
+        'confidence': confidence,
+        'bootstrap_samples': samples,
+        'scenarios': result['scenarios'],
+    }
+
+
+def write_comparison(run_dir, comparison):
+    path = os.path.join(run_dir, COMPARISON_FILE)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(comparison, f, ensure_ascii=False, indent=2)
+    return path
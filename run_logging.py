@@ -0,0 +1,106 @@
+# run_logging.py
+# 日志与请求追踪：
+# - setup_logging 配置分级日志，经由 tqdm.write 输出，不会打乱进度条
+# - TraceWriter 把每次请求的完整 prompt 与响应写入运行目录下 gzip 压缩的 JSONL 文件；
+#   写盘在后台线程中进行，工作线程只负责入队，不会阻塞在磁盘I/O上
+
+import os
+import gzip
+import json
+import time
+import queue
+import logging
+import threading
+
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
+TRACE_FILE = "trace.jsonl.gz"
+
+# 这些第三方库在 INFO 级别会为每个HTTP请求输出一行日志
+_NOISY_LOGGERS = ('httpx', 'httpcore', 'openai', 'urllib3')
+
+_STOP = object()
+
+
+class TqdmLoggingHandler(logging.Handler):
+    """通过 tqdm.write 输出日志，使日志行显示在进度条上方而不是把进度条打断"""
+
+    def emit(self, record):
+        try:
+            # 在第一条日志输出时才导入 tqdm，导入本模块不会加载它
+            from tqdm import tqdm
+
+            tqdm.write(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+def setup_logging(level="INFO", log_file=None):
+    """配置根日志器；log_file 不为空时同时写入该文件"""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+
+    formatter = logging.Formatter(LOG_FORMAT, datefmt="%H:%M:%S")
+    console = TqdmLoggingHandler()
+    console.setFormatter(formatter)
+    root.addHandler(console)
+    if log_file:
+        file_handler = logging.FileHandler(log_file, encoding='utf-8')
+        file_handler.setFormatter(formatter)
+        root.addHandler(file_handler)
+
+    for name in _NOISY_LOGGERS:
+        logging.getLogger(name).setLevel(max(root.level, logging.WARNING))
+
+
+def new_trace_path(output_dir):
+    """
+    返回运行目录下尚未使用的追踪文件路径：首次运行为 trace.jsonl.gz，之后每次恢复依次为 trace.1.jsonl.gz、trace.2.jsonl.gz ……
+    进程崩溃时旧文件末尾可能是截断的 gzip 成员，接着追加会使整个文件无法读取，因此每次恢复都写入新文件。
+    """
+    path = os.path.join(output_dir, TRACE_FILE)
+    stem, suffix = TRACE_FILE.split('.', 1)
+    attempt = 0
+    while os.path.exists(path):
+        attempt += 1
+        path = os.path.join(output_dir, f"{stem}.{attempt}.{suffix}")
+    return path
+
+
+class TraceWriter:
+    """
+    后台线程写入的请求追踪文件。
+    write() 只把记录放入队列并立即返回；总是新建文件写入，路径由调用方给出（运行目录中用 new_trace_path 取得）。
+    """
+
+    def __init__(self, path, flush_interval=5.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, kind, **fields):
+        self._queue.put({'ts': round(time.time(), 3), 'kind': kind, **fields})
+
+    def _run(self):
+        with gzip.open(self.path, 'wt', encoding='utf-8') as f:
+            last_flush = time.monotonic()
+            while True:
+                try:
+                    record = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    record = None
+                if record is _STOP:
+                    break
+                if record is not None:
+                    f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+                if time.monotonic() - last_flush >= self.flush_interval:
+                    f.flush()
+                    last_flush = time.monotonic()
+
+    def close(self):
+        """写完队列中剩余的记录后关闭文件"""
+        self._queue.put(_STOP)
+        self._thread.join()
@@ -0,0 +1,200 @@
+# run_metrics.py
+# 运行级指标：各阶段耗时、单次请求延迟分布、裁判token用量、重试次数与缓存命中。
+# 评估结束后写入运行目录下的 metrics.json，可选同时输出 Prometheus 文本格式的 metrics.prom，
+# 用于跨版本追踪吞吐与成本的变化。所有方法线程安全，可在生成线程、评估事件循环与主线程中同时调用。
+# 恢复运行时保留之前各次尝试的指标（previous_attempts），并给出所有尝试的累计值（totals）。
+
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from array import array
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+METRICS_FILE = "metrics.json"
+PROMETHEUS_FILE = "metrics.prom"
+
+# Prometheus 直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _load_previous_metrics(path):
+    """读取之前一次尝试写下的 metrics.json；不存在或无法解析时返回 None"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"无法读取之前的运行指标 {path}，本次不合并: {e}")
+        return None
+
+
+def _sum_attempts(attempts):
+    """累计各次尝试的总耗时、各阶段耗时与计数器（延迟分位数无法跨尝试合并，只保留在各次尝试中）"""
+    stages, counters = {}, {}
+    for attempt in attempts:
+        for name, seconds in attempt.get('stages_seconds', {}).items():
+            stages[name] = round(stages.get(name, 0.0) + seconds, 3)
+        for name, value in attempt.get('counters', {}).items():
+            counters[name] = counters.get(name, 0) + value
+    return {
+        'attempts': len(attempts),
+        'wall_seconds': round(sum(attempt.get('wall_seconds', 0.0) for attempt in attempts), 3),
+        'stages_seconds': stages,
+        'counters': counters,
+    }
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+class LatencyHistogram:
+    """保留全部样本（每个8字节）以便给出精确分位数，导出 Prometheus 时再按桶计数"""
+
+    def __init__(self):
+        self.samples = array('d')
+
+    def observe(self, seconds):
+        self.samples.append(seconds)
+
+    def as_dict(self):
+        values = sorted(self.samples)
+        if not values:
+            return {'count': 0}
+        return {
+            'count': len(values),
+            'sum': round(sum(values), 4),
+            'mean': round(sum(values) / len(values), 4),
+            'min': round(values[0], 4),
+            'p50': round(_percentile(values, 0.5), 4),
+            'p90': round(_percentile(values, 0.9), 4),
+            'p99': round(_percentile(values, 0.99), 4),
+            'max': round(values[-1], 4),
+        }
+
+    def bucket_counts(self):
+        """返回 [(上限, 累计计数)]，最后一项为 +Inf"""
+        values = sorted(self.samples)
+        counts = [(bound, bisect.bisect_right(values, bound)) for bound in LATENCY_BUCKETS]
+        counts.append(('+Inf', len(values)))
+        return counts
+
+
+class RunMetrics:
+    def __init__(self, labels=None):
+        self.labels = dict(labels or {})
+        self.stages = {}
+        self.histograms = {}
+        self.counters = {}
+        self.extra = {}
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+
+    @contextmanager
+    def stage(self, name):
+        """统计一个阶段的耗时；同名阶段多次进入时累加"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record_stage(name, time.monotonic() - started)
+
+    def record_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record_usage(self, kind, usage):
+        """累计 OpenAI 兼容响应中的 usage（prompt/completion token 数），usage 可以是SDK对象或字典"""
+        if usage is None:
+            return
+        if isinstance(usage, dict):
+            prompt_tokens, completion_tokens = usage.get('prompt_tokens'), usage.get('completion_tokens')
+        else:
+            prompt_tokens, completion_tokens = getattr(usage, 'prompt_tokens', None), getattr(usage, 'completion_tokens', None)
+        self.incr(f"{kind}_prompt_tokens", prompt_tokens or 0)
+        self.incr(f"{kind}_completion_tokens", completion_tokens or 0)
+
+    def set(self, name, value):
+        """记录其他需要原样写入 metrics.json 的数据，如缓存统计"""
+        with self._lock:
+            self.extra[name] = value
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'labels': self.labels,
+                'wall_seconds': round(time.monotonic() - self._started, 3),
+                'stages_seconds': {name: round(seconds, 3) for name, seconds in self.stages.items()},
+                'latency_seconds': {name: histogram.as_dict() for name, histogram in self.histograms.items()},
+                'counters': dict(self.counters),
+                **self.extra,
+            }
+
+    def to_prometheus(self, prefix="llm_eval"):
+        """导出为 Prometheus 文本格式（可交给 node_exporter 的 textfile collector 或 Pushgateway）"""
+        base_labels = ",".join(f'{key}="{value}"' for key, value in self.labels.items())
+
+        def labels(**extra):
+            parts = [base_labels] if base_labels else []
+            parts += [f'{key}="{value}"' for key, value in extra.items()]
+            return "{" + ",".join(parts) + "}"
+
+        lines = [f"# TYPE {prefix}_stage_seconds gauge"]
+        with self._lock:
+            for name, seconds in self.stages.items():
+                lines.append(f"{prefix}_stage_seconds{labels(stage=name)} {seconds:.6f}")
+            lines.append(f"# TYPE {prefix}_request_latency_seconds histogram")
+            for name, histogram in self.histograms.items():
+                for bound, count in histogram.bucket_counts():
+                    lines.append(f"{prefix}_request_latency_seconds_bucket{labels(kind=name, le=bound)} {count}")
+                lines.append(f"{prefix}_request_latency_seconds_sum{labels(kind=name)} {sum(histogram.samples):.6f}")
+                lines.append(f"{prefix}_request_latency_seconds_count{labels(kind=name)} {len(histogram.samples)}")
+            for name, value in self.counters.items():
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                lines.append(f"{prefix}_{name}_total{labels()} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, run_dir, prometheus=False, resume=False):
+        """
+        写入 metrics.json（以及可选的 metrics.prom），返回 metrics.json 的路径。
+        顶层字段为本次尝试的指标；resume 为 True 时，已有 metrics.json 中的各次尝试保存在 previous_attempts 中，
+        totals 给出包括本次在内所有尝试的累计值。metrics.prom 只包含本次尝试。
+        """
+        path = os.path.join(run_dir, METRICS_FILE)
+        data = self.as_dict()
+        previous = _load_previous_metrics(path) if resume else None
+        if previous is not None:
+            attempts = previous.pop('previous_attempts', [])
+            previous.pop('totals', None)
+            attempts.append(previous)
+            data['previous_attempts'] = attempts
+            data['totals'] = _sum_attempts(attempts + [data])
+        # 先写临时文件再替换，写到一半中断时不会留下无法解析的 metrics.json
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        if prometheus:
+            with open(os.path.join(run_dir, PROMETHEUS_FILE), 'w', encoding='utf-8') as f:
+                f.write(self.to_prometheus())
+        return path
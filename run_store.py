@@ -0,0 +1,143 @@
+# run_store.py
+# 运行目录中结果文件的读写：逐条追加并立即刷盘，支持在进程中断后读取部分结果继续运行
+
+import os
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+RUN_META_FILE = "run_meta.json"
+
+
+def _ends_with_newline(path):
+    """文件为空或以换行结尾时返回 True"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+class JsonlAppender:
+    """线程安全的JSONL追加写入器，每写一条都会立即flush，进程崩溃时已完成的结果不会丢失"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+        if not _ends_with_newline(path):
+            # 上次中断时最后一行可能只写了一半：先补一个换行，新记录从新的一行开始，不会与半行拼接后一起被丢弃
+            self._file.write('\n')
+            self._file.flush()
+
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def iter_jsonl_tolerant(path):
+    """
+    逐行读取可能被中断写入的JSONL文件。
+    跳过无法解析的行（通常是崩溃时写了一半的最后一行）；文件不存在时不产出任何记录。
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"跳过 {os.path.basename(path)} 中无法解析的行（可能是中断时未写完）。")
+
+
+def read_jsonl_tolerant(path):
+    """读取可能被中断写入的JSONL文件，返回记录列表；文件不存在时返回空列表"""
+    return list(iter_jsonl_tolerant(path))
+
+
+def index_by_id(records):
+    """按题目ID建立索引；同一ID出现多次时保留最后一条"""
+    return {str(record.get('id')): record for record in records}
+
+
+def rewrite_jsonl_atomic(path, records):
+    """先写临时文件再原子替换，避免整理结果时中断导致文件损坏"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    os.replace(tmp_path, path)
+
+
+def rewrite_jsonl_in_order(path, ordered_ids):
+    """
+    按 ordered_ids（如题库中的题目顺序）流式整理结果文件：同一ID只保留最后一条，
+    ordered_ids 中没有的记录按原顺序附在末尾，无法解析的行被丢弃。
+    内存中只保留 {题目ID: 行偏移} 索引，记录内容逐行从原文件复制；先写临时文件再原子替换。
+    """
+    if not os.path.exists(path):
+        return
+    offsets = {}
+    with open(path, 'rb') as f:
+        offset = 0
+        for line in f:
+            if line.strip():
+                try:
+                    key = str(json.loads(line).get('id'))
+                except ValueError:
+                    logger.warning(f"跳过 {os.path.basename(path)} 中无法解析的行（可能是中断时未写完）。")
+                else:
+                    offsets.pop(key, None)
+                    offsets[key] = offset
+            offset += len(line)
+
+    tmp_path = path + '.tmp'
+    with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+        def copy_line(offset):
+            src.seek(offset)
+            line = src.readline()
+            dst.write(line if line.endswith(b'\n') else line + b'\n')
+
+        for key in ordered_ids:
+            offset = offsets.pop(key, None)
+            if offset is not None:
+                copy_line(offset)
+        for offset in offsets.values():
+            copy_line(offset)
+    os.replace(tmp_path, path)
+
+
+def write_run_meta(run_dir, meta):
+    meta_path = os.path.join(run_dir, RUN_META_FILE)
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, meta_path)
+
+
+def load_run_meta(run_dir):
+    meta_path = os.path.join(run_dir, RUN_META_FILE)
+    if not os.path.exists(meta_path):
+        raise FileNotFoundError(f"运行目录 {run_dir} 中缺少 {RUN_META_FILE}，无法恢复。")
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def update_run_meta(run_dir, **fields):
+    """在 run_meta.json 中更新部分字段"""
+    meta = load_run_meta(run_dir)
+    meta.update(fields)
+    write_run_meta(run_dir, meta)
+    return meta
@@ -0,0 +1,77 @@
+# scheduler.py
+# 多模型并发调度：同时评估多个Ollama模型，并限制每台Ollama主机(base_url)上同时运行的模型数
+
+import queue
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def host_of(model_config):
+    """以规范化后的 base_url 作为主机标识"""
+    return model_config.get('base_url', 'http://localhost:11434').strip().rstrip('/')
+
+
+class ModelScheduler:
+    """
+    按配置顺序调度模型评估任务。
+    - max_concurrent_models: 全局同时运行的模型数上限
+    - max_models_per_host: 同一个 base_url 上同时处于加载/生成阶段的模型数上限，避免单台Ollama主机超载
+    某个主机已满时，调度器会跳过它的模型，优先启动其他主机上的模型。
+    """
+
+    def __init__(self, max_concurrent_models=1, max_models_per_host=1):
+        self.max_concurrent_models = max(1, int(max_concurrent_models))
+        self.max_models_per_host = max(1, int(max_models_per_host))
+
+    def run(self, model_configs, run_fn):
+        """
+        对每个模型配置调用 run_fn(model_config, release_host)。单个模型失败不会中断其他模型。
+        run_fn 可以在生成结束（模型已从Ollama卸载）后调用 release_host() 提前让出主机：同一主机上的下一个模型随即开始加载与生成，
+        与当前模型的评估、总结阶段重叠进行；未调用时在 run_fn 返回后释放。
+        返回 {model_name: 异常} 形式的失败列表。
+        """
+        pending = list(enumerate(model_configs))
+        running = {}
+        holding = set()
+        host_load = defaultdict(int)
+        failures = {}
+        # 主机占用只在调度线程中修改；工作线程通过事件队列通知“让出主机”与“任务结束”
+        events = queue.SimpleQueue()
+
+        def release_host_of(index, host):
+            if index in holding:
+                holding.discard(index)
+                host_load[host] -= 1
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_models) as executor:
+            while pending or running:
+                for index, model_config in list(pending):
+                    if len(running) >= self.max_concurrent_models:
+                        break
+                    host = host_of(model_config)
+                    if host_load[host] >= self.max_models_per_host:
+                        continue
+                    pending.remove((index, model_config))
+                    host_load[host] += 1
+                    holding.add(index)
+                    release = lambda index=index, host=host: events.put(('release', (index, host)))
+                    future = executor.submit(run_fn, model_config, release)
+                    running[future] = (index, model_config, host)
+                    future.add_done_callback(lambda f: events.put(('done', f)))
+
+                kind, item = events.get()
+                if kind == 'release':
+                    release_host_of(*item)
+                    continue
+                index, model_config, host = running.pop(item)
+                release_host_of(index, host)
+                try:
+                    item.result()
+                except Exception as e:
+                    logger.error(f"模型 {model_config['model_name']} 评估失败: {e}", exc_info=True)
+                    failures[model_config['model_name']] = e
+
+        return failures